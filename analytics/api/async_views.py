@@ -0,0 +1,84 @@
+"""
+Async (ASGI) entry points for the AnalyticsViewSet GET actions.
+
+Each async view runs its viewset action in a worker thread with its own
+database connection (sync_to_async(thread_sensitive=False)), so one ASGI
+worker serves many slow aggregations at once. Django's async ORM methods
+all go through the single thread-sensitive executor, so awaiting several
+of them together would still run the queries one after another.
+dashboard() gathers top, blog_views and performance concurrently; its
+latency is that of the slowest of them rather than their sum.
+"""
+import asyncio
+import copy
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+from rest_framework.exceptions import NotAcceptable
+
+from .renderers import negotiate
+from .views import DASHBOARD_ACTIONS, AnalyticsViewSet, row_fields
+
+STREAM_BATCH = 100
+
+_views = {
+    name: AnalyticsViewSet.as_view({'get': name})
+    for name in ('blog_views', 'top', 'performance')
+}
+
+
+def _call(name, request):
+    try:
+        return _views[name](request)
+    finally:
+        # Worker threads outlive the request, so apply CONN_MAX_AGE here
+        close_old_connections()
+
+
+async def _run(name, request):
+    """Run a viewset action in its own thread; returns the (unrendered) DRF response."""
+    return await sync_to_async(_call, thread_sensitive=False)(name, copy.copy(request))
+
+
+async def _aiterate(iterator):
+    # thread_sensitive keeps every batch, and so the server-side cursor, on the request's thread
+    while chunks := await sync_to_async(lambda: list(islice(iterator, STREAM_BATCH)))():
+        for chunk in chunks:
+            yield chunk
+
+
+def _action_view(name):
+    async def view(request):
+        response = await _run(name, request)
+        if response.streaming and not response.is_async and isinstance(request, ASGIRequest):
+            # Django would buffer a synchronous iterator before sending it over ASGI
+            response.streaming_content = _aiterate(iter(response.streaming_content))
+        return response
+    view.__name__ = name
+    return view
+
+
+blog_views = _action_view('blog_views')
+top = _action_view('top')
+performance = _action_view('performance')
+
+
+async def dashboard(request):
+    if 'stream' in request.GET:
+        return JsonResponse({'error': 'stream is not supported by the dashboard.'}, status=400)
+    try:
+        renderer, media_type = negotiate(request)
+    except NotAcceptable as exc:
+        return JsonResponse({'detail': str(exc.detail)}, status=exc.status_code)
+    responses = await asyncio.gather(*(_run(name, request) for name in DASHBOARD_ACTIONS))
+    for response in responses:
+        if response.status_code != 200:
+            return response
+    payload = {name: response.data for name, response in zip(DASHBOARD_ACTIONS, responses)}
+    response = HttpResponse(renderer.render(payload, media_type, {'row_fields': row_fields('dashboard')}),
+                            content_type=media_type)
+    response.data = payload  # like a DRF Response, for the instrumentation middleware's row count
+    return response
@@ -0,0 +1,284 @@
+"""
+Response cache for AnalyticsViewSet actions.
+
+Keys are built from the action, the normalized BlogViewFilter/action
+parameters, a time bucket and a generation counter:
+
+- windows with a rolling lower bound (range=day...) or an open upper bound
+  are bucketed by their endpoint TTL, so they are recomputed at most once per TTL;
+- fixed windows that ended before now - GRACE, including calendar ranges of
+  complete periods (range=last_N_...), are cached for CLOSED_TTL.
+
+Rows written through analytics.ingest (or saved one by one) with viewed_at
+before now - GRACE change already-closed windows, so they bump the
+generation and orphan every existing key.
+
+Concurrent misses of one key are coalesced: one request computes the
+response while the others wait for its entry, threads of a process on an
+Event and other workers on a lock entry in the cache. Each request also
+counts its normalized query in AnalyticsQuery, from which
+analytics.api.warming precomputes the popular keys before they are asked for.
+"""
+import atexit
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http.response import HttpResponseBase
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .. import periods, rollups
+from ..ingest import COLUMNS, views_written
+from ..models import AnalyticsQuery, BlogView
+from ..periods import TIME_RANGES
+from .filters import BlogViewFilter
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ALIAS': 'default',      # must be shared by all workers (Redis, files): generation bumps only reach its users
+    'TTL': {},               # per action, seconds
+    'DEFAULT_TTL': 60,
+    'RANGE_TTL': {},         # per rolling range, seconds; never below the action's TTL
+    'CLOSED_TTL': 86400,
+    'GRACE': 300,            # seconds after which a window end counts as closed
+    'LOCK_TIMEOUT': 30,      # seconds a miss waits for the request computing the same key
+    'COUNT_QUERIES': True,   # count normalized queries in AnalyticsQuery
+    'PERSIST_INTERVAL': 10.0,  # seconds between writes of the counts
+}
+GENERATION_KEY = 'analytics:generation'
+POLL_INTERVAL = 0.05
+# (names, rolling) of every cached action, for analytics.api.warming
+ACTIONS = {}
+
+
+def cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_CACHE', {})}
+
+def get_cache():
+    return caches[cache_settings()['ALIAS']]
+
+
+def is_shared():
+    """False when the cache lives in each process's memory, so workers see neither each other's entries nor bumps."""
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def generation(key=GENERATION_KEY):
+    return get_cache().get_or_set(key, 1, timeout=None)
+
+def bump_generation(key=GENERATION_KEY):
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+        return generation(key)
+
+
+def normalize(params, names):
+    """Sorted (name, value) pairs of the BlogViewFilter and action parameters `names` that are set."""
+    allowed = set(names) | set(BlogViewFilter.base_filters)
+    return sorted((name, params.get(name)) for name in allowed if params.get(name) not in (None, ''))
+
+
+def cache_key(action, params, names, rolling, at=None):
+    """
+    Return (key, ttl) for a request; `names` are the action-specific
+    parameters. `at` (a timestamp, default now) picks the time bucket.
+    """
+    conf = cache_settings()
+    at = time.time() if at is None else at
+    ttl = conf['TTL'].get(action, conf['DEFAULT_TTL'])
+    normalized = normalize(params, names)
+
+    time_range = params.get('range', 'month')
+    rolling = rolling and time_range in TIME_RANGES
+    if rolling:
+        ttl = max(ttl, conf['RANGE_TTL'].get(time_range, 0))
+    # Calendar ranges end at a period boundary in the current (request) time zone
+    now = datetime.fromtimestamp(at, tz=dt_timezone.utc)
+    calendar = periods.range_window(time_range, now) if periods.is_calendar(time_range) else (None, None)
+    _, end = rollups.window(params, *calendar)
+    closed = end is not None and end < now - timedelta(seconds=conf['GRACE'])
+    if closed and not rolling:
+        bucket, ttl = 'closed', conf['CLOSED_TTL']
+    else:
+        bucket = int(at // max(ttl, 1))
+
+    raw = f'{action}|{normalized}|{bucket}|{generation()}'
+    return f'analytics:{action}:{hashlib.sha1(raw.encode()).hexdigest()}', ttl
+
+
+class QueryCounter:
+    """Per-process counts of normalized queries, added to AnalyticsQuery every PERSIST_INTERVAL seconds."""
+    def __init__(self):
+        self._counts = Counter()
+        self._persisted_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._registered = False
+
+    def add(self, action, normalized):
+        with self._lock:
+            self._counts[action, json.dumps(normalized)] += 1
+            if not self._registered:
+                atexit.register(self.persist)
+                self._registered = True
+
+    def due(self):
+        return time.monotonic() - self._persisted_at >= cache_settings()['PERSIST_INTERVAL']
+
+    def persist(self):
+        """Add the counts so far to AnalyticsQuery; returns the rows touched."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._persisted_at = time.monotonic()
+        now = timezone.now()
+        for (action, normalized), hits in counts.items():
+            key = hashlib.sha1(f'{action}|{normalized}'.encode()).hexdigest()
+            seen = AnalyticsQuery.objects.filter(key=key)
+            try:
+                if not seen.update(hits=F('hits') + hits, last_seen=now):
+                    try:
+                        with transaction.atomic():
+                            AnalyticsQuery.objects.create(key=key, action=action, params=dict(json.loads(normalized)),
+                                                          hits=hits, last_seen=now)
+                    except IntegrityError:  # created by another worker meanwhile
+                        seen.update(hits=F('hits') + hits, last_seen=now)
+            except DatabaseError:
+                logger.exception("Dropped query counts of %s", action)
+        return len(counts)
+
+
+queries = QueryCounter()
+
+# Set by warming() while analytics.api.warming precomputes the entry of a time bucket
+_warming_at = contextvars.ContextVar('analytics_warming_at', default=None)
+_flights = {}  # key -> Event set once the thread computing it is done
+_flights_lock = threading.Lock()
+
+
+@contextmanager
+def warming(at):
+    """Make cached actions compute and store their entry for timestamp `at` instead of reading the cache."""
+    token = _warming_at.set(at)
+    try:
+        yield
+    finally:
+        _warming_at.reset(token)
+
+
+def _wait_for(cache, key, lock_key, timeout):
+    """The entry another worker is computing, or None once its lock is gone or `timeout` passed."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        data = cache.get(key)
+        if data is not None or cache.get(lock_key) is None:
+            return data
+    return None
+
+
+def _single_flight(cache, key, timeout, compute):
+    """
+    Cached data of `key` computed by whichever request got there first, or
+    compute()'s response. Followers that find no entry afterwards (the
+    response was not cacheable, or the leader failed) compute their own.
+    """
+    with _flights_lock:
+        event = _flights.get(key)
+        leader = event is None
+        if leader:
+            event = _flights[key] = threading.Event()
+    if not leader:
+        event.wait(timeout)
+        data = cache.get(key)
+        return compute() if data is None else data
+
+    lock_key = f'{key}:lock'
+    try:
+        if cache.add(lock_key, 1, timeout=timeout):
+            try:
+                return compute()
+            finally:
+                cache.delete(lock_key)
+        data = _wait_for(cache, key, lock_key, timeout)
+        return compute() if data is None else data
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        event.set()
+
+
+def cached_response(*names, rolling=True):
+    """
+    Cache successful responses of a viewset action. `names` are the query
+    parameters the action reads besides BlogViewFilter's; `rolling` says
+    whether it applies the rolling `range` window.
+    """
+    def decorator(view_func):
+        action = view_func.__name__
+        ACTIONS[action] = names, rolling
+
+        @functools.wraps(view_func)
+        def wrapper(viewset, request, *args, **kwargs):
+            conf = cache_settings()
+            at = _warming_at.get()
+            key, ttl = cache_key(action, request.query_params, names, rolling, at)
+            cache = get_cache()
+
+            def compute():
+                response = view_func(viewset, request, *args, **kwargs)
+                # Streaming responses are consumed once and never cached
+                if isinstance(response, Response) and response.status_code == 200:
+                    # A bucket warmed ahead of time lasts until that bucket ends
+                    cache.set(key, response.data, ttl + max(at - time.time(), 0) if at else ttl)
+                    response['X-Cache'] = 'MISS'
+                return response
+
+            if at is not None:
+                return compute()
+            if conf['COUNT_QUERIES']:
+                queries.add(action, normalize(request.query_params, names))
+                if queries.due():
+                    queries.persist()
+            data = cache.get(key)
+            if data is None:
+                data = _single_flight(cache, key, conf['LOCK_TIMEOUT'], compute)
+                if isinstance(data, HttpResponseBase):
+                    return data
+            return Response(data, headers={'X-Cache': 'HIT'})
+        return wrapper
+    return decorator
+
+
+def _is_late(viewed_at):
+    return viewed_at < timezone.now() - timedelta(seconds=cache_settings()['GRACE'])
+
+
+@receiver(views_written)
+def _bump_on_late_rows(sender, rows, columns=COLUMNS, **kwargs):
+    position = columns.index('viewed_at')
+    if any(_is_late(row[position]) for row in rows):
+        bump_generation()
+
+
+@receiver(post_save, sender=BlogView)
+def _bump_on_late_save(sender, instance, **kwargs):
+    if _is_late(instance.viewed_at):
+        bump_generation()
@@ -1,15 +1,48 @@
 import django_filters
+from ..ingest import country_codes
 from ..models import BlogView
 
 class BlogViewFilter(django_filters.FilterSet):
     viewed_at_gte = django_filters.IsoDateTimeFilter(field_name="viewed_at", lookup_expr='gte')
     viewed_at_lte = django_filters.IsoDateTimeFilter(field_name="viewed_at", lookup_expr='lte')
 
-    blog_author = django_filters.NumberFilter(field_name="blog__author_id")
-    blog_country = django_filters.CharFilter(field_name="blog__country__code")
-    viewer_country = django_filters.CharFilter(field_name="viewer_country__code")
+    # Denormalized columns, so none of these join Blog or Country
+    blog_author = django_filters.NumberFilter(field_name="blog_author_id")
+    blog_country = django_filters.CharFilter(field_name="blog_country_id", method="filter_country_code")
+    viewer_country = django_filters.CharFilter(field_name="viewer_country_id", method="filter_country_code")
     user = django_filters.NumberFilter(field_name="user_id")
 
     class Meta:
         model = BlogView
         fields = []
+
+    def filter_country_code(self, queryset, name, value):
+        """Resolve the country code from the in-process cache and filter on the id column."""
+        country_id = country_codes.resolve(value)
+        if country_id is None:
+            return queryset.none()
+        return queryset.filter(**{name: country_id})
+
+    def values(self):
+        """Validated, non-empty filter values; invalid ones are ignored like in .qs."""
+        self.errors
+        data = getattr(self.form, 'cleaned_data', {})
+        return {name: value for name, value in data.items() if value not in (None, '')}
+
+    def time_bounds(self):
+        """Validated (viewed_at_gte, viewed_at_lte); invalid values are ignored like in .qs."""
+        self.errors
+        data = getattr(self.form, 'cleaned_data', {})
+        return data.get('viewed_at_gte'), data.get('viewed_at_lte')
+
+
+class RollupFilter(BlogViewFilter):
+    """
+    BlogViewFilter for any table sharing BlogView's blog/user/viewer_country
+    relations. The viewed_at bounds are applied per tier by analytics.rollups.
+    """
+    viewed_at_gte = django_filters.IsoDateTimeFilter(method='skip')
+    viewed_at_lte = django_filters.IsoDateTimeFilter(method='skip')
+
+    def skip(self, queryset, name, value):
+        return queryset
@@ -0,0 +1,96 @@
+"""
+Response renderers of the analytics actions, negotiated through Accept (or ?format=).
+
+- application/json (json): orjson instead of the stdlib encoder, same output
+  as DRF's JSONRenderer including its date and Decimal formatting;
+- application/vnd.analytics.columns+json (columns): every list of rows as
+  one array per field, {"x": [...], "y": [...], "z": [...]}, which repeats
+  no keys and parses into typed arrays on the client;
+- application/msgpack (msgpack): MessagePack of the JSON document, offered
+  only when the msgpack package is installed.
+
+Responses are cached as data, so every format is rendered from the same
+cache entry.
+"""
+import orjson
+from rest_framework import renderers
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .streaming import FIELDS
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    # Dates, Decimals, lazy strings, NumPy scalars...: as DRF's JSONRenderer writes them
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = ORJSON_OPTIONS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
+
+
+def columns(data, fields=FIELDS):
+    """
+    Lists of row dicts as {field: [values]}, in dicts one level down too
+    (pages, dashboard, batch). `fields` names the columns of an empty list:
+    a sequence, or {key: sequence} for the lists of a dict such as the dashboard.
+    """
+    if isinstance(data, list):
+        if not all(isinstance(row, dict) for row in data):
+            return data
+        return {field: [row.get(field) for row in data] for field in (list(data[0]) if data else fields)}
+    if isinstance(data, dict):
+        return {
+            key: columns(value, fields.get(key, FIELDS) if isinstance(fields, dict) else fields)
+            if isinstance(value, list) else value
+            for key, value in data.items()
+        }
+    return data
+
+
+class ColumnarJSONRenderer(ORJSONRenderer):
+    """Columns of the row fields in renderer_context['row_fields'] (FIELDS by default)."""
+    media_type = 'application/vnd.analytics.columns+json'
+    format = 'columns'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        fields = (renderer_context or {}).get('row_fields', FIELDS)
+        return super().render(columns(data, fields), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default)
+
+
+DATA_RENDERERS = [ORJSONRenderer, ColumnarJSONRenderer] + ([MessagePackRenderer] if msgpack else [])
+RENDERERS = DATA_RENDERERS + [renderers.BrowsableAPIRenderer]
+
+
+def negotiate(request):
+    """(renderer, media type) of DATA_RENDERERS for a plain Django request; NotAcceptable if none fits."""
+    negotiation = DefaultContentNegotiation()
+    return negotiation.select_renderer(Request(request), [renderer() for renderer in DATA_RENDERERS])
+
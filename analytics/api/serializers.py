@@ -1,5 +1,13 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
 
+from .. import exports
+from ..ingest import country_codes, ingest_settings
+from ..models import Blog, ExportJob
+
 
 class BlogViewsAnalyticsSerializer(serializers.Serializer):
     x = serializers.CharField()
@@ -14,5 +22,106 @@ class TopAnalyticsSerializer(serializers.Serializer):
 class PerformanceAnalyticsSerializer(serializers.Serializer):
     x = serializers.CharField()
     y = serializers.IntegerField()
-    z = serializers.FloatField(allow_null=True)
+    z = serializers.IntegerField()
+    growth_blogs = serializers.FloatField(allow_null=True)
+    growth_views = serializers.FloatField(allow_null=True)
+
+class BlogViewEventListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        # One query per referenced table for the whole batch, not per event
+        blog_ids = {event['blog'] for event in attrs}
+        user_ids = {event['user'] for event in attrs if event.get('user') is not None}
+        missing_blogs = blog_ids - set(Blog.objects.filter(id__in=blog_ids).values_list('id', flat=True))
+        missing_users = user_ids - set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        errors = {}
+        if missing_blogs:
+            errors['blog'] = f"Unknown blog ids: {sorted(missing_blogs)}"
+        if missing_users:
+            errors['user'] = f"Unknown user ids: {sorted(missing_users)}"
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+class BlogViewEventSerializer(serializers.Serializer):
+    blog = serializers.IntegerField(min_value=1)
+    user = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    viewer_country = serializers.CharField(max_length=2, required=False, allow_null=True)
+    viewed_at = serializers.DateTimeField(required=False)
+
+    class Meta:
+        list_serializer_class = BlogViewEventListSerializer
+
+    def validate_viewer_country(self, value):
+        if value is None:
+            return None
+        country_id = country_codes.resolve(value.upper())
+        if country_id is None:
+            raise serializers.ValidationError(f"Unknown country code '{value}'.")
+        return country_id
+
+    def validate_viewed_at(self, value):
+        if value > timezone.now() + timedelta(minutes=5):
+            raise serializers.ValidationError("viewed_at is in the future.")
+        max_age = ingest_settings()['MAX_AGE']
+        if max_age and value < timezone.now() - timedelta(days=max_age):
+            raise serializers.ValidationError(f"viewed_at is more than {max_age} days ago.")
+        return value
+
+    def to_row(self, event):
+        """Event tuple in analytics.ingest.EVENT_COLUMNS order."""
+        return (
+            event['blog'],
+            event.get('user'),
+            event.get('viewer_country'),
+            event.get('viewed_at') or timezone.now(),
+        )
+
+class BatchQuerySerializer(serializers.Serializer):
+    id = serializers.CharField(max_length=100)
+    group = serializers.ChoiceField(choices=['country', 'user', 'blog'])
+    limit = serializers.IntegerField(min_value=1, required=False, allow_null=True, default=None)
+
+class BatchAnalyticsSerializer(serializers.Serializer):
+    filters = serializers.DictField(child=serializers.CharField(allow_blank=True), required=False, default=dict)
+    queries = BatchQuerySerializer(many=True, allow_empty=False, max_length=20)
+
+    def validate_queries(self, value):
+        ids = [query['id'] for query in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError("Query ids must be unique.")
+        return value
+
+class ExportRequestSerializer(serializers.Serializer):
+    format = serializers.ChoiceField(choices=ExportJob.FORMATS, default=ExportJob.CSV)
+    filters = serializers.DictField(child=serializers.CharField(allow_blank=True), required=False, default=dict)
+
+    def validate_format(self, value):
+        if value == ExportJob.PARQUET and not exports.parquet_available():
+            raise serializers.ValidationError("Parquet exports need pyarrow installed on the server.")
+        return value
+
+class ExportJobSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    status = serializers.CharField()
+    format = serializers.CharField()
+    params = serializers.DictField()
+    rows = serializers.IntegerField()
+    total = serializers.IntegerField(allow_null=True)
+    progress = serializers.SerializerMethodField()
+    error = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    finished_at = serializers.DateTimeField(allow_null=True)
+    url = serializers.SerializerMethodField()
+
+    def get_progress(self, job) -> float | None:
+        """Share of the rows written, 0-1; null while the total is unknown."""
+        if job.status == ExportJob.DONE:
+            return 1.0
+        if not job.total:
+            return None
+        return round(min(job.rows / job.total, 1.0), 4)
 
+    def get_url(self, job) -> str | None:
+        if job.status != ExportJob.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(reverse('exports-download', kwargs={'pk': job.pk}))
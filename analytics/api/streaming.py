@@ -0,0 +1,45 @@
+"""
+NDJSON and CSV streaming of {x, y, z} rows (?stream=ndjson|csv).
+
+Rows are written as the database cursor yields them, so a response over
+hundreds of thousands of groups never holds them all in memory.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+FIELDS = ('x', 'y', 'z')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class _Echo:
+    """File-like object handing csv.writer's output straight back."""
+    def write(self, value):
+        return value
+
+
+def _ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def _csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in FIELDS])
+
+
+WRITERS = {'ndjson': _ndjson, 'csv': _csv}
+
+
+def stream_response(rows, fmt, filename):
+    response = StreamingHttpResponse(WRITERS[fmt](rows), content_type=CONTENT_TYPES[fmt])
+    if fmt == 'csv':
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
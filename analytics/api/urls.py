@@ -1,8 +1,18 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import AnalyticsViewSet
+
+from . import async_views
+from .views import AnalyticsViewSet, ExportViewSet
 
 router = DefaultRouter()
+router.register(r'exports', ExportViewSet, basename='exports')
 router.register(r'', AnalyticsViewSet, basename='analytics')
 
-urlpatterns = router.urls
-
+# Async views take the GET actions' URLs first; the router's routes stay for
+# the OpenAPI schema and for POST /views/.
+urlpatterns = [
+    path('blog-views/', async_views.blog_views),
+    path('top/', async_views.top),
+    path('performance/', async_views.performance),
+    path('dashboard/', async_views.dashboard),
+] + router.urls
@@ -0,0 +1,114 @@
+"""
+Precomputation of the most requested analytics queries.
+
+analytics.api.cache counts every normalized query in AnalyticsQuery. warm()
+takes the TOP most requested queries of each cached action seen in the last
+STALE_AFTER seconds and makes sure the cache holds their entry for the
+current time bucket. Within LEAD seconds of a bucket's end it also computes
+the next bucket's entry. Each query is thus recomputed on the cadence of
+its own TTL: per endpoint, longer for long ranges (ANALYTICS_CACHE
+RANGE_TTL), once for closed windows. Requests for these queries are
+answered from the cache without reading BlogView.
+
+`manage.py warm_analytics_cache` runs warm() every INTERVAL seconds. The
+web workers only see its entries through a cache they share with it, so
+the analytics cache must not be the per-process locmem one.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.test import RequestFactory
+from django.utils import timezone
+
+from .. import periods
+from ..models import AnalyticsQuery
+from . import cache
+from .views import AnalyticsViewSet
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TOP': 20,              # queries per action
+    'INTERVAL': 15.0,       # seconds between passes
+    'LEAD': 30.0,           # seconds before a bucket ends that its successor is computed
+    'STALE_AFTER': 7 * 86400,  # seconds; older queries are no longer warmed and are deleted
+}
+# Pages and streams are not worth keeping warm
+SKIPPED = {'cursor', 'page_size', 'stream'}
+
+
+def warming_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_WARMING', {})}
+
+
+def popular(action, limit):
+    """The `limit` most requested recent queries of `action`, as parameter dicts."""
+    since = timezone.now() - timedelta(seconds=warming_settings()['STALE_AFTER'])
+    rows = AnalyticsQuery.objects.filter(action=action, last_seen__gte=since).order_by('-hits', 'key')
+    return [row.params for row in rows[:limit * 2] if not SKIPPED & set(row.params)][:limit]
+
+
+def warm(limit=None, lead=None, at=None):
+    """
+    Compute the missing cache entries of the popular queries for timestamp
+    `at` (default now) and, near a bucket's end, for the next bucket.
+    Returns (entries computed, queries considered).
+    """
+    conf = warming_settings()
+    limit = conf['TOP'] if limit is None else limit
+    lead = conf['LEAD'] if lead is None else lead
+    at = time.time() if at is None else at
+    store = cache.get_cache()
+    computed = considered = 0
+    for action, (names, rolling) in cache.ACTIONS.items():
+        view = AnalyticsViewSet.as_view({'get': action})
+        for params in popular(action, limit):
+            considered += 1
+            try:
+                zone = periods.get_zone(params['tz']) if params.get('tz') else timezone.get_default_timezone()
+            except ValueError:
+                continue
+            keys = {}
+            # Calendar ranges, and so the keys, depend on the time zone the view will run in
+            with timezone.override(zone):
+                for when in (at, at + lead):
+                    keys.setdefault(cache.cache_key(action, params, names, rolling, when)[0], when)
+            for key, when in keys.items():
+                if store.get(key) is not None:
+                    continue
+                try:
+                    with cache.warming(when):
+                        response = view(RequestFactory().get('/', params))
+                except Exception:
+                    logger.exception("Warming %s %s failed", action, params)
+                    continue
+                computed += response.status_code == 200
+    return computed, considered
+
+
+def prune():
+    """Delete the queries not requested for STALE_AFTER seconds."""
+    since = timezone.now() - timedelta(seconds=warming_settings()['STALE_AFTER'])
+    return AnalyticsQuery.objects.filter(last_seen__lt=since).delete()[0]
+
+
+def run(interval=None, passes=None, report=None):
+    """warm() every `interval` seconds, `passes` times or forever; report(computed, considered, ms) after each."""
+    interval = warming_settings()['INTERVAL'] if interval is None else interval
+    done = 0
+    while passes is None or done < passes:
+        started = time.monotonic()
+        try:
+            prune()
+            computed, considered = warm()
+        finally:
+            # A long-running process must not hold on to broken or expired connections
+            close_old_connections()
+        if report:
+            report(computed, considered, (time.monotonic() - started) * 1000)
+        done += 1
+        if passes is None or done < passes:
+            time.sleep(max(interval - (time.monotonic() - started), 0))
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AnalyticsApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        # Connect the cache invalidation, denormalization, columnar store, label cache, dirty rollup hour and query instrumentation receivers
+        from . import columnar, denormalize, ingest, labels, middleware, rollups  # noqa: F401
+        from .api import cache  # noqa: F401
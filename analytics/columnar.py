@@ -0,0 +1,355 @@
+"""
+In-process columnar copy of recent BlogView rows for range=day/week queries.
+
+ColumnStore holds the BlogView rows of the last DAYS days as int64 NumPy
+arrays: id, blog, viewer country, viewer user, blog author, blog country and
+viewed_at in microseconds since the epoch, with NULL stored as -1. Every
+REFRESH_INTERVAL seconds it appends the rows past its id watermark. It
+re-reads the last OVERLAP ids so that rows committed out of id order are
+not missed, and drops rows that have aged out. Every RELOAD_INTERVAL
+seconds, and after a blog's author or country changes or a blog is deleted,
+it reloads everything instead. Such changes also bump a generation shared
+through the ANALYTICS_CACHE cache, which every process compares on its next
+refresh, so the other workers reload too.
+
+Refreshes and reloads run on a daemon thread of each worker process, woken
+by the first request that finds the store due; requests keep reading the
+previous arrays meanwhile and never wait for the database. Until the first
+load is done, including in every worker gunicorn starts to replace one
+recycled after max_requests, the store answers nothing and requests take
+the SQL path. A reload that would hold more than MAX_ROWS rows is skipped
+after a COUNT, without reading them.
+
+aggregate() and timeline() answer like their analytics.rollups counterparts
+with np.unique/np.bincount group-bys on the id columns. They return None when the store is
+disabled or the window starts before the oldest row held, and the caller
+then runs the SQL path. Each worker process has its own store; it is off
+unless ANALYTICS_COLUMNAR['ENABLED'].
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import labels, periods, rollups
+from .api import cache
+from .api.filters import BlogViewFilter
+from .ingest import country_codes
+from .models import Blog, BlogView
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DAYS': 8,                   # covers range=week between refreshes
+    'REFRESH_INTERVAL': 5.0,     # seconds between incremental refreshes
+    'RELOAD_INTERVAL': 3600.0,   # seconds between full reloads
+    'OVERLAP': 10000,            # ids below the watermark read again on every refresh
+    'MAX_ROWS': 20_000_000,      # 56 bytes per row; larger windows stay on SQL
+}
+BATCH_SIZE = 5000
+NULL = -1
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+GENERATION_KEY = 'analytics:columnar:generation'
+US_PER_DAY = 86_400_000_000
+
+FIELDS = ('id', 'blog_id', 'viewer_country_id', 'user_id', 'blog_author_id', 'blog_country_id', 'viewed_at')
+# BlogViewFilter filters answered by equality on a column
+FILTER_FIELDS = {
+    'viewer_country': 'viewer_country_id',
+    'blog_country': 'blog_country_id',
+    'blog_author': 'blog_author_id',
+    'user': 'user_id',
+}
+COUNTRY_FILTERS = {'viewer_country', 'blog_country'}
+
+COUNTRY, USER, BLOG = labels.COUNTRY, labels.USER, labels.BLOG
+KEY_FIELDS = {COUNTRY: 'viewer_country_id', USER: 'user_id', BLOG: 'blog_id'}
+
+
+def columnar_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_COLUMNAR', {})}
+
+
+def _micros(dt):
+    return (dt - EPOCH) // MICROSECOND
+
+
+def _take(columns, selected):
+    return {name: values[selected] for name, values in columns.items()}
+
+
+def _concat(parts):
+    if not parts:
+        return {name: np.empty(0, dtype=np.int64) for name in FIELDS}
+    return {name: np.concatenate([part[name] for part in parts]) for name in FIELDS}
+
+
+def _fetch(qs):
+    """FIELDS of the queryset's rows as int64 arrays, read BATCH_SIZE rows at a time."""
+    rows = qs.values_list(*FIELDS).order_by().iterator(chunk_size=BATCH_SIZE)
+    parts = []
+    while batch := list(islice(rows, BATCH_SIZE)):
+        *ids, viewed_at = zip(*batch)
+        part = {
+            name: np.array([NULL if value is None else value for value in values], dtype=np.int64)
+            for name, values in zip(FIELDS, ids)
+        }
+        part['viewed_at'] = np.array([_micros(value) for value in viewed_at], dtype=np.int64)
+        parts.append(part)
+    return _concat(parts)
+
+
+class ColumnStore:
+    """BlogView rows viewed at or after `since` as int64 arrays, one per FIELDS entry."""
+    def __init__(self):
+        self.state = (None, None)  # (columns, since), replaced as a whole so readers need no lock
+        self.watermark = 0
+        self._refreshed = None
+        self._loaded = None
+        self._generation = None
+        self._wanted = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def invalidate(self):
+        """Reload everything on the next refresh."""
+        self._loaded = None
+
+    def snapshot(self):
+        """(columns, since) as held now, waking the refresh thread when due; columns is None while unusable."""
+        if self._due(columnar_settings()):
+            self._wake()
+        return self.state
+
+    def _due(self, conf):
+        return self._loaded is None or time.monotonic() - self._refreshed >= conf['REFRESH_INTERVAL']
+
+    def _wake(self):
+        self._ensure_thread()
+        self._wanted.set()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork(); start one per worker process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='columnar-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            conf = columnar_settings()
+            try:
+                if self._due(conf):
+                    self.refresh(conf)
+            except Exception:
+                logger.exception("Refreshing the columnar store failed")
+                time.sleep(conf['REFRESH_INTERVAL'])  # rather than retrying on every request
+            finally:
+                close_old_connections()
+
+    def refresh(self, conf=None):
+        conf = conf or columnar_settings()
+        clock = time.monotonic()
+        since = timezone.now() - timedelta(days=conf['DAYS'])
+        columns = self.state[0]
+        rows = BlogView.objects.filter(viewed_at__gte=since, blog__isnull=False)
+        # Read before the rows, so that a bump while they load reloads again
+        generation = cache.generation(GENERATION_KEY)
+
+        if (self._loaded is None or generation != self._generation
+                or clock - self._loaded >= conf['RELOAD_INTERVAL']):
+            self._loaded, self._generation = clock, generation
+            count = rows.count()
+            if count > conf['MAX_ROWS']:
+                logger.warning("Columnar store disabled until the next reload: %d rows exceed MAX_ROWS", count)
+                self.state, self.watermark, self._refreshed = (None, None), 0, clock
+                return
+            columns = _fetch(rows)
+        elif columns is None:
+            # Too large at the last reload; wait for the next one
+            self._refreshed = clock
+            return
+        else:
+            floor = max(self.watermark - conf['OVERLAP'], 0)
+            new = _fetch(rows.filter(id__gt=floor))
+            new = _take(new, ~np.isin(new['id'], columns['id'][columns['id'] > floor]))
+            columns = _concat([_take(columns, columns['viewed_at'] >= _micros(since)), new])
+
+        if len(columns['id']) > conf['MAX_ROWS']:
+            logger.warning("Columnar store disabled until the next reload: %d rows exceed MAX_ROWS",
+                           len(columns['id']))
+            self.state, self.watermark = (None, None), 0
+        else:
+            self.state = (columns, since)
+            self.watermark = int(columns['id'].max()) if len(columns['id']) else self.watermark
+        self._refreshed = clock
+
+
+_store = ColumnStore()
+
+
+def get_store():
+    return _store
+
+
+def _select(params, start, end, author=None):
+    """(columns, mask) of the rows in [start, end] matching `params`, None when the store cannot answer."""
+    if not columnar_settings()['ENABLED'] or start is None:
+        return None
+    columns, since = get_store().snapshot()
+    if columns is None or start < since:
+        return None
+
+    mask = columns['viewed_at'] >= _micros(start)
+    if end is not None:
+        mask &= columns['viewed_at'] <= _micros(end)
+    if author is not None:
+        mask &= columns['blog_author_id'] == author
+    values = BlogViewFilter(params).values()
+    for name, field in FILTER_FIELDS.items():
+        value = values.get(name)
+        if value is None:
+            continue
+        if name in COUNTRY_FILTERS:
+            value = country_codes.resolve(value)
+        elif value != int(value):  # NumberFilter yields Decimals
+            value = None
+        if value is None:
+            mask[:] = False
+        else:
+            mask &= columns[field] == int(value)
+    return columns, mask
+
+
+def _distinct_counts(codes, blogs, size):
+    """Distinct blogs per code, from the unique (code, blog) pairs."""
+    if not len(codes):
+        return np.zeros(size, dtype=np.int64)
+    span = int(blogs.max()) + 1
+    return np.bincount(np.unique(codes * span + blogs) // span, minlength=size)
+
+
+def aggregate(params, dimension, start=None, end=None, limit=None):
+    """
+    rollups.aggregate() grouped by viewer country, viewer user or blog id,
+    ordered by views then id, from the in-memory rows. x is the id
+    (labels.NO_COUNTRY for views without a country); y counts distinct
+    blogs (1 for BLOG). Returns None when the store cannot answer the window.
+    """
+    start, end = rollups.window(params, start, end)
+    selected = _select(params, start, end)
+    if selected is None:
+        return None
+    columns, mask = selected
+    if dimension == USER:
+        mask &= columns['user_id'] != NULL
+    keys, inverse = np.unique(columns[KEY_FIELDS[dimension]][mask], return_inverse=True)
+    if dimension == COUNTRY:
+        keys[keys == NULL] = labels.NO_COUNTRY  # still the smallest key
+
+    z = np.bincount(inverse, minlength=len(keys))
+    if dimension == BLOG:
+        y = np.ones(len(keys), dtype=np.int64)
+    else:
+        y = _distinct_counts(inverse, columns['blog_id'][mask], len(keys))
+    order = np.lexsort((keys, -z))
+    if limit:
+        order = order[:limit]
+    return [{'x': int(keys[i]), 'y': int(y[i]), 'z': int(z[i])} for i in order.tolist()]
+
+
+def _period_keys(micros, unit):
+    """Index of the day/week/month/year of each wall-clock timestamp, matching rollups.floor_period."""
+    days = micros // US_PER_DAY
+    if unit == 'day':
+        return days
+    if unit == 'week':
+        return days - (days + 3) % 7  # the epoch is a Thursday; weeks start on Monday
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return months if unit == 'month' else months // 12
+
+
+def _period_start(key, unit, zone):
+    if unit in ('day', 'week'):
+        start = EPOCH + timedelta(days=key)
+    elif unit == 'month':
+        start = EPOCH.replace(year=1970 + key // 12, month=key % 12 + 1)
+    else:
+        start = EPOCH.replace(year=1970 + key)
+    return start.replace(tzinfo=zone)
+
+
+def timeline(params, unit, start, end, author=None):
+    """
+    rollups.timeline() from the in-memory rows, optionally for one blog
+    author. Returns None when the store cannot answer the window or the
+    time zone's UTC offset changes within it.
+    """
+    first, last = rollups.floor_period(start, unit), rollups.floor_period(end, unit)
+    baseline = rollups.add_periods(first, unit, -1)
+    offsets = {period.utcoffset() for period in periods.boundaries(baseline, rollups.add_periods(last, unit, 1), unit)}
+    if len(offsets) > 1:
+        return None
+    if author is not None:
+        try:
+            author = int(author)
+        except ValueError:
+            return None
+    selected = _select(params, baseline, end, author)
+    if selected is None:
+        return None
+    columns, mask = selected
+
+    local = columns['viewed_at'][mask] + offsets.pop() // MICROSECOND
+    keys, inverse = np.unique(_period_keys(local, unit), return_inverse=True)
+    z = np.bincount(inverse, minlength=len(keys))
+    y = _distinct_counts(inverse, columns['blog_id'][mask], len(keys))
+    zone = timezone.get_current_timezone()
+    totals = {
+        _period_start(key, unit, zone): {'y': int(y[i]), 'z': int(z[i])}
+        for i, key in enumerate(keys.tolist())
+    }
+    return rollups.fill_series(totals, unit, baseline, last)
+
+
+def _reload_everywhere():
+    """Reload this process's store now and every other process's on its next refresh."""
+    get_store().invalidate()
+    cache.bump_generation(GENERATION_KEY)
+
+
+@receiver(pre_save, sender=Blog)
+def _note_blog_columns(sender, instance, **kwargs):
+    # analytics.denormalize remembers the loaded columns and resets them in its post_save
+    columns = (instance.__dict__.get('author_id'), instance.__dict__.get('country_id'))
+    instance._columnar_stale = not instance._state.adding and columns != getattr(instance, '_denormalized', columns)
+
+
+@receiver(post_save, sender=Blog)
+def _reload_after_resync(sender, instance, **kwargs):
+    if getattr(instance, '_columnar_stale', False):
+        # Queued after analytics.denormalize's resync of the blog's views
+        transaction.on_commit(_reload_everywhere)
+
+
+@receiver(post_delete, sender=Blog)
+def _reload_after_delete(sender, instance, **kwargs):
+    transaction.on_commit(_reload_everywhere)
@@ -0,0 +1,92 @@
+"""
+Keeps BlogView.blog_author/blog_country (and the rollup copies) equal to
+blog.author/blog.country.
+
+Blog saves that change either column resync that blog's rows in chunks after
+the transaction commits. QuerySet.update() on Blog bypasses signals; run
+`manage.py backfill_blog_columns` after such bulk changes.
+"""
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Blog, BlogView, BlogViewDaily, BlogViewHourly, Country
+
+DENORMALIZED = (BlogView, BlogViewHourly, BlogViewDaily)
+CHUNK_SIZE = 10000
+
+
+def blog_columns(blog_ids):
+    """{blog_id: (author_id, country_id)} for the given blogs, in one query."""
+    return {
+        blog_id: (author_id, country_id)
+        for blog_id, author_id, country_id in
+        Blog.objects.filter(id__in=set(blog_ids)).values_list('id', 'author_id', 'country_id')
+    }
+
+
+def sync_blog(blog_id, author_id, country_id, chunk_size=CHUNK_SIZE):
+    """Rewrite the denormalized columns of one blog's rows, chunk_size rows per UPDATE."""
+    current = Q(blog_author_id=author_id) & (
+        Q(blog_country_id=country_id) if country_id is not None else Q(blog_country__isnull=True)
+    )
+    updated = 0
+    for model in DENORMALIZED:
+        stale = model.objects.filter(blog_id=blog_id).exclude(current)
+        while ids := list(stale.values_list('id', flat=True)[:chunk_size]):
+            updated += model.objects.filter(id__in=ids).update(blog_author_id=author_id, blog_country_id=country_id)
+    return updated
+
+
+def backfill(model, start_id, end_id, only_missing=False):
+    """Set the denormalized columns of model rows with start_id <= id < end_id from Blog."""
+    blog = Blog.objects.filter(id=OuterRef('blog_id'))
+    qs = model.objects.filter(id__gte=start_id, id__lt=end_id)
+    if only_missing:
+        qs = qs.filter(blog_author__isnull=True)
+    return qs.update(
+        blog_author_id=Subquery(blog.values('author_id')[:1]),
+        blog_country_id=Subquery(blog.values('country_id')[:1]),
+    )
+
+
+def resync_blog(blog_id):
+    columns = blog_columns([blog_id]).get(blog_id)
+    if columns is not None:
+        sync_blog(blog_id, *columns)
+
+
+def _loaded_columns(instance):
+    # __dict__ rather than attribute access so deferred fields are not fetched
+    return instance.__dict__.get('author_id'), instance.__dict__.get('country_id')
+
+
+@receiver(post_init, sender=Blog)
+def _remember_blog_columns(sender, instance, **kwargs):
+    instance._denormalized = _loaded_columns(instance)
+
+
+@receiver(post_save, sender=Blog)
+def _resync_blog(sender, instance, created, **kwargs):
+    columns = _loaded_columns(instance)
+    if not created and columns != instance._denormalized:
+        blog_id = instance.pk
+        transaction.on_commit(lambda: resync_blog(blog_id))
+    instance._denormalized = columns
+
+
+@receiver(pre_save, sender=BlogView)
+def _fill_blog_columns(sender, instance, **kwargs):
+    # Single ORM saves (admin, scripts); bulk writes go through ingest.write_views
+    if instance.blog_id is not None:
+        instance.blog_author_id, instance.blog_country_id = (
+            blog_columns([instance.blog_id]).get(instance.blog_id, (None, None))
+        )
+
+
+@receiver(post_delete, sender=Country)
+def _clear_deleted_country(sender, instance, **kwargs):
+    # Blog.country is SET_NULL, which updates blogs without sending post_save
+    for model in DENORMALIZED:
+        model.objects.filter(blog_country_id=instance.pk).update(blog_country_id=None)
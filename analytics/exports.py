@@ -0,0 +1,201 @@
+"""
+Background exports of filtered BlogView rows to gzipped CSV or Parquet files.
+
+POST /analytics/exports/ stores an ExportJob and hands it to a pool of
+WORKERS threads per process, so request workers only insert a row. A job
+reads the matching rows with a server-side cursor, or with COPY ... TO
+STDOUT on PostgreSQL for CSV. It appends them to the file CHUNK_SIZE rows
+at a time, so memory stays flat whatever the row count. After every chunk
+the job's `rows` is updated; `total` is counted from the rollups first.
+
+Files are written to DIRECTORY under a temporary name and renamed once
+complete. DIRECTORY must be shared by every worker process that serves
+downloads. Jobs and their files are deleted RETENTION seconds after they
+were created. A job whose process dies while it runs stays 'running'.
+"""
+import csv
+import gzip
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Value
+from django.utils import timezone
+
+from . import periods, rollups
+from .api.filters import BlogViewFilter
+from .models import BlogView, ExportJob
+from .routers import replica_reads
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DIRECTORY': 'exports',
+    'WORKERS': 2,           # threads per process; 0 runs jobs in the request
+    'CHUNK_SIZE': 50000,    # rows per read and per progress update
+    'RETENTION': 86400,     # seconds
+    'USE_COPY': True,       # COPY ... TO STDOUT on PostgreSQL
+}
+FIELDS = ('id', 'viewed_at', 'blog_id', 'blog_author_id', 'blog_country_id', 'user_id', 'viewer_country_id')
+EXTENSIONS = {ExportJob.CSV: '.csv.gz', ExportJob.PARQUET: '.parquet'}
+
+
+def export_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_EXPORTS', {})}
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def path(job):
+    return Path(settings.BASE_DIR, export_settings()['DIRECTORY'], f'{job.pk}{EXTENSIONS[job.format]}')
+
+
+def job_params(filters):
+    """BlogViewFilter parameters of `filters`, with `range` resolved now (in the current time zone)."""
+    params = {name: filters[name] for name in BlogViewFilter.base_filters if filters.get(name) not in (None, '')}
+    start, end = rollups.window(params, *periods.range_window(filters.get('range')))
+    for name, bound in (('viewed_at_gte', start), ('viewed_at_lte', end)):
+        if bound is not None:
+            params[name] = bound.isoformat()
+    return params
+
+
+def submit(fmt, filters):
+    """Create an export job and start it once the transaction commits."""
+    prune()
+    job = ExportJob.objects.create(format=fmt, params=job_params(filters))
+    if export_settings()['WORKERS'] <= 0:
+        transaction.on_commit(lambda: run(job.pk))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.pk))
+    return job
+
+
+def prune():
+    """Delete the jobs and files older than RETENTION."""
+    cutoff = timezone.now() - timedelta(seconds=export_settings()['RETENTION'])
+    expired = list(ExportJob.objects.filter(created_at__lt=cutoff))
+    for job in expired:
+        path(job).unlink(missing_ok=True)
+    ExportJob.objects.filter(pk__in=[job.pk for job in expired]).delete()
+
+
+def run(pk):
+    """Write the job's file, recording progress on the job; failures are recorded, not raised."""
+    job = ExportJob.objects.get(pk=pk)
+    target = path(job)
+    partial = target.with_name(target.name + '.part')
+
+    def progress(written):
+        ExportJob.objects.filter(pk=pk).update(rows=written)
+
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # The job row itself is read from the primary: the replica may not have it yet
+        with replica_reads():
+            total = sum(row['z'] for row in rollups.aggregate(job.params, group=lambda time_field: Value(0),
+                                                              distinct=False))
+            ExportJob.objects.filter(pk=pk).update(status=ExportJob.RUNNING, total=total)
+            rows = BlogViewFilter(job.params, queryset=BlogView.objects.all()).qs.values_list(*FIELDS).order_by()
+            if job.format == ExportJob.PARQUET:
+                _write_parquet(rows, partial, progress)
+            elif connections[rows.db].vendor == 'postgresql' and export_settings()['USE_COPY']:
+                _copy_csv(rows, partial, progress)
+            else:
+                _write_csv(rows, partial, progress)
+        os.replace(partial, target)
+        ExportJob.objects.filter(pk=pk).update(status=ExportJob.DONE, finished_at=timezone.now())
+    except Exception as exc:
+        logger.exception("Export %s failed", pk)
+        partial.unlink(missing_ok=True)
+        ExportJob.objects.filter(pk=pk).update(status=ExportJob.FAILED, error=str(exc), finished_at=timezone.now())
+
+
+def _chunks(rows):
+    chunk_size = export_settings()['CHUNK_SIZE']
+    rows = rows.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def _write_csv(rows, target, progress):
+    written = 0
+    with gzip.open(target, 'wt', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for chunk in _chunks(rows):
+            writer.writerows(chunk)
+            written += len(chunk)
+            progress(written)
+
+
+def _copy_csv(rows, target, progress):
+    """COPY the query's rows out as CSV; PostgreSQL formats them, Python only compresses."""
+    chunk_size = export_settings()['CHUNK_SIZE']
+    sql, params = rows.query.sql_with_params()
+    written = reported = 0
+    # A connection of its own: the thread's stays free for the progress updates during the COPY
+    connection = connections.create_connection(rows.db)
+    try:
+        with gzip.open(target, 'wb') as file, connection.cursor() as cursor:
+            with cursor.cursor.copy(f'COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)', params) as copy:
+                for data in copy:
+                    file.write(data)
+                    written += bytes(data).count(b'\n')
+                    if written - reported >= chunk_size:
+                        progress(written - 1)  # minus the header
+                        reported = written
+    finally:
+        connection.close()
+    progress(max(written - 1, 0))
+
+
+def _write_parquet(rows, target, progress):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        (name, pa.timestamp('us', tz='UTC') if name == 'viewed_at' else pa.int64()) for name in FIELDS
+    ])
+    written = 0
+    with pq.ParquetWriter(target, schema, compression='zstd') as writer:
+        for chunk in _chunks(rows):
+            columns = zip(*chunk)
+            writer.write_batch(pa.record_batch([pa.array(column, type=field.type)
+                                                for column, field in zip(columns, schema)], schema=schema))
+            written += len(chunk)
+            progress(written)
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Threads do not survive fork(); start a pool per worker process.
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=export_settings()['WORKERS'], thread_name_prefix='export')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _run_in_worker(pk):
+    try:
+        run(pk)
+    finally:
+        connections.close_all()
@@ -0,0 +1,251 @@
+"""
+Write path for BlogView events.
+
+POST /analytics/views/ validates a batch and offers it to a bounded
+in-process ViewBuffer. A background thread drains the buffer with
+write_views() whenever FLUSH_SIZE rows are queued or FLUSH_INTERVAL seconds
+have passed, using PostgreSQL COPY where available and bulk_create otherwise.
+write_views() also fills the denormalized blog_author/blog_country columns.
+A batch that fails to write, e.g. while the database is unreachable, goes
+back to the front of the buffer and is retried with exponential backoff;
+meanwhile the buffer fills up and requests get 429 instead of events being
+lost. Only rows the database rejects on their own are dropped.
+"""
+import atexit
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, connections, router
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .denormalize import blog_columns
+from .models import BlogView, Country
+
+logger = logging.getLogger(__name__)
+
+# Column order of the event tuples handed to write_views().
+EVENT_COLUMNS = ('blog_id', 'user_id', 'viewer_country_id', 'viewed_at')
+# Column order of the rows actually written: events plus the denormalized blog columns.
+COLUMNS = EVENT_COLUMNS + ('blog_author_id', 'blog_country_id')
+
+# Sent after rows have been written; receivers get `rows` and `columns`.
+views_written = Signal()
+
+DEFAULTS = {
+    'MAX_BATCH': 1000,       # events accepted per request
+    'BUFFER_SIZE': 50000,    # queued rows before requests get 429
+    'FLUSH_SIZE': 5000,      # rows per write
+    'FLUSH_INTERVAL': 2.0,   # seconds; <= 0 writes synchronously in the request
+    'USE_COPY': True,        # COPY FROM STDIN on PostgreSQL
+    'MAX_AGE': 30,           # days; older viewed_at are rejected, 0 accepts any
+}
+RETRY_DELAY = 1.0       # seconds before the first retry of a failed flush, doubled per failure
+MAX_RETRY_DELAY = 60.0
+
+
+def ingest_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_INGEST', {})}
+
+
+class CountryCodes:
+    """
+    Process-wide country code -> id map. Unknown codes trigger a reload, at
+    most once per `reload_after` seconds so bogus codes cannot stampede the DB.
+    """
+    def __init__(self, reload_after=30):
+        self.reload_after = reload_after
+        self._ids = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def resolve(self, code):
+        country_id = self._ids.get(code)
+        if country_id is None and self._stale():
+            self.reload()
+            country_id = self._ids.get(code)
+        return country_id
+
+    def reload(self):
+        with self._lock:
+            self._ids = dict(Country.objects.values_list('code', 'id'))
+            self._loaded_at = time.monotonic()
+
+    def _stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_after
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+            self._loaded_at = None
+
+
+country_codes = CountryCodes()
+
+
+@receiver([post_save, post_delete], sender=Country)
+def _clear_country_codes(sender, **kwargs):
+    country_codes.clear()
+
+
+def denormalize_events(events):
+    """Extend event tuples with the blog's author and country (one query per batch)."""
+    columns = blog_columns(event[0] for event in events)
+    return [tuple(event) + columns.get(event[0], (None, None)) for event in events]
+
+
+def write_views(events, using=None):
+    """Insert BlogView rows given as tuples in EVENT_COLUMNS order; returns the row count."""
+    events = list(events)
+    if not events:
+        return 0
+    rows = denormalize_events(events)
+    using = using or router.db_for_write(BlogView)
+    connection = connections[using]
+    if connection.vendor == 'postgresql' and ingest_settings()['USE_COPY']:
+        _copy_views(connection, rows)
+    else:
+        BlogView.objects.using(using).bulk_create(
+            [BlogView(**dict(zip(COLUMNS, row))) for row in rows],
+            batch_size=ingest_settings()['FLUSH_SIZE'],
+        )
+    views_written.send(sender=BlogView, rows=rows, columns=COLUMNS)
+    return len(rows)
+
+
+def _copy_views(connection, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+    buf.seek(0)
+
+    opts = BlogView._meta
+    columns = ', '.join(connection.ops.quote_name(opts.get_field(name).column) for name in COLUMNS)
+    sql = f'COPY {connection.ops.quote_name(opts.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)'
+    with connection.cursor() as cursor:
+        if hasattr(cursor.cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, buf)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buf.getvalue())
+
+
+class ViewBuffer:
+    """Bounded queue of row tuples flushed by size or by time from a daemon thread."""
+    def __init__(self, max_size, flush_size, flush_interval):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def offer(self, rows):
+        """Queue all rows or none of them; False means the buffer is full."""
+        with self._cond:
+            if len(self._rows) + len(rows) > self.max_size:
+                return False
+            self._rows.extend(rows)
+            if len(self._rows) >= self.flush_size:
+                self._cond.notify()
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+        return True
+
+    def flush(self):
+        """
+        Write everything queued so far; returns the number of rows written.
+        After a failure the batch is requeued and nothing is written until
+        the backoff delay has passed.
+        """
+        written = 0
+        while time.monotonic() >= self._retry_at:
+            with self._cond:
+                batch = [self._rows.popleft() for _ in range(min(self.flush_size, len(self._rows)))]
+            if not batch:
+                break
+            try:
+                written += self._write(batch)
+            except Exception:
+                with self._cond:
+                    self._rows.extendleft(reversed(batch))
+                self._failures += 1
+                delay = min(RETRY_DELAY * 2 ** (self._failures - 1), MAX_RETRY_DELAY)
+                self._retry_at = time.monotonic() + delay
+                logger.exception("Writing %d buffered blog views failed (%d in a row); retrying in %.0f s",
+                                 len(batch), self._failures, delay)
+            else:
+                self._failures, self._retry_at = 0, 0.0
+        return written
+
+    def _write(self, batch):
+        # A row can be rejected on its own, e.g. its blog was deleted since validation: write
+        # the others one by one and drop only the rejected rows
+        try:
+            return write_views(batch)
+        except (DataError, IntegrityError):
+            if len(batch) == 1:
+                logger.exception("Dropped blog view %s", batch[0])
+                return 0
+        return sum(self._write([row]) for row in batch)
+
+    def close(self):
+        """Last flush at exit, whatever the backoff; logs the rows that could not be written."""
+        self._retry_at = 0.0
+        self.flush()
+        if self._rows:
+            logger.error("Dropped %d buffered blog views at exit", len(self._rows))
+
+    def _ensure_thread(self):
+        # Threads do not survive fork(); start one per worker process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='blogview-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                backoff = self._retry_at - time.monotonic()
+                if backoff > 0:
+                    self._cond.wait(backoff)
+                elif len(self._rows) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                conf = ingest_settings()
+                _buffer = ViewBuffer(conf['BUFFER_SIZE'], conf['FLUSH_SIZE'], conf['FLUSH_INTERVAL'])
+    return _buffer
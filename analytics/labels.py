@@ -0,0 +1,122 @@
+"""
+Process-wide id -> label cache for viewer countries, users and blogs.
+
+The aggregations group by the integer id columns and only turn ids into x
+here, at the end, so their queries neither join Country, User or Blog nor
+group and sort on text. Each kind keeps at most MAX_SIZE labels and evicts
+the least recently used; misses are loaded in one query per BATCH_SIZE ids.
+Saving or deleting a Country, User or Blog drops its entry in this process,
+and entries older than TTL seconds are reloaded so that renames made through
+other workers show up as well.
+"""
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Blog, Country
+
+DEFAULTS = {
+    'MAX_SIZE': 100_000,  # labels per kind
+    'TTL': 300.0,         # seconds
+}
+BATCH_SIZE = 5000
+
+COUNTRY, USER, BLOG = 'country', 'user', 'blog'
+# Group key of views without a viewer country (ids start at 1), so it sorts first like in SQL
+NO_COUNTRY = 0
+UNKNOWN = 'Unknown'
+
+
+def label_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_LABELS', {})}
+
+
+class LabelCache:
+    """Bounded LRU map of model id -> `field` value."""
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self._labels = OrderedDict()  # id -> (label, loaded at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def get_many(self, ids):
+        """{id: label} for the ids that exist, loading the missing and expired ones."""
+        conf = label_settings()
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for pk in ids:
+                entry = self._labels.get(pk)
+                if entry is not None and now - entry[1] < conf['TTL']:
+                    self._labels.move_to_end(pk)
+                    found[pk] = entry[0]
+                else:
+                    missing.append(pk)
+
+        for offset in range(0, len(missing), BATCH_SIZE):
+            loaded = dict(
+                self.model.objects.filter(id__in=missing[offset:offset + BATCH_SIZE]).values_list('id', self.field)
+            )
+            found.update(loaded)
+            with self._lock:
+                for pk, label in loaded.items():
+                    self._labels[pk] = (label, now)
+                    self._labels.move_to_end(pk)
+                while len(self._labels) > conf['MAX_SIZE']:
+                    self._labels.popitem(last=False)
+        return found
+
+    def discard(self, pk):
+        with self._lock:
+            self._labels.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._labels.clear()
+
+
+caches = {
+    COUNTRY: LabelCache(Country, 'name'),
+    USER: LabelCache(User, 'username'),
+    BLOG: LabelCache(Blog, 'title'),
+}
+KINDS = {Country: COUNTRY, User: USER, Blog: BLOG}
+
+
+def label_rows(rows, kind):
+    """
+    {x, y, z} rows with the id in x replaced by its label, resolved
+    BATCH_SIZE rows at a time so streamed rows stay lazy. Rows of users and
+    blogs deleted since they were aggregated are dropped; countries deleted
+    since read as UNKNOWN, like views without a country.
+    """
+    cache = caches[kind]
+    rows = iter(rows)
+    while batch := list(islice(rows, BATCH_SIZE)):
+        ids = {row['x'] for row in batch}
+        if kind == COUNTRY:
+            ids.discard(NO_COUNTRY)
+        names = cache.get_many(ids)
+        for row in batch:
+            label = names.get(row['x'])
+            if label is None:
+                if kind != COUNTRY:
+                    continue
+                label = UNKNOWN
+            yield {**row, 'x': label}
+
+
+@receiver([post_save, post_delete], sender=Country)
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Blog)
+def _discard_label(sender, instance, **kwargs):
+    caches[KINDS[sender]].discard(instance.pk)
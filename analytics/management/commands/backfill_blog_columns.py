@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from analytics.denormalize import DENORMALIZED, backfill
+
+
+class Command(BaseCommand):
+    help = ('Backfill BlogView.blog_author/blog_country (and the rollup copies) from Blog '
+            'in id-range chunks, one UPDATE per chunk')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Ids per UPDATE')
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Only touch rows whose blog_author is still NULL')
+
+    def handle(self, *args, **options):
+        chunk = max(options['chunk_size'], 1)
+        for model in DENORMALIZED:
+            bounds = model.objects.aggregate(low=Min('id'), high=Max('id'))
+            if bounds['low'] is None:
+                continue
+            updated = 0
+            for start in range(bounds['low'], bounds['high'] + 1, chunk):
+                # Autocommit per chunk keeps locks and WAL bursts short
+                updated += backfill(model, start, start + chunk, only_missing=options['only_missing'])
+            self.stdout.write(f"{model.__name__}: {updated} rows updated.")
+
+        self.stdout.write(self.style.SUCCESS("Backfill complete!"))
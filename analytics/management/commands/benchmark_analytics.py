@@ -0,0 +1,237 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from analytics.api import renderers
+from analytics.api.views import AnalyticsViewSet
+from analytics.models import Blog, BlogView
+from analytics.rollups import refresh_rollups
+from analytics.sketches import refresh_sketches
+
+RANGES = ['day', 'week', 'month', 'year']
+COMPARES = ['day', 'week', 'month', 'year']
+# drf-json is DRF's stdlib-based JSONRenderer, the renderer before analytics.api.renderers
+RENDERERS = {
+    'drf-json': JSONRenderer,
+    'json': renderers.ORJSONRenderer,
+    'columns': renderers.ColumnarJSONRenderer,
+    'msgpack': renderers.MessagePackRenderer if renderers.msgpack else None,
+}
+
+
+def benchmark_cases(author_id, country_code, approx=False):
+    """(path, params) pairs covering every action, range/compare value and filter."""
+    since = (timezone.now() - timedelta(days=14)).strftime('%Y-%m-%dT%H:%M:%S')
+    until = (timezone.now() - timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%S')
+    cases = []
+    for object_type in ['country', 'user']:
+        for time_range in RANGES:
+            cases.append(('/analytics/blog-views/', {'object_type': object_type, 'range': time_range}))
+        cases += [
+            ('/analytics/blog-views/', {'object_type': object_type, 'range': 'year', 'viewer_country': country_code}),
+            ('/analytics/blog-views/', {'object_type': object_type, 'range': 'year', 'blog_author': author_id}),
+            ('/analytics/blog-views/', {'object_type': object_type, 'range': 'year',
+                                        'viewed_at_gte': since, 'viewed_at_lte': until}),
+        ]
+    for top_type in ['user', 'country', 'blog']:
+        for time_range in RANGES:
+            cases.append(('/analytics/top/', {'top': top_type, 'range': time_range}))
+        cases.append(('/analytics/top/', {'top': top_type, 'range': 'year', 'viewer_country': country_code}))
+    for compare in COMPARES:
+        cases.append(('/analytics/performance/', {'compare': compare}))
+        cases.append(('/analytics/performance/', {'compare': compare, 'user': author_id}))
+    if approx:
+        cases += [
+            (path, {**params, 'approx': 'true'}) for path, params in cases
+            if path == '/analytics/blog-views/' or params.get('top') in ('user', 'country')
+        ]
+    return cases
+
+
+def rows_scanned(queries):
+    """Rows read by scan nodes according to EXPLAIN ANALYZE (PostgreSQL only)."""
+    if connection.vendor != 'postgresql':
+        return None
+
+    def walk(node):
+        total = 0
+        if 'Scan' in node.get('Node Type', ''):
+            total += node.get('Actual Rows', 0) * node.get('Actual Loops', 1)
+            total += node.get('Rows Removed by Filter', 0) * node.get('Actual Loops', 1)
+        for child in node.get('Plans', []):
+            total += walk(child)
+        return total
+
+    total = 0
+    with connection.cursor() as cursor:
+        for query in queries:
+            if not query['sql'].lstrip().upper().startswith('SELECT'):
+                continue
+            cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query['sql']}")
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            total += walk(plan[0]['Plan'])
+    return total
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the analytics endpoints at increasing BlogView counts and print JSON. '
+            'Seeding WRITES to the configured database; point DATABASE_URL at a scratch database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10_000,1_000_000,10_000_000',
+                            help='Comma separated BlogView counts to benchmark at (ascending)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+        parser.add_argument('--span-days', type=float, default=365)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--no-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--rollups', action='store_true', help='Refresh rollups and sketches before each size')
+        parser.add_argument('--approx', action='store_true', help='Add ?approx=true variants of the distinct-count cases')
+        parser.add_argument('--cache', action='store_true', help='Keep the response cache enabled')
+        parser.add_argument('--renderers', action='store_true',
+                            help='Also time rendering each response with every renderer')
+        parser.add_argument('--output', help='Write JSON here instead of stdout')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size.replace('_', '')) for size in options['sizes'].split(','))
+        report = {
+            'meta': {
+                'commit': self._commit(),
+                'vendor': connection.vendor,
+                'started_at': timezone.now().isoformat(),
+                'repeat': options['repeat'],
+                'rollups': options['rollups'],
+                'approx': options['approx'],
+                'cache': options['cache'],
+                'renderers': options['renderers'],
+            },
+            'results': [],
+        }
+
+        for size in ([None] if options['no_seed'] else sizes):
+            if size is not None:
+                self._seed(size, sizes[-1], options)
+            if options['rollups']:
+                refresh_rollups()
+                refresh_sketches()
+            report['results'] += self._run(BlogView.objects.count(), options)
+
+        payload = json.dumps(report, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(payload)
+            self.stderr.write(f"Benchmark written to {options['output']}")
+        else:
+            self.stdout.write(payload)
+
+    def _seed(self, size, largest, options):
+        """Top the dataset up to `size` views; users and blogs are sized for the largest run."""
+        missing = size - BlogView.objects.count()
+        if missing <= 0:
+            return
+        self.stderr.write(f"Seeding {missing} views to reach {size}...")
+        call_command(
+            'populate_sample_data',
+            users=max(10, largest // 1000),
+            countries=50,
+            blogs=0 if Blog.objects.exists() else max(50, largest // 500),
+            views=missing,
+            span_days=options['span_days'],
+            seed=options['seed'] + size,
+            stdout=sys.stderr,
+        )
+
+    def _run(self, size, options):
+        blog = Blog.objects.select_related('country').order_by('id').first()
+        if blog is None:
+            raise CommandError("No data to benchmark; drop --no-seed.")
+        country_code = blog.country.code if blog.country else 'US'
+
+        factory = APIRequestFactory()
+        overrides = {} if options['cache'] else {
+            'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            'ANALYTICS_CACHE': {'ALIAS': 'default'},
+        }
+        results = []
+        with override_settings(**overrides):
+            for path, params in benchmark_cases(blog.author_id, country_code, options['approx']):
+                # The viewset action behind the async view, on this thread so its queries are captured
+                view = AnalyticsViewSet.as_view({'get': path.strip('/').split('/')[-1].replace('-', '_')})
+
+                def call():
+                    response = view(factory.get(path, params))
+                    response.render()
+                    return response
+
+                call()  # warm-up
+                timings = []
+                for _ in range(max(options['repeat'], 1)):
+                    started = time.perf_counter()
+                    call()
+                    timings.append((time.perf_counter() - started) * 1000)
+
+                with CaptureQueriesContext(connection) as ctx:
+                    tracemalloc.start()
+                    response = call()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                results.append({
+                    'size': size,
+                    'path': path,
+                    'params': params,
+                    'status': response.status_code,
+                    'rows_returned': len(response.data) if isinstance(response.data, list) else None,
+                    'p50_ms': round(statistics.median(timings), 3),
+                    'p95_ms': round(self._p95(timings), 3),
+                    'queries': len(ctx.captured_queries),
+                    'rows_scanned': rows_scanned(ctx.captured_queries),
+                    'peak_memory_kb': round(peak / 1024, 1),
+                })
+                if options['renderers'] and response.status_code == 200:
+                    results[-1]['render'] = self._render(response.data, options['repeat'])
+                self.stderr.write(f"{size:>10} {path}?{'&'.join(f'{k}={v}' for k, v in params.items())} "
+                                  f"p50={results[-1]['p50_ms']}ms")
+        return results
+
+    @staticmethod
+    def _render(data, repeat):
+        """{renderer: {p50_ms, bytes}} of rendering `data` with each of RENDERERS."""
+        results = {}
+        for name, renderer_class in RENDERERS.items():
+            if renderer_class is None:
+                continue
+            renderer = renderer_class()
+            timings = []
+            for _ in range(max(repeat, 1)):
+                started = time.perf_counter()
+                body = renderer.render(data, renderer.media_type)
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {'p50_ms': round(statistics.median(timings), 3), 'bytes': len(body)}
+        return results
+
+    @staticmethod
+    def _p95(timings):
+        if len(timings) < 2:
+            return timings[0]
+        return statistics.quantiles(timings, n=20, method='inclusive')[-1]
+
+    @staticmethod
+    def _commit():
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,145 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_analytics import Command as BenchmarkCommand
+
+DEFAULT_PATHS = '/analytics/blog-views/?range=week,/analytics/top/?top=user&range=week,/api/schema/'
+# A fresh interpreter standing in for a gunicorn worker: import the ASGI app, optionally
+# warm it up as the preloading master does, then answer each path twice through it
+PROBE = '''
+import asyncio, json, sys, time
+spawned = time.time()
+started = time.perf_counter()
+from project_config.asgi import application
+imported = time.perf_counter()
+if sys.argv[1] == 'preloaded':
+    from project_config.startup import warm_up
+    warm_up()
+warmed = time.perf_counter()
+
+from django.conf import settings
+host = next((host for host in settings.ALLOWED_HOSTS if '*' not in host), 'localhost')
+
+async def get(path):
+    path_info, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path_info, 'raw_path': path_info.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', host.encode())], 'client': ('127.0.0.1', 0), 'server': (host, 80),
+    }
+    requests, sent = [{'type': 'http.request', 'body': b'', 'more_body': False}], []
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Future()  # the client stays connected until the response is sent
+
+    async def send(message):
+        sent.append(message)
+
+    begun = time.perf_counter()
+    await application(scope, receive, send)
+    return sent[0]['status'], (time.perf_counter() - begun) * 1000
+
+async def main(paths):
+    return [(path, *await get(path), (await get(path))[1]) for path in paths]
+
+responses = asyncio.run(main(json.loads(sys.argv[2])))
+print(json.dumps({'spawned': spawned, 'import_ms': (imported - started) * 1000,
+                  'warm_up_ms': (warmed - imported) * 1000, 'responses': responses}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Measure what a gunicorn (uvicorn) worker pays before answering: interpreter start, ASGI app import, '
+            'warm-up and the first and second response per path, in fresh processes, without and with '
+            'preloading. Run it with the deployment settings (DEBUG=False) and print JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', default=DEFAULT_PATHS, help='Comma separated paths with query strings')
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per mode')
+        parser.add_argument('--imports', type=int, default=15, help='Report the N slowest imports (0 for none)')
+        parser.add_argument('--output', help='Write JSON here instead of stdout')
+
+    def handle(self, *args, **options):
+        paths = [path for path in options['paths'].split(',') if path]
+        report = {
+            'meta': {
+                'commit': BenchmarkCommand._commit(),
+                'settings': os.environ.get('DJANGO_SETTINGS_MODULE'),
+                'python': sys.version.split()[0],
+                'runs': options['runs'],
+            },
+            'results': [self._mode(mode, paths, options['runs']) for mode in ('lazy', 'preloaded')],
+        }
+        if options['imports']:
+            report['imports'] = self._imports(options['imports'])
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(payload)
+            self.stderr.write(f"Benchmark written to {options['output']}")
+        else:
+            self.stdout.write(payload)
+
+    def _mode(self, mode, paths, runs):
+        """
+        Medians over `runs` processes. worker_ms is what each forked worker
+        pays before its responses are done: the import and the first
+        responses when lazy, only the first responses when preloaded (the
+        master imports and warms up once).
+        """
+        probes = []
+        for _ in range(max(runs, 1)):
+            spawned = time.time()
+            # The last line: request logs may be written to stdout before it
+            probe = json.loads(self._probe(['-c', PROBE, mode, json.dumps(paths)]).splitlines()[-1])
+            probe['interpreter_ms'] = (probe['spawned'] - spawned) * 1000
+            probes.append(probe)
+
+        def median(values):
+            return round(statistics.median(values), 1)
+
+        first = {path: median([probe['responses'][i][2] for probe in probes]) for i, path in enumerate(paths)}
+        result = {
+            'mode': mode,
+            'interpreter_ms': median([probe['interpreter_ms'] for probe in probes]),
+            'import_ms': median([probe['import_ms'] for probe in probes]),
+            'warm_up_ms': median([probe['warm_up_ms'] for probe in probes]),
+            'status': {path: probes[0]['responses'][i][1] for i, path in enumerate(paths)},
+            'first_response_ms': first,
+            'second_response_ms': {path: median([probe['responses'][i][3] for probe in probes])
+                                   for i, path in enumerate(paths)},
+        }
+        result['worker_ms'] = round(sum(first.values()) + (result['import_ms'] if mode == 'lazy' else 0), 1)
+        self.stderr.write(f"{mode:>10} import={result['import_ms']}ms warm_up={result['warm_up_ms']}ms "
+                          f"worker={result['worker_ms']}ms")
+        return result
+
+    def _imports(self, limit):
+        """The `limit` slowest modules imported by the app and its URLconf, from python -X importtime."""
+        code = 'from project_config.asgi import application; from project_config.startup import warm_up; warm_up()'
+        output = self._probe(['-X', 'importtime', '-c', code], stderr=True)
+        modules = []
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            # Top-level imports only: nested ones are part of their parent's cumulative time
+            if not name.startswith('  '):
+                modules.append({'module': name.strip(), 'cumulative_ms': round(int(cumulative) / 1000, 1)})
+        return sorted(modules, key=lambda module: -module['cumulative_ms'])[:limit]
+
+    @staticmethod
+    def _probe(arguments, stderr=False):
+        completed = subprocess.run([sys.executable, *arguments], capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f"Probe failed:\n{completed.stderr}")
+        return completed.stderr if stderr else completed.stdout
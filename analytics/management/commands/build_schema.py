@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.validation import validate_schema
+
+from project_config.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema once and write it to OPENAPI_SCHEMA_DIR as YAML and JSON for /api/schema/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--validate', action='store_true', help='Fail if the schema is not valid OpenAPI 3')
+
+    def handle(self, *args, **options):
+        generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+        schema = generator.get_schema(request=None, public=True)
+        if options['validate']:
+            try:
+                validate_schema(schema)
+            except Exception as exc:
+                raise CommandError(f'Invalid schema: {exc}') from exc
+        for path in write_schema(schema):
+            self.stdout.write(f'Wrote {path}')
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from analytics import retention
+from analytics.rollups import HOURLY_HORIZON, RAW_HORIZON, watermarks
+
+
+class Command(BaseCommand):
+    help = ('Compact raw views past ANALYTICS_RETENTION_RAW_DAYS into the hourly and daily rollups and delete '
+            'hourly rollups past ANALYTICS_RETENTION_HOURLY_DAYS; run after refresh_rollups')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-days', type=int, default=1, help='Days compacted per transaction (unpartitioned tables)')
+
+    def handle(self, *args, **options):
+        conf = retention.retention_settings()
+        if conf['RAW_DAYS'] <= 0 and conf['HOURLY_DAYS'] <= 0:
+            self.stdout.write("Retention is off (ANALYTICS_RETENTION_RAW_DAYS and _HOURLY_DAYS are 0).")
+            return
+        raw, hourly = retention.compact(chunk=timedelta(days=max(options['chunk_days'], 1)))
+        marks = watermarks()
+        horizons = ', '.join(f"{name} {marks[name]:%Y-%m-%d}" for name in (RAW_HORIZON, HOURLY_HORIZON) if name in marks)
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted: {raw} raw views and {hourly} hourly rows deleted ({horizons or 'no horizon yet'})."
+        ))
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics import partitions
+from analytics.rollups import RAW_HORIZON, set_watermark, watermarks
+
+
+class Command(BaseCommand):
+    help = ('Create monthly analytics_blogview partitions ahead of time and detach or drop '
+            'partitions past the retention period (PostgreSQL only)')
+
+    def add_arguments(self, parser):
+        conf = partitions.partition_settings()
+        parser.add_argument('--ahead', type=int, default=conf['AHEAD_MONTHS'],
+                            help='Months to create past the current one')
+        parser.add_argument('--retain-months', type=int, default=conf['RETAIN_MONTHS'],
+                            help='Complete months of raw views to keep; 0 keeps everything')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop expired partitions instead of detaching them for archiving')
+        parser.add_argument('--force', action='store_true',
+                            help='Expire partitions even if the daily rollups do not cover them yet')
+        parser.add_argument('--dry-run', action='store_true', help='Only print what would change')
+        parser.add_argument('--database', default=None, help='Database alias (default: the BlogView write database)')
+
+    def handle(self, *args, **options):
+        connection = partitions.get_connection(options['database'])
+        if not partitions.is_partitioned(connection):
+            raise CommandError(f"{partitions.PARENT} is not partitioned on '{connection.alias}' "
+                               f"(PostgreSQL with ANALYTICS_PARTITIONS['ENABLED'] and migration 0004 required).")
+
+        now = timezone.now()
+        current = partitions.month_floor(now)
+        last = partitions.add_months(current, max(options['ahead'], 0))
+        existing = partitions.partitions(connection)
+
+        missing = []
+        month = current
+        while month <= last:
+            if month not in existing:
+                missing.append(month)
+            month = partitions.add_months(month, 1)
+        for month in missing:
+            if not options['dry_run']:
+                partitions.create_partition(connection, month)
+            self.stdout.write(f"{'Would create' if options['dry_run'] else 'Created'} "
+                              f"{partitions.partition_name(month)}")
+
+        if options['retain_months'] > 0:
+            self._expire(connection, partitions.add_months(current, -options['retain_months']), options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(partitions.partitions(connection))} monthly partitions attached."
+        ))
+
+    def _expire(self, connection, cutoff, options):
+        daily = watermarks().get('daily')
+        if not options['force'] and (daily is None or daily < cutoff):
+            # Raw rows are the only copy of anything the daily rollups have not reached
+            cutoff = min(cutoff, partitions.month_floor(daily)) if daily else None
+            self.stderr.write(self.style.WARNING(
+                "Daily rollups lag the retention cutoff; only expiring months they cover "
+                "(run refresh_rollups or pass --force)."
+            ))
+        if cutoff is None:
+            return
+        if options['dry_run']:
+            action = 'Would drop' if options['drop'] else 'Would detach'
+        else:
+            action = 'Dropped' if options['drop'] else 'Detached'
+        expired = partitions.expired_partitions(connection, cutoff)
+        for name in expired:
+            if not options['dry_run']:
+                partitions.detach_partition(connection, name, drop=options['drop'])
+            self.stdout.write(f"{action} {name}")
+        horizon = watermarks().get(RAW_HORIZON)
+        if expired and not options['dry_run'] and (horizon is None or horizon < cutoff):
+            # Queries read the rollups alone for the detached months, see analytics.retention
+            set_watermark(RAW_HORIZON, cutoff)
@@ -1,60 +1,145 @@
-from django.core.management.base import BaseCommand
+import time
+from datetime import timedelta
+from itertools import accumulate
+from random import Random
+from string import ascii_uppercase
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from analytics.models import Country, Blog, BlogView
-from random import choice
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analytics.ingest import write_views
+from analytics.models import Blog, Country
+
+COUNTRY_DATA = [
+    ('USA', 'US'),
+    ('Ethiopia', 'ET'),
+    ('India', 'IN'),
+    ('Germany', 'DE'),
+    ('Brazil', 'BR'),
+]
+
+
+def zipf_cum_weights(n, exponent):
+    """Cumulative weights of rank 1..n under Zipf(exponent); 0 gives a uniform distribution."""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
 
 class Command(BaseCommand):
-    help = 'Populate sample data: 10 users, 5 countries, 50 blogs, 1000 blog views'
+    help = ('Populate synthetic analytics data: users, countries, blogs and blog views '
+            'spread over a time span with Zipf-skewed blogs and countries')
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--countries', type=int, default=5,
+                            help='Countries to use; codes beyond the built-in five are synthetic')
+        parser.add_argument('--blogs', type=int, default=50,
+                            help='New blogs to create; 0 spreads the views over existing blogs')
+        parser.add_argument('--views', type=lambda value: int(value.replace('_', '')), default=1000,
+                            help='Blog views to create, e.g. 50_000_000')
+        parser.add_argument('--span-days', type=float, default=30,
+                            help='Spread viewed_at uniformly over the last N days (0 = now)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--blog-skew', type=float, default=1.1, help='Zipf exponent for blog popularity')
+        parser.add_argument('--country-skew', type=float, default=1.0, help='Zipf exponent for viewer countries')
+        parser.add_argument('--anonymous', type=float, default=0.3, help='Share of views without a user')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per bulk write / COPY')
+
+    def handle(self, *args, **options):
+        rng = Random(options['seed'])
         self.stdout.write("Starting to populate sample data...")
 
-        # --- Create users ---
-        users = []
-        for i in range(1, 11):
-            user, created = User.objects.get_or_create(
-                username=f'user{i}',
-                defaults={'email': f'user{i}@example.com'}
-            )
-            if created:
-                user.set_password('password123')
-                user.save()
-            users.append(user)
-        self.stdout.write("10 users created.")
-
-        # --- Create countries ---
-        country_data = [
-            ('USA', 'US'),
-            ('Ethiopia', 'ET'),
-            ('India', 'IN'),
-            ('Germany', 'DE'),
-            ('Brazil', 'BR')
-        ]
-        countries = []
-        for name, code in country_data:
-            country, _ = Country.objects.get_or_create(name=name, code=code)
-            countries.append(country)
-        self.stdout.write("5 countries created.")
-
-        # --- Create blogs ---
-        blogs = []
-        for i in range(1, 51):
-            blog = Blog.objects.create(
-                author=choice(users),
-                country=choice(countries),
-                title=f'Sample Blog Post {i}',
-                content=f"This is sample content for blog post {i}."
-            )
-            blogs.append(blog)
-        self.stdout.write("50 blogs created.")
-
-        # --- Create blog views ---
-        for _ in range(1000):
-            BlogView.objects.create(
-                blog=choice(blogs),
-                viewer_country=choice(countries)
-                # viewed_at is auto_now_add=True
-            )
-        self.stdout.write("1000 blog views created.")
+        users = self._users(options['users'])
+        self.stdout.write(f"{len(users)} users ready.")
+
+        countries = self._countries(options['countries'])
+        self.stdout.write(f"{len(countries)} countries ready.")
+
+        blogs = self._blogs(options['blogs'], users, countries, rng)
+        self.stdout.write(f"{len(blogs)} blogs created.")
+        if not blogs:  # --blogs 0 tops up views on the existing blogs
+            blogs = list(Blog.objects.values_list('id', flat=True))
+
+        total = options['views']
+        started = time.monotonic()
+        written = 0
+        for chunk in self._views(rng, total, blogs, users, countries, options):
+            written += write_views(chunk)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"  {written}/{total} views ({written / max(elapsed, 1e-9):,.0f} rows/s)")
+        self.stdout.write(f"{written} blog views created.")
 
         self.stdout.write(self.style.SUCCESS("Sample data population complete!"))
+
+    def _users(self, count):
+        usernames = [f'user{i}' for i in range(1, count + 1)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        password = make_password('password123')  # hash once, not per user
+        User.objects.bulk_create(
+            [User(username=name, email=f'{name}@example.com', password=password)
+             for name in usernames if name not in existing],
+            batch_size=5000,
+        )
+        return list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+
+    def _countries(self, count):
+        data = COUNTRY_DATA[:count]
+        synthetic = (a + b for a in ascii_uppercase for b in ascii_uppercase)
+        taken = {code for _, code in COUNTRY_DATA}
+        while len(data) < count:
+            code = next(synthetic)
+            if code not in taken:
+                data.append((f'Country {code}', code))
+
+        countries = []
+        for name, code in data:
+            country, _ = Country.objects.get_or_create(code=code, defaults={'name': name})
+            countries.append(country.id)
+        return countries
+
+    def _blogs(self, count, users, countries, rng):
+        start = Blog.objects.count() + 1
+        blogs = Blog.objects.bulk_create(
+            [
+                Blog(
+                    author_id=rng.choice(users),
+                    country_id=rng.choice(countries),
+                    title=f'Sample Blog Post {i}',
+                    content=f"This is sample content for blog post {i}.",
+                )
+                for i in range(start, start + count)
+            ],
+            batch_size=5000,
+        )
+        if blogs and blogs[0].pk is None:  # backends that do not return ids from bulk inserts
+            blogs = Blog.objects.order_by('-id')[:count]
+        return [blog.pk for blog in blogs]
+
+    def _views(self, rng, total, blogs, users, countries, options):
+        """
+        Yield event tuples (ingest.EVENT_COLUMNS order) in chunks. Chunks walk the span
+        from oldest to newest so rows arrive roughly in viewed_at order, like
+        an append-only production table.
+        """
+        if not blogs:
+            return
+        chunk_size = max(options['chunk_size'], 1)
+        blog_weights = zipf_cum_weights(len(blogs), options['blog_skew'])
+        country_weights = zipf_cum_weights(len(countries), options['country_skew']) if countries else None
+        anonymous = options['anonymous']
+
+        now = timezone.now()
+        span = timedelta(days=options['span_days']).total_seconds()
+        chunks = -(-total // chunk_size)
+        for index in range(chunks):
+            size = min(chunk_size, total - index * chunk_size)
+            slice_start = span * (chunks - index) / chunks
+            slice_length = span / chunks
+            offsets = sorted((slice_start - rng.random() * slice_length for _ in range(size)), reverse=True)
+            yield list(zip(
+                rng.choices(blogs, cum_weights=blog_weights, k=size),
+                [None if rng.random() < anonymous else rng.choice(users) for _ in range(size)] if users else [None] * size,
+                rng.choices(countries, cum_weights=country_weights, k=size) if countries else [None] * size,
+                [now - timedelta(seconds=offset) for offset in offsets],
+            ))
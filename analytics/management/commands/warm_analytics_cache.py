@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from analytics.api import cache, warming
+
+
+class Command(BaseCommand):
+    help = ('Keep the cache entries of the most requested blog-views, top and performance queries '
+            'computed ahead of requests; runs until stopped unless --once is given')
+
+    def add_arguments(self, parser):
+        conf = warming.warming_settings()
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+        parser.add_argument('--interval', type=float, default=conf['INTERVAL'], help='Seconds between passes')
+
+    def handle(self, *args, **options):
+        backend = type(cache.get_cache()).__name__
+        if backend in ('LocMemCache', 'DummyCache'):
+            self.stderr.write(self.style.WARNING(
+                f"The analytics cache is a {backend}; web workers will not see the warmed entries "
+                "(set ANALYTICS_CACHE_BACKEND to a shared cache)."
+            ))
+
+        def report(computed, considered, ms):
+            self.stdout.write(f"Warmed {computed} entries for {considered} popular queries in {ms:.0f} ms.")
+
+        warming.run(interval=options['interval'], passes=1 if options['once'] else None, report=report)
@@ -0,0 +1,300 @@
+"""
+Per-request instrumentation of the analytics routes.
+
+Every database connection gets an execute wrapper (installed when it is
+created) that adds each query's time to the RequestStats of the current
+request, found through a context variable, so queries run by the async
+views' worker threads and on the replica are counted too.
+
+For each request under ANALYTICS_INSTRUMENTATION['PATH_PREFIX'] the
+middleware adds a Server-Timing header (db, app and total time, query
+count) and logs one JSON object to the 'analytics.requests' logger with the
+query count, DB time, total time, serialized row count and the normalized
+filter set. Requests slower than SLOW_MS are sampled (SLOW_SAMPLE_RATE)
+to the 'analytics.slow' logger together with the EXPLAIN output of their
+slowest queries. The EXPLAINs run on a daemon thread fed through a bounded
+queue, not in the request; while the queue is full, slow requests are
+logged without them.
+"""
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .api.filters import BlogViewFilter
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger('analytics.requests')
+slow_logger = logging.getLogger('analytics.slow')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'PATH_PREFIX': '/analytics/',
+    'SLOW_MS': 500,
+    'SLOW_SAMPLE_RATE': 1.0,
+    'EXPLAIN_QUERIES': 3,      # slowest queries explained per slow request
+    'EXPLAIN_ANALYZE': False,  # EXPLAIN ANALYZE on PostgreSQL (runs the query again)
+    'EXPLAIN_BACKLOG': 100,    # slow requests waiting for their EXPLAINs; beyond it they are logged without
+}
+# Parameters that differ on every page and say nothing about the query shape
+IGNORED_PARAMS = ('cursor',)
+
+_stats = contextvars.ContextVar('analytics_request_stats', default=None)
+_sequence = itertools.count()
+
+
+def instrumentation_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_INSTRUMENTATION', {})}
+
+
+class RequestStats:
+    """Query count and time of one request, shared by the threads it runs queries in."""
+    def __init__(self, keep):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = []  # min-heap of (duration, seq, alias, sql, params)
+        self._keep = keep
+        self._lock = threading.Lock()
+
+    def add(self, alias, sql, params, many, duration):
+        with self._lock:
+            self.queries += 1
+            self.db_time += duration
+            if many or not self._keep:
+                return
+            entry = (duration, next(_sequence), alias, sql, params)
+            if len(self.slowest) < self._keep:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+
+def _record(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(context['connection'].alias, sql, params, many, time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def _install_wrapper(sender, connection, **kwargs):
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+def explain(alias, sql, params, analyze=False):
+    """EXPLAIN output of a captured query, or the error it raised."""
+    connection = connections[alias]
+    options = {'analyze': True} if analyze and connection.vendor == 'postgresql' else {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix(**options)} {sql}', params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+
+
+def log_slow(record, slowest, analyze=False, explained=True):
+    """
+    Log a slow request with its slowest queries, (duration, alias, sql,
+    params) tuples, and unless `explained` is False the EXPLAIN of each SELECT.
+    """
+    record['slowest'] = [
+        {
+            'alias': alias,
+            'ms': round(duration * 1000, 1),
+            'sql': sql,
+            'explain': explain(alias, sql, params, analyze)
+            if explained and sql.lstrip().upper().startswith(('SELECT', 'WITH')) else None,
+        }
+        for duration, alias, sql, params in slowest
+    ]
+    slow_logger.warning(json.dumps(record, default=str))
+
+
+class SlowLog:
+    """Bounded queue of slow requests whose queries a daemon thread explains and logs."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def offer(self, record, slowest, analyze=False):
+        """Queue a slow request for explaining; False means the queue is full."""
+        with self._cond:
+            if len(self._entries) >= self.max_size:
+                return False
+            self._entries.append((record, slowest, analyze))
+            self._cond.notify()
+        self._ensure_thread()
+        return True
+
+    def drain(self):
+        """Explain and log everything queued so far; returns the number of requests logged."""
+        logged = 0
+        while True:
+            with self._cond:
+                if not self._entries:
+                    return logged
+                entry = self._entries.popleft()
+            log_slow(*entry)
+            logged += 1
+
+    def _ensure_thread(self):
+        # Threads do not survive fork(); start one per worker process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-explain', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._entries:
+                    self._cond.wait()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("Logging a slow analytics request failed")
+            finally:
+                close_old_connections()
+
+
+_slow_log = None
+_slow_log_lock = threading.Lock()
+
+
+def get_slow_log():
+    global _slow_log
+    if _slow_log is None:
+        with _slow_log_lock:
+            if _slow_log is None:
+                _slow_log = SlowLog(instrumentation_settings()['EXPLAIN_BACKLOG'])
+    return _slow_log
+
+
+def normalized_filters(params):
+    """(sorted BlogViewFilter names in use, {other parameter: value}) of a query string."""
+    used = {name: value for name, value in params.items() if value not in (None, '') and name not in IGNORED_PARAMS}
+    filters = sorted(name for name in used if name in BlogViewFilter.base_filters)
+    return filters, {name: used[name] for name in sorted(used) if name not in BlogViewFilter.base_filters}
+
+
+def row_count(data):
+    """Rows in a serialized analytics payload: a list, a {next, results} page or a dashboard."""
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        if isinstance(data.get('results'), list):
+            return len(data['results'])
+        counts = [row_count(value) for value in data.values()]
+        if counts and None not in counts:
+            return sum(counts)
+    return None
+
+
+class AnalyticsInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        conf = instrumentation_settings()
+        if not self._applies(request, conf):
+            return self.get_response(request)
+        stats, token, start = self._start(conf)
+        try:
+            response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        record = self._finish(request, response, stats, start)
+        if self._is_slow(record, conf):
+            self._log_slow(record, stats, conf)
+        return response
+
+    async def __acall__(self, request):
+        conf = instrumentation_settings()
+        if not self._applies(request, conf):
+            return await self.get_response(request)
+        stats, token, start = self._start(conf)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _stats.reset(token)
+        record = self._finish(request, response, stats, start)
+        if self._is_slow(record, conf):
+            self._log_slow(record, stats, conf)
+        return response
+
+    def _applies(self, request, conf):
+        return conf['ENABLED'] and request.path.startswith(conf['PATH_PREFIX'])
+
+    def _start(self, conf):
+        stats = RequestStats(conf['EXPLAIN_QUERIES'])
+        return stats, _stats.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.db_time * 1000
+        # db sums every query, so it exceeds total when the dashboard runs them concurrently
+        timing = (
+            f'db;dur={db_ms:.1f};desc="{stats.queries} queries", '
+            f'app;dur={max(total_ms - db_ms, 0):.1f}, total;dur={total_ms:.1f}'
+        )
+        existing = response.get('Server-Timing')
+        response['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+        filters, params = normalized_filters(request.GET)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'db_ms': round(db_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'rows': row_count(getattr(response, 'data', None)),
+            'filters': filters,
+            'params': params,
+            'cache': response.get('X-Cache'),
+        }
+        request_logger.info(json.dumps(record))
+        return record
+
+    def _is_slow(self, record, conf):
+        return record['total_ms'] >= conf['SLOW_MS'] and random.random() < conf['SLOW_SAMPLE_RATE']
+
+    def _log_slow(self, record, stats, conf):
+        slowest = [(duration, alias, sql, params)
+                   for duration, _, alias, sql, params in sorted(stats.slowest, reverse=True)]
+        if not get_slow_log().offer(record, slowest, conf['EXPLAIN_ANALYZE']):
+            log_slow(record, slowest, explained=False)
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Country',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('code', models.CharField(max_length=2, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('value', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Blog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(db_index=True, max_length=255)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blogs', to=settings.AUTH_USER_MODEL)),
+                ('country', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='blogs', to='analytics.country')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BlogViewHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='analytics.blog')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('viewer_country', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analytics.country')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['bucket', 'viewer_country'], name='analytics_b_bucket_199b0c_idx'), models.Index(fields=['user', 'bucket'], name='analytics_b_user_id_20594f_idx'), models.Index(fields=['blog', 'bucket'], name='analytics_b_blog_id_e66954_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BlogViewDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='analytics.blog')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('viewer_country', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analytics.country')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['bucket', 'viewer_country'], name='analytics_b_bucket_652868_idx'), models.Index(fields=['user', 'bucket'], name='analytics_b_user_id_9c6a69_idx'), models.Index(fields=['blog', 'bucket'], name='analytics_b_blog_id_b008d6_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BlogView',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='views', to='analytics.blog')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='blog_views', to=settings.AUTH_USER_MODEL)),
+                ('viewer_country', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='analytics.country')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['viewed_at'], name='analytics_b_viewed__cc8f95_idx'), models.Index(fields=['viewer_country'], name='analytics_b_viewer__59ad37_idx'), models.Index(fields=['user'], name='analytics_b_user_id_e3cbfb_idx'), models.Index(fields=['blog', 'viewed_at'], name='analytics_b_blog_id_dbf85e_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(fields=['author', 'created_at'], name='analytics_b_author__43b6cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(fields=['country', 'created_at'], name='analytics_b_country_3364b7_idx'),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BRIN_INDEX = 'blogview_viewed_at_brin'
+
+
+def create_brin_index(apps, schema_editor):
+    """BRIN on viewed_at: a few pages per million rows for append-only, time-ordered inserts."""
+    if schema_editor.connection.vendor != 'postgresql' or not getattr(settings, 'ANALYTICS_BRIN_VIEWED_AT', True):
+        return
+    table = apps.get_model('analytics', 'BlogView')._meta.db_table
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {BRIN_INDEX} ON {schema_editor.quote_name(table)} '
+        f'USING brin (viewed_at) WITH (pages_per_range = 32)'
+    )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {BRIN_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='blogview',
+            name='analytics_b_viewed__cc8f95_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='blogview',
+            name='analytics_b_viewer__59ad37_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='blogview',
+            name='analytics_b_user_id_e3cbfb_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='blogviewdaily',
+            name='analytics_b_bucket_652868_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='blogviewhourly',
+            name='analytics_b_bucket_199b0c_idx',
+        ),
+        migrations.AlterField(
+            model_name='blogview',
+            name='blog',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='views', to='analytics.blog'),
+        ),
+        migrations.AlterField(
+            model_name='blogview',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='blog_views', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='blogview',
+            name='viewer_country',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='analytics.country'),
+        ),
+        migrations.AlterField(
+            model_name='blogviewdaily',
+            name='blog',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='analytics.blog'),
+        ),
+        migrations.AlterField(
+            model_name='blogviewdaily',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='blogviewdaily',
+            name='viewer_country',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analytics.country'),
+        ),
+        migrations.AlterField(
+            model_name='blogviewhourly',
+            name='blog',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='analytics.blog'),
+        ),
+        migrations.AlterField(
+            model_name='blogviewhourly',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='blogviewhourly',
+            name='viewer_country',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analytics.country'),
+        ),
+        migrations.AddIndex(
+            model_name='blogview',
+            index=models.Index(fields=['viewed_at', 'viewer_country'], include=('blog', 'user'), name='blogview_time_country_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='blogview',
+            index=models.Index(fields=['viewer_country', 'viewed_at'], include=('blog',), name='blogview_country_time_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='blogview',
+            index=models.Index(fields=['user', 'viewed_at'], include=('blog',), name='blogview_user_time_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='blogviewdaily',
+            index=models.Index(fields=['bucket', 'viewer_country'], include=('blog', 'user', 'views'), name='blogviewdaily_bucket_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='blogviewhourly',
+            index=models.Index(fields=['bucket', 'viewer_country'], include=('blog', 'user', 'views'), name='blogviewhourly_bucket_cov'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
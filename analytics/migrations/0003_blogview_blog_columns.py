@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogview',
+            name='blog_author',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='blogview',
+            name='blog_country',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='analytics.country'),
+        ),
+        migrations.AddField(
+            model_name='blogviewdaily',
+            name='blog_author',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='blogviewdaily',
+            name='blog_country',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='analytics.country'),
+        ),
+        migrations.AddField(
+            model_name='blogviewhourly',
+            name='blog_author',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='blogviewhourly',
+            name='blog_country',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='analytics.country'),
+        ),
+        migrations.AddIndex(
+            model_name='blogview',
+            index=models.Index(fields=['blog_author', 'viewed_at'], include=('blog',), name='blogview_author_time_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='blogviewdaily',
+            index=models.Index(fields=['blog_author', 'bucket'], name='analytics_b_blog_au_890d9b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogviewhourly',
+            index=models.Index(fields=['blog_author', 'bucket'], name='analytics_b_blog_au_e0fbeb_idx'),
+        ),
+    ]
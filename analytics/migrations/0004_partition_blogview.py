@@ -0,0 +1,140 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations
+
+TABLE = 'analytics_blogview'
+STAGING = 'analytics_blogview_unpartitioned'
+SEQUENCE = 'analytics_blogview_id_seq'
+
+
+def _month(dt):
+    return datetime(dt.year, dt.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _next_month(month):
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def _relkind(cursor, name):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [name])
+    row = cursor.fetchone()
+    return row and row[0]
+
+
+def _detach_definitions(cursor, table):
+    """
+    Drop the indexes, primary key and foreign keys of `table` (so their names
+    can be reused) and return the statements that recreate them on TABLE.
+    """
+    cursor.execute(
+        "SELECT c.conname, pg_get_constraintdef(c.oid) FROM pg_constraint c "
+        "WHERE c.conrelid = to_regclass(%s) AND c.contype = 'f'",
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(i.oid), x.indisprimary FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = to_regclass(%s)",
+        [table],
+    )
+    indexes = cursor.fetchall()
+
+    statements = []
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+        statements.append(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+    for name, definition, primary in indexes:
+        if primary:
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+        else:
+            cursor.execute(f'DROP INDEX {name}')
+            # Partitioned indexes print as "ON ONLY", which would skip the partitions
+            definition = definition.replace(' ON ONLY ', ' ON ')
+            statements.append(definition.replace(f' ON {table} ', f' ON {TABLE} ')
+                              .replace(f'.{table} ', f'.{TABLE} '))
+    return statements
+
+
+def partition_blogview(apps, schema_editor):
+    """
+    Rebuild analytics_blogview as a table PARTITION BY RANGE (viewed_at) with
+    a partition per month of existing data (plus AHEAD_MONTHS) and a DEFAULT
+    partition. The primary key becomes (id, viewed_at), as PostgreSQL requires
+    the partition key in unique constraints; ids still come from one sequence.
+    Copies every row, so run it in a maintenance window on large tables.
+    """
+    conf = getattr(settings, 'ANALYTICS_PARTITIONS', {})
+    if schema_editor.connection.vendor != 'postgresql' or not conf.get('ENABLED', True):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if _relkind(cursor, TABLE) == 'p':
+            return
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {STAGING}')
+        statements = _detach_definitions(cursor, STAGING)
+        cursor.execute(f'ALTER TABLE {STAGING} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE {STAGING} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCE}')
+
+        cursor.execute(f'CREATE TABLE {TABLE} (LIKE {STAGING}) PARTITION BY RANGE (viewed_at)')
+        cursor.execute(f'CREATE SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, viewed_at)')
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'SELECT min(viewed_at), max(viewed_at), now() FROM {STAGING}')
+        first, last, now = cursor.fetchone()
+        month = _month(first or now)
+        until = _month(max(last or now, now))
+        for _ in range(conf.get('AHEAD_MONTHS', 3)):
+            until = _next_month(until)
+        while month <= until:
+            upper = _next_month(month)
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+            )
+            month = upper
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {STAGING}')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE(max(id), 0) + 1, false) FROM {TABLE}")
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(f'DROP TABLE {STAGING}')
+        cursor.execute(f'ANALYZE {TABLE}')
+
+
+def unpartition_blogview(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if _relkind(cursor, TABLE) != 'p':
+            return
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {STAGING}')
+        statements = _detach_definitions(cursor, STAGING)
+        cursor.execute(f'ALTER TABLE {STAGING} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCE}')
+
+        cursor.execute(f'CREATE TABLE {TABLE} (LIKE {STAGING})')
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {STAGING}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)')
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), COALESCE(max(id), 0) + 1, false) FROM {TABLE}"
+        )
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(f'DROP TABLE {STAGING}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_blogview_blog_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_blogview, unpartition_blogview),
+    ]
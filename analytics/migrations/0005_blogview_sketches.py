@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_partition_blogview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlogViewSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('dimension', models.CharField(choices=[('country', 'Viewer country'), ('user', 'Viewer user')], max_length=16)),
+                ('key', models.BigIntegerField(blank=True, null=True)),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('registers', models.BinaryField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', 'bucket', 'key'], include=('views',), name='blogviewsketch_bucket_cov')],
+            },
+        ),
+    ]
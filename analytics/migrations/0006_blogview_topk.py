@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_blogview_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlogViewTopK',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('dimension', models.CharField(choices=[('country', 'Viewer country'), ('user', 'Viewer user'), ('blog', 'Blog')], max_length=16)),
+                ('floor', models.PositiveBigIntegerField(default=0)),
+                ('counters', models.BinaryField(default=b'')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'bucket'), name='blogviewtopk_dimension_bucket')],
+            },
+        ),
+    ]
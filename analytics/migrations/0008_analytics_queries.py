@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_export_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('action', models.CharField(max_length=32)),
+                ('params', models.JSONField(default=dict)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('last_seen', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
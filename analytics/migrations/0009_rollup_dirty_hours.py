@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_analytics_queries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupDirtyHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(unique=True)),
+            ],
+        ),
+    ]
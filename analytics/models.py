@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Country(models.Model):
     name = models.CharField(max_length=100, db_index=True)
@@ -19,15 +22,143 @@ class Blog(models.Model):
         ]
 
 class BlogView(models.Model):
-    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='views')
-    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='blog_views')
-    viewer_country = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True)
-    viewed_at = models.DateTimeField(auto_now_add=True)
+    # FK indexes are replaced by the composites below, which lead with each FK
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='views', db_index=False)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='blog_views', db_index=False)
+    viewer_country = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, db_index=False)
+    viewed_at = models.DateTimeField(default=timezone.now)  # not auto_now_add: bulk ingest keeps event times
+    # Copies of blog.author / blog.country so filters and aggregations never join Blog.
+    # Set at ingest, kept in sync by analytics.denormalize, backfilled by backfill_blog_columns.
+    blog_author = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                    db_constraint=False, db_index=False, related_name='+')
+    blog_country = models.ForeignKey(Country, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                     db_constraint=False, db_index=False, related_name='+')
 
     class Meta:
+        # INCLUDE columns are PostgreSQL only; other backends build plain composites.
+        # A BRIN index on viewed_at is added on PostgreSQL by migration 0002.
         indexes = [
-            models.Index(fields=['viewed_at']),
-            models.Index(fields=['viewer_country']),
-            models.Index(fields=['user']),
-            models.Index(fields=['blog', 'viewed_at']),  # for time filtering
+            # range=/viewed_at_* window grouped by viewer country or user (index-only on PostgreSQL)
+            models.Index(fields=['viewed_at', 'viewer_country'], include=['blog', 'user'], name='blogview_time_country_cov'),
+            # viewer_country=XX within a window
+            models.Index(fields=['viewer_country', 'viewed_at'], include=['blog'], name='blogview_country_time_cov'),
+            # user=N within a window, ON DELETE SET NULL lookups
+            models.Index(fields=['user', 'viewed_at'], include=['blog'], name='blogview_user_time_cov'),
+            # blog_author=N within a window and performance?user=N
+            models.Index(fields=['blog_author', 'viewed_at'], include=['blog'], name='blogview_author_time_cov'),
+            # top=blog, per-blog resync of the denormalized columns
+            models.Index(fields=['blog', 'viewed_at']),
         ]
+
+class BlogViewRollup(models.Model):
+    """Pre-aggregated BlogView counts keyed by (bucket, blog, viewer_country, user)."""
+    bucket = models.DateTimeField()
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='+', db_index=False)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+', db_index=False)
+    viewer_country = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, related_name='+', db_index=False)
+    blog_author = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                    db_constraint=False, db_index=False, related_name='+')
+    blog_country = models.ForeignKey(Country, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                     db_constraint=False, db_index=False, related_name='+')
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        indexes = [
+            models.Index(fields=['bucket', 'viewer_country'], include=['blog', 'user', 'views'], name='%(class)s_bucket_cov'),
+            models.Index(fields=['user', 'bucket']),
+            models.Index(fields=['blog', 'bucket']),
+            models.Index(fields=['blog_author', 'bucket']),
+        ]
+
+class BlogViewHourly(BlogViewRollup):
+    class Meta(BlogViewRollup.Meta):
+        pass
+
+class BlogViewDaily(BlogViewRollup):
+    class Meta(BlogViewRollup.Meta):
+        pass
+
+class BlogViewSketch(models.Model):
+    """
+    Per day and viewer country (or viewer user): total views and a
+    HyperLogLog sketch of the blogs viewed, built from BlogViewDaily.
+    See analytics.sketches.
+    """
+    COUNTRY = 'country'
+    USER = 'user'
+    DIMENSIONS = [(COUNTRY, 'Viewer country'), (USER, 'Viewer user')]
+
+    bucket = models.DateTimeField()
+    dimension = models.CharField(max_length=16, choices=DIMENSIONS)
+    key = models.BigIntegerField(null=True, blank=True)  # viewer_country_id / user_id
+    views = models.PositiveBigIntegerField(default=0)
+    registers = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dimension', 'bucket', 'key'], include=['views'], name='blogviewsketch_bucket_cov'),
+        ]
+
+class BlogViewTopK(models.Model):
+    """
+    Per day and viewer country, viewer user or blog: a Space-Saving summary
+    of the most viewed keys, kept at ingest and rebuilt from BlogViewDaily.
+    See analytics.topk.
+    """
+    COUNTRY = 'country'
+    USER = 'user'
+    BLOG = 'blog'
+    DIMENSIONS = [(COUNTRY, 'Viewer country'), (USER, 'Viewer user'), (BLOG, 'Blog')]
+
+    bucket = models.DateTimeField()
+    dimension = models.CharField(max_length=16, choices=DIMENSIONS)
+    floor = models.PositiveBigIntegerField(default=0)  # no key left out of counters has more views
+    counters = models.BinaryField(default=b'')  # int64 (key, count, error) triples
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'bucket'], name='blogviewtopk_dimension_bucket'),
+        ]
+
+class RollupWatermark(models.Model):
+    """
+    Exclusive upper bound of the buckets a rollup table has been refreshed up
+    to, or for the horizons, of the compacted history (analytics.retention).
+    """
+    name = models.CharField(max_length=32, unique=True)  # 'hourly' | 'daily' | 'sketch' | 'topk' | 'raw_horizon' | 'hourly_horizon'
+    value = models.DateTimeField()
+
+class RollupDirtyHour(models.Model):
+    """An already rolled up hour that got raw views afterwards, re-aggregated by refresh_rollups()."""
+    bucket = models.DateTimeField(unique=True)
+
+class ExportJob(models.Model):
+    """A background export of filtered BlogView rows to a file, see analytics.exports."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    CSV = 'csv'
+    PARQUET = 'parquet'
+    FORMATS = [(CSV, 'Gzipped CSV'), (PARQUET, 'Parquet')]
+
+    # Random ids: the download URL is the only access check
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    format = models.CharField(max_length=16, choices=FORMATS, default=CSV)
+    params = models.JSONField(default=dict)  # BlogViewFilter parameters, range resolved to viewed_at bounds
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    rows = models.PositiveBigIntegerField(default=0)  # written so far
+    total = models.PositiveBigIntegerField(null=True)  # rows expected, from the rollups
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_at = models.DateTimeField(null=True)
+
+class AnalyticsQuery(models.Model):
+    """How often a normalized analytics query was requested, see analytics.api.warming."""
+    key = models.CharField(max_length=40, unique=True)  # sha1 of the action and params
+    action = models.CharField(max_length=32)
+    params = models.JSONField(default=dict)  # normalized query parameters
+    hits = models.PositiveBigIntegerField(default=0)
+    last_seen = models.DateTimeField(db_index=True)
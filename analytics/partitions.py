@@ -0,0 +1,199 @@
+"""
+Monthly range partitions of analytics_blogview (PostgreSQL only).
+
+Migration 0004 turns the table into a parent PARTITION BY RANGE (viewed_at)
+with one child per calendar month (UTC) and a DEFAULT partition catching
+rows outside every month created so far. Django keeps reading and writing
+the parent; PostgreSQL prunes to the months a viewed_at filter touches.
+`manage.py manage_partitions` creates months ahead of time and detaches or
+drops expired ones, so retention is a metadata change instead of a DELETE.
+
+DETACH takes an ACCESS EXCLUSIVE lock on the parent, which stalls every read
+and write, so nothing is scanned while it is held: months are built as
+standalone tables and ATTACHed (SHARE UPDATE EXCLUSIVE), and partitions are
+checked under a SHARE lock of their own before the DETACH. DETACH
+CONCURRENTLY is not an option, PostgreSQL refuses it next to a DEFAULT
+partition.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+
+from .models import BlogView
+
+PARENT = BlogView._meta.db_table
+DEFAULT_PARTITION = f'{PARENT}_default'
+PARTITION_RE = re.compile(rf'^{PARENT}_p(\d{{4}})(\d{{2}})$')
+
+DEFAULTS = {
+    'ENABLED': True,      # partition on migrate
+    'AHEAD_MONTHS': 3,    # months created past the current one
+    'RETAIN_MONTHS': 0,   # complete months kept by manage_partitions; 0 keeps everything
+    'LOCK_TIMEOUT': 1.0,  # seconds a drop waits for the parent's lock before leaving it to the next run
+}
+
+
+def partition_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_PARTITIONS', {})}
+
+
+def month_floor(dt):
+    return dt.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{PARENT}_p{month:%Y%m}'
+
+
+def get_connection(using=None):
+    return connections[using or router.db_for_write(BlogView)]
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [PARENT])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions(connection):
+    """{month: name} of the monthly partitions attached to the parent, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [PARENT],
+        )
+        names = [name for name, in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            year, month = match.groups()
+            months[datetime(int(year), int(month), 1, tzinfo=dt_timezone.utc)] = name
+    return dict(sorted(months.items()))
+
+
+def create_partition(connection, month):
+    """
+    Create the partition for the month starting at `month`; returns False if
+    it already exists. Rows for that month already sitting in the DEFAULT
+    partition are moved into it (PostgreSQL refuses the ATTACH otherwise).
+    """
+    qn = connection.ops.quote_name
+    name = partition_name(month)
+    check = f'{name}_bounds'
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s), to_regclass(%s)', [name, DEFAULT_PARTITION])
+        existing, default = cursor.fetchone()
+        if existing is not None:
+            return False
+
+        # The CHECK proves the bounds, so the ATTACH does not scan the table for them
+        cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(PARENT)} INCLUDING DEFAULTS)')
+        cursor.execute(
+            f"ALTER TABLE {qn(name)} ADD CONSTRAINT {qn(check)} "
+            f"CHECK (viewed_at >= '{lower}' AND viewed_at < '{upper}')"
+        )
+        if default is not None:
+            # Holds off writers to DEFAULT until the ATTACH, but not readers
+            cursor.execute(f'LOCK TABLE {qn(DEFAULT_PARTITION)} IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {qn(DEFAULT_PARTITION)} '
+                f'WHERE viewed_at >= %s AND viewed_at < %s RETURNING *) '
+                f'INSERT INTO {qn(name)} SELECT * FROM moved',
+                [lower, upper],
+            )
+        # SHARE UPDATE EXCLUSIVE on the parent; DEFAULT, holding strays only, is scanned for the month's rows
+        cursor.execute(
+            f"ALTER TABLE {qn(PARENT)} ATTACH PARTITION {qn(name)} "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+        cursor.execute(f'ALTER TABLE {qn(name)} DROP CONSTRAINT {qn(check)}')
+    return True
+
+
+def ensure_partitions(connection, since, until):
+    """Create every missing monthly partition from since's month through until's; returns their names."""
+    created = []
+    month, last = month_floor(since), month_floor(until)
+    while month <= last:
+        if create_partition(connection, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def expired_partitions(connection, before):
+    """Names of monthly partitions that hold only rows older than `before`."""
+    return [name for month, name in partitions(connection).items() if add_months(month, 1) <= before]
+
+
+def detach_partition(connection, name, drop=False):
+    """
+    Detach a partition from the parent, keeping it as a standalone table for
+    archiving (pg_dump, SET SCHEMA) or dropping it when `drop` is set.
+    """
+    qn = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(PARENT)} DETACH PARTITION {qn(name)}')
+        if drop:
+            cursor.execute(f'DROP TABLE {qn(name)}')
+        else:
+            # The id default would otherwise tie the archive to the parent's sequence
+            cursor.execute(f'ALTER TABLE {qn(name)} ALTER COLUMN id DROP DEFAULT')
+
+
+def drop_empty_partition(connection, name):
+    """Drop a partition if it holds no rows; returns whether it did. See _drop_checked()."""
+    def empty(cursor):
+        cursor.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {connection.ops.quote_name(name)})')
+        return cursor.fetchone()[0]
+    return _drop_checked(connection, name, empty)
+
+
+def drop_rolled_up_partition(connection, name, rows):
+    """
+    Drop a partition if it holds exactly `rows` rows, the ones its rollups
+    were built from; returns whether it did. A row written or deleted since
+    the rollup keeps it attached.
+    """
+    def unchanged(cursor):
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(name)}')
+        return cursor.fetchone()[0] == rows
+    return _drop_checked(connection, name, unchanged)
+
+
+def _drop_checked(connection, name, check):
+    """
+    Detach and drop a partition if check(cursor) is true of its rows; returns
+    whether it did. The check runs while the partition is still attached,
+    under a SHARE lock that holds off its writers but neither its readers nor
+    the other partitions, so no row can slip in before the DROP. Only then is
+    the parent locked for the DETACH itself. If that lock is not granted
+    within LOCK_TIMEOUT, e.g. behind a long query, or a writer of the
+    partition deadlocks with it, the partition is kept for the next run.
+    """
+    qn = connection.ops.quote_name
+    timeout = f"{int(partition_settings()['LOCK_TIMEOUT'] * 1000)}ms"
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", [timeout])
+            cursor.execute(f'LOCK TABLE {qn(name)} IN SHARE MODE')
+            if not check(cursor):
+                return False
+            cursor.execute(f'ALTER TABLE {qn(PARENT)} DETACH PARTITION {qn(name)}')
+            cursor.execute(f'DROP TABLE {qn(name)}')
+    except OperationalError:
+        return False
+    return True
@@ -0,0 +1,110 @@
+"""
+Calendar periods in the current time zone and the `range` windows built on them.
+
+`range` is either rolling (day, week, month, year: the last 1, 7, 30 or 365
+days up to now) or calendar-aligned:
+
+- current_day, current_week, current_month, current_year: from the start of
+  the day, ISO week, month or year containing now;
+- last_N_days, last_N_weeks, last_N_months, last_N_years (N = 1-999): the N
+  complete periods before the current one.
+
+Periods start at midnight in the current time zone, which the views take
+from ?tz=. A calendar window keeps the same bounds for every request made
+during a period, so its responses can be cached, and when its bounds fall
+on rollup bucket boundaries it is answered from the rollups alone. snap()
+says which rollup buckets never straddle a period boundary.
+"""
+import re
+from datetime import timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.utils import timezone
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+MICROSECOND = timedelta(microseconds=1)
+UNITS = ('day', 'week', 'month', 'year')
+
+# Rolling windows selected by the `range` query parameter
+TIME_RANGES = {
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+}
+CALENDAR_RANGE = re.compile(
+    r'current_(?P<current>day|week|month|year)|last_(?P<count>[1-9]\d{0,2})_(?P<unit>day|week|month|year)s'
+)
+
+
+def get_zone(name):
+    """ZoneInfo of an IANA time zone name; ValueError for unknown names."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}") from None
+
+
+def floor_period(dt, unit):
+    """Start of the day/ISO week/month/year containing dt in the current time zone, like the Trunc functions."""
+    day = timezone.localtime(dt).replace(hour=0, minute=0, second=0, microsecond=0, fold=0)
+    if unit == 'week':
+        return add_periods(day, 'day', -day.weekday())
+    if unit == 'month':
+        return day.replace(day=1)
+    if unit == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def add_periods(dt, unit, periods):
+    """Move a period start by `periods` periods, in wall-clock time so that DST changes keep midnights."""
+    if unit in ('day', 'week'):
+        return dt + periods * (7 if unit == 'week' else 1) * DAY
+    index = dt.year * 12 + dt.month - 1 + periods * (12 if unit == 'year' else 1)
+    return dt.replace(year=index // 12, month=index % 12 + 1)
+
+
+def boundaries(first, last, unit):
+    """Period starts from `first` through `last`."""
+    while first <= last:
+        yield first
+        first = add_periods(first, unit, 1)
+
+
+def snap(starts):
+    """
+    Largest rollup bucket (DAY, HOUR, or None for raw rows only) of which
+    no bucket contains any of the period `starts` other than at its own start.
+    """
+    grain = DAY
+    for start in starts:
+        utc = start.astimezone(dt_timezone.utc)
+        if utc.minute or utc.second or utc.microsecond:
+            return None
+        if utc.hour:
+            grain = HOUR
+    return grain
+
+
+def is_calendar(time_range):
+    return time_range is not None and CALENDAR_RANGE.fullmatch(time_range) is not None
+
+
+def range_window(time_range, now=None):
+    """
+    (start, end) of a `range` value, end inclusive like viewed_at_lte and
+    None while the window is still open. (None, None) for no/unknown range.
+    """
+    now = now or timezone.now()
+    delta = TIME_RANGES.get(time_range)
+    if delta:
+        return now - delta, None
+    match = CALENDAR_RANGE.fullmatch(time_range or '')
+    if match is None:
+        return None, None
+    if match['current']:
+        return floor_period(now, match['current']), None
+    current = floor_period(now, match['unit'])
+    return add_periods(current, match['unit'], -int(match['count'])), current - MICROSECOND
@@ -0,0 +1,187 @@
+"""
+Tiered retention: raw BlogView rows for RAW_DAYS, hourly rollups for
+HOURLY_DAYS, daily rollups forever.
+
+compact() (`manage.py compact_views`) works through the expired days
+oldest first, one transaction per chunk. It rolls each day's raw rows up
+once more, so views that arrived after the last refresh_rollups are kept,
+deletes them and moves the 'raw_horizon' watermark past the day. Expired
+hourly rows are deleted behind 'hourly_horizon' the same way. Raw rows are
+only compacted once the hourly rollups cover them, hourly rows once the
+daily rollups do and the raw horizon has passed them. Daily buckets that
+change get their sketches and top-K summaries rebuilt.
+
+On a partitioned PostgreSQL table (analytics.partitions) raw rows expire a
+month at a time instead: each monthly partition that ended before the
+cutoff is rolled up, then detached and dropped whole, without a DELETE, so
+the table and its indexes shrink instead of waiting for VACUUM. A month
+whose rows changed while it was rolled up stays until the next run.
+
+rollups.plan() reads only the compacted tiers before a horizon, so every
+query keeps covering the whole history: at hourly resolution before the
+raw horizon and daily before the hourly one. Raw rows written behind a
+horizon later on are added to the compacted buckets by the next run.
+"""
+import logging
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from . import columnar, partitions, rollups, sketches, topk
+from .models import BlogView, BlogViewDaily, BlogViewHourly
+from .rollups import DAY, HOURLY_HORIZON, RAW_HORIZON, floor_day
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RAW_DAYS': 0,     # days of raw views kept; 0 keeps everything
+    'HOURLY_DAYS': 0,  # days of hourly rollups kept; 0 keeps everything
+}
+
+
+def retention_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_RETENTION', {})}
+
+
+def cutoffs(now=None):
+    """(raw, hourly) day boundaries before which the tiers may be compacted, None for keep everything."""
+    conf = retention_settings()
+    now = now or timezone.now()
+    raw = floor_day(now - timedelta(days=conf['RAW_DAYS'])) if conf['RAW_DAYS'] > 0 else None
+    hourly = floor_day(now - timedelta(days=conf['HOURLY_DAYS'])) if conf['HOURLY_DAYS'] > 0 else None
+    columnar_conf = columnar.columnar_settings()
+    if raw is not None and columnar_conf['ENABLED']:
+        # The in-memory store loads the raw rows of its last DAYS
+        raw = min(raw, floor_day(now - timedelta(days=columnar_conf['DAYS'])))
+    return raw, hourly
+
+
+def compact(now=None, chunk=DAY):
+    """Fold late raw rows, then compact the raw and hourly tiers; returns (raw, hourly) rows deleted."""
+    raw_cutoff, hourly_cutoff = cutoffs(now)
+    chunk = max(chunk, DAY)
+    raw = _fold_late_rows()
+    marks = rollups.watermarks()
+
+    if raw_cutoff is not None and marks.get('hourly') is not None:
+        raw_cutoff = min(raw_cutoff, floor_day(marks['hourly']))
+        connection = partitions.get_connection()
+        if partitions.is_partitioned(connection):
+            raw += _drop_partitions(connection, raw_cutoff, marks)
+        else:
+            raw += _delete_raw(raw_cutoff, chunk, marks)
+
+    marks = rollups.watermarks()
+    hourly = 0
+    if hourly_cutoff is not None and marks.get('daily') is not None and marks.get(RAW_HORIZON) is not None:
+        hourly_cutoff = min(hourly_cutoff, marks['daily'], marks[RAW_HORIZON])
+        start = (marks.get(HOURLY_HORIZON) or _first_day(BlogViewHourly.objects.filter(bucket__lt=hourly_cutoff), 'bucket')
+                 or hourly_cutoff)
+        while start < hourly_cutoff:
+            stop = min(start + chunk, hourly_cutoff)
+            with transaction.atomic():
+                hourly += BlogViewHourly.objects.filter(bucket__gte=start, bucket__lt=stop).delete()[0]
+                rollups.set_watermark(HOURLY_HORIZON, stop)
+            start = stop
+        rollups.set_watermark(HOURLY_HORIZON, start)
+    return raw, hourly
+
+
+def _delete_raw(raw_cutoff, chunk, marks):
+    """Roll up and delete the raw rows before raw_cutoff a chunk at a time; returns the rows deleted."""
+    start = (marks.get(RAW_HORIZON) or _first_day(BlogView.objects.filter(viewed_at__lt=raw_cutoff), 'viewed_at')
+             or raw_cutoff)
+    deleted = 0
+    while start < raw_cutoff:
+        stop = min(start + chunk, raw_cutoff)
+        with transaction.atomic():
+            _roll_up(start, stop, marks)
+            deleted += BlogView.objects.filter(viewed_at__gte=start, viewed_at__lt=stop).delete()[0]
+            rollups.set_watermark(RAW_HORIZON, stop)
+        start = stop
+    rollups.set_watermark(RAW_HORIZON, start)  # also when there was nothing to delete
+    return deleted
+
+
+def _drop_partitions(connection, raw_cutoff, marks):
+    """
+    Roll up each monthly partition that ended before raw_cutoff, then drop it
+    whole; returns the rows dropped. The raw horizon moves a month at a time.
+    """
+    first = _first_day(BlogView.objects.filter(viewed_at__lt=raw_cutoff), 'viewed_at')
+    if first is not None:
+        # Expired rows in DEFAULT get a month of their own, so they are dropped with it
+        partitions.ensure_partitions(connection, first, raw_cutoff)
+    expired = [(month, name) for month, name in partitions.partitions(connection).items()
+               if partitions.add_months(month, 1) <= raw_cutoff]
+
+    dropped = 0
+    for month, name in expired:
+        stop = partitions.add_months(month, 1)
+        horizon = rollups.watermarks().get(RAW_HORIZON)
+        if horizon is not None and stop <= horizon:
+            # Compacted before; any row left in it is a late one, folded in by the next run
+            partitions.drop_empty_partition(connection, name)
+            continue
+        start = month if horizon is None else max(month, horizon)
+        with transaction.atomic():
+            _roll_up(start, stop, marks)
+        rows = BlogViewHourly.objects.filter(bucket__gte=start, bucket__lt=stop).aggregate(rows=Sum('views'))['rows']
+        if not partitions.drop_rolled_up_partition(connection, name, rows or 0):
+            logger.warning("Kept %s: its views changed while it was rolled up, or the parent table stayed locked; "
+                           "the next run retries", name)
+            break
+        rollups.set_watermark(RAW_HORIZON, stop)
+        dropped += rows or 0
+    else:
+        horizon = rollups.watermarks().get(RAW_HORIZON)
+        cutoff_month = partitions.month_floor(raw_cutoff)
+        if horizon is None or horizon < cutoff_month:
+            rollups.set_watermark(RAW_HORIZON, cutoff_month)  # also when there was nothing to drop
+    return dropped
+
+
+def _roll_up(start, stop, marks):
+    """Rebuild the hourly buckets of the raw rows in [start, stop), then the daily tier where it is past them."""
+    rollups.rebuild_buckets(BlogViewHourly, BlogView, TruncHour, Count('id'), start, stop)
+    if marks.get('daily') is not None and start < marks['daily']:
+        stop = min(stop, marks['daily'])
+        rollups.rebuild_buckets(BlogViewDaily, BlogViewHourly, TruncDay, Sum('views'), start, stop)
+        _rebuild_summaries(start, stop, marks)
+
+
+def _rebuild_summaries(start, stop, marks):
+    """Rebuild the sketches and top-K summaries of the days in [start, stop) their watermarks have passed."""
+    for name, module in (('sketch', sketches), ('topk', topk)):
+        if marks.get(name) is not None and start < marks[name]:
+            module.rebuild(start, min(stop, marks[name]))
+
+
+def _first_day(queryset, field):
+    first = queryset.aggregate(first=Min(field))['first']
+    return floor_day(first) if first is not None else None
+
+
+def _fold_late_rows():
+    """Add raw rows written behind the raw horizon to the compacted buckets and delete them."""
+    marks = rollups.watermarks()
+    horizon = marks.get(RAW_HORIZON)
+    if horizon is None:
+        return 0
+    late = BlogView.objects.filter(viewed_at__lt=horizon)
+    folded = 0
+    for day in late.datetimes('viewed_at', 'day', tzinfo=dt_timezone.utc):
+        stop = day + DAY
+        with transaction.atomic():
+            if marks.get(HOURLY_HORIZON) is None or day >= marks[HOURLY_HORIZON]:
+                rollups.add_buckets(BlogViewHourly, BlogView, TruncHour, Count('id'), day, stop)
+            # Days past the daily watermark get the views from BlogViewHourly on the next refresh
+            if marks.get('daily') is not None and day < marks['daily']:
+                rollups.add_buckets(BlogViewDaily, BlogView, TruncDay, Count('id'), day, stop)
+                _rebuild_summaries(day, stop, marks)
+            folded += late.filter(viewed_at__gte=day, viewed_at__lt=stop).delete()[0]
+    return folded
@@ -0,0 +1,538 @@
+"""
+Hourly and daily BlogView rollups.
+
+refresh_rollups() aggregates complete buckets past a watermark; aggregate()
+answers a grouped {x, y, z} query by splitting the requested window into
+daily buckets in the middle, hourly buckets around them and raw BlogView
+rows only for the partial hours at the edges (and anything newer than the
+hourly watermark). aggregate_sets() answers several groupings of one window
+in one query, and timeline() builds gap-filled per-period series with
+growth over the same slices. Behind the retention horizons moved by
+analytics.retention only the compacted tiers are read.
+
+Views written behind the hourly watermark, e.g. late events through
+POST /analytics/views/, mark their hour in RollupDirtyHour; the next
+refresh_rollups() rebuilds those hours, their days and the days' sketches
+and top-K summaries.
+"""
+from datetime import timedelta, timezone as dt_timezone
+from itertools import groupby, islice
+
+from django.db import connections, transaction
+from django.db.models import Count, F, Min, Q, Sum, Value
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek, TruncYear
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .api.filters import BlogViewFilter, RollupFilter
+from .ingest import COLUMNS, views_written
+from .models import BlogView, BlogViewDaily, BlogViewHourly, RollupDirtyHour, RollupWatermark
+from .periods import DAY, HOUR, MICROSECOND, add_periods, boundaries, floor_period, snap
+
+BATCH_SIZE = 5000
+STREAM_CHUNK_SIZE = 2000
+# x breaks ties so that keyset pagination on (z, x) sees a total order
+ORDERINGS = {'-z': ('-z', 'x'), 'x': ('x',)}
+PERIODS = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth, 'year': TruncYear}
+# Watermarks before which analytics.retention has deleted the raw rows / hourly buckets
+RAW_HORIZON, HOURLY_HORIZON = 'raw_horizon', 'hourly_horizon'
+
+
+def floor_hour(dt):
+    return dt.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+def ceil_hour(dt):
+    floor = floor_hour(dt)
+    return floor if floor == dt else floor + HOUR
+
+def floor_day(dt):
+    return floor_hour(dt).replace(hour=0)
+
+def ceil_day(dt):
+    floor = floor_day(dt)
+    return floor if floor == dt else floor + DAY
+
+
+def watermarks():
+    return dict(RollupWatermark.objects.values_list('name', 'value'))
+
+def set_watermark(name, value):
+    RollupWatermark.objects.update_or_create(name=name, defaults={'value': value})
+
+
+def _bulk_insert(model, rows):
+    rows = iter(rows)
+    created = 0
+    while batch := [model(**row) for row in islice(rows, BATCH_SIZE)]:
+        model.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def _grouped(source, trunc, count, start, stop):
+    """Rollup rows of the source rows in [start, stop), truncated to the bucket size."""
+    time_field = 'viewed_at' if source is BlogView else 'bucket'
+    rows = (
+        source.objects.filter(**{f'{time_field}__gte': start, f'{time_field}__lt': stop})
+        .values(
+            bucket_start=trunc(time_field),
+            blog_ref=F('blog_id'),
+            country_ref=F('viewer_country_id'),
+            user_ref=F('user_id'),
+            author_ref=F('blog_author_id'),
+            blog_country_ref=F('blog_country_id'),
+        )
+        .annotate(total=count)
+        .order_by()
+    )
+    return (
+        {
+            'bucket': row['bucket_start'],
+            'blog_id': row['blog_ref'],
+            'viewer_country_id': row['country_ref'],
+            'user_id': row['user_ref'],
+            'blog_author_id': row['author_ref'],
+            'blog_country_id': row['blog_country_ref'],
+            'views': row['total'],
+        }
+        for row in rows.iterator(chunk_size=BATCH_SIZE)
+    )
+
+
+def rebuild_buckets(model, source, trunc, count, start, stop):
+    """Replace model's buckets in [start, stop) with source rows truncated to the bucket size."""
+    model.objects.filter(bucket__gte=start, bucket__lt=stop).delete()
+    return _bulk_insert(model, _grouped(source, trunc, count, start, stop))
+
+
+def add_buckets(model, source, trunc, count, start, stop):
+    """
+    Add the source rows in [start, stop) to model's buckets as extra rows;
+    every query sums views, so a bucket may be split over several rows.
+    """
+    return _bulk_insert(model, _grouped(source, trunc, count, start, stop))
+
+
+def mark_dirty(viewed_at):
+    """Record the rolled up hours among the datetimes `viewed_at` for the next refresh_rollups()."""
+    mark = RollupWatermark.objects.filter(name='hourly').values_list('value', flat=True).first()
+    hours = {floor_hour(value) for value in viewed_at if mark is not None and value < mark}
+    RollupDirtyHour.objects.bulk_create([RollupDirtyHour(bucket=hour) for hour in hours], ignore_conflicts=True)
+    return len(hours)
+
+
+@receiver(views_written)
+def _mark_written_rows(sender, rows, columns=COLUMNS, **kwargs):
+    position = columns.index('viewed_at')
+    mark_dirty(row[position] for row in rows)
+
+
+@receiver(post_save, sender=BlogView)
+def _mark_saved_view(sender, instance, **kwargs):
+    mark_dirty([instance.viewed_at])
+
+
+def refresh_dirty():
+    """
+    Rebuild the hours marked by mark_dirty(), then their days in
+    BlogViewDaily, the sketches and the top-K summaries where those are
+    past them. Hours behind the raw horizon are left to
+    analytics.retention, which folds their late rows in. Returns the
+    number of (hourly, daily) rows written.
+    """
+    # Both import this module
+    from . import sketches, topk
+
+    marks = watermarks()
+    hours = sorted(RollupDirtyHour.objects.values_list('bucket', flat=True))
+    hourly = daily = 0
+    for day, day_hours in groupby(hours, key=floor_day):
+        day_hours = list(day_hours)
+        with transaction.atomic():
+            # Deleted first: a view written meanwhile marks its hour again
+            RollupDirtyHour.objects.filter(bucket__in=day_hours).delete()
+            day_hours = [hour for hour in day_hours if marks.get(RAW_HORIZON) is None or hour >= marks[RAW_HORIZON]]
+            if not day_hours:
+                continue
+            for hour in day_hours:
+                hourly += rebuild_buckets(BlogViewHourly, BlogView, TruncHour, Count('id'), hour, hour + HOUR)
+            if marks.get('daily') is not None and day < marks['daily']:
+                daily += rebuild_buckets(BlogViewDaily, BlogViewHourly, TruncDay, Sum('views'), day, day + DAY)
+                if marks.get('sketch') is not None and day < marks['sketch']:
+                    sketches.rebuild(day, day + DAY)
+                if marks.get('topk') is not None and day < marks['topk']:
+                    topk.rebuild(day, day + DAY)
+    return hourly, daily
+
+
+def refresh_rollups(until=None, lookback=timedelta(0), chunk=DAY):
+    """
+    Roll complete hours up to `until` (default: now) into BlogViewHourly and
+    complete days into BlogViewDaily, one transaction per `chunk`, after
+    refresh_dirty(). `lookback` re-aggregates already rolled up buckets.
+    Returns the number of (hourly, daily) rows written.
+    """
+    until = floor_hour(until or timezone.now())
+    hourly, daily = refresh_dirty()
+    marks = watermarks()
+
+    start = marks.get('hourly')
+    if start is None:
+        first = BlogView.objects.aggregate(first=Min('viewed_at'))['first']
+        if first is None:
+            return hourly, daily
+        start = floor_hour(first)
+    start = floor_hour(start - lookback)
+    # Buckets behind a retention horizon can no longer be rebuilt from their source rows
+    if marks.get(RAW_HORIZON):
+        start = max(start, marks[RAW_HORIZON])
+
+    while start < until:
+        stop = min(start + chunk, until)
+        with transaction.atomic():
+            hourly += rebuild_buckets(BlogViewHourly, BlogView, TruncHour, Count('id'), start, stop)
+            set_watermark('hourly', stop)
+        start = stop
+
+    day_until = floor_day(watermarks().get('hourly', until))
+    start = marks.get('daily')
+    if start is None:
+        first = BlogViewHourly.objects.aggregate(first=Min('bucket'))['first']
+        if first is None:
+            return hourly, daily
+        start = floor_day(first)
+    start = floor_day(start - lookback)
+    if marks.get(HOURLY_HORIZON):
+        start = max(start, marks[HOURLY_HORIZON])
+
+    while start < day_until:
+        stop = min(start + max(chunk, DAY), day_until)
+        with transaction.atomic():
+            daily += rebuild_buckets(BlogViewDaily, BlogViewHourly, TruncDay, Sum('views'), start, stop)
+            set_watermark('daily', stop)
+        start = stop
+    return hourly, daily
+
+
+def plan(start, end, marks, grain=DAY):
+    """
+    Split the window [start, end] (either side may be None) into a list of
+    (model, lookups) slices that together cover it exactly once, using
+    rollup buckets up to `grain` (DAY, HOUR or None for raw rows only).
+    Before the retention horizons only whole buckets of the tiers left are
+    read, whatever the grain: hourly before the raw horizon and daily
+    before the hourly one, each counted when it starts inside the window.
+    """
+    def raw(lo=None, hi=None, hi_inclusive=None):
+        lookups = {}
+        if lo is not None:
+            lookups['viewed_at__gte'] = lo
+        if hi is not None:
+            lookups['viewed_at__lt'] = hi
+        if hi_inclusive is not None:
+            lookups['viewed_at__lte'] = hi_inclusive
+        return BlogView, lookups
+
+    def rollup(model, lo, hi):
+        lookups = {'bucket__lt': hi}
+        if lo is not None:
+            lookups['bucket__gte'] = lo
+        return model, lookups
+
+    def buckets(lo, hi, daily_mark):
+        """Hourly buckets in [lo, hi), daily ones for the whole days up to daily_mark."""
+        ds = ceil_day(lo) if lo is not None else None
+        de = min(floor_day(hi), daily_mark) if daily_mark is not None else None
+        if de is None or (ds is not None and ds >= de):
+            return [rollup(BlogViewHourly, lo, hi)]
+        parts = []
+        if lo is not None and lo < ds:
+            parts.append(rollup(BlogViewHourly, lo, ds))
+        parts.append(rollup(BlogViewDaily, ds, de))
+        if de < hi:
+            parts.append(rollup(BlogViewHourly, de, hi))
+        return parts
+
+    slices = []
+    raw_horizon = marks.get(RAW_HORIZON)
+    if raw_horizon is not None and (start is None or start < raw_horizon):
+        lo = ceil_hour(start) if start is not None else None
+        hi = raw_horizon if end is None or end >= raw_horizon else floor_hour(end) + HOUR
+        hourly_horizon = marks.get(HOURLY_HORIZON)
+        if hourly_horizon is not None and (lo is None or lo < hourly_horizon):
+            day_lo, day_hi = ceil_day(lo) if lo is not None else None, min(ceil_day(hi), hourly_horizon)
+            if day_lo is None or day_lo < day_hi:
+                slices.append(rollup(BlogViewDaily, day_lo, day_hi))
+            lo = hourly_horizon
+        if lo is None or lo < hi:
+            slices += buckets(lo, hi, marks.get('daily') if grain == DAY else None)
+        if end is not None and end < raw_horizon:
+            return slices
+        start = raw_horizon
+
+    hourly_mark = marks.get('hourly') if grain else None
+    daily_mark = marks.get('daily') if grain == DAY else None
+    if hourly_mark is None:
+        return slices + [raw(start, hi_inclusive=end)]
+
+    hs = ceil_hour(start) if start is not None else None
+    # viewed_at <= end is viewed_at < end + 1us, so an end just before a bucket boundary needs no raw tail
+    he = min(floor_hour(end + MICROSECOND), hourly_mark) if end is not None else hourly_mark
+    if hs is not None and hs >= he:
+        return slices + [raw(start, hi_inclusive=end)]
+
+    if start is not None and start < hs:
+        slices.append(raw(start, hs))
+    slices += buckets(hs, he, daily_mark)
+    if end is None or he <= end:
+        slices.append(raw(he, hi_inclusive=end))
+    return slices
+
+
+def window(params, start=None, end=None):
+    """Narrow [start, end] to the viewed_at_gte/viewed_at_lte bounds in `params`."""
+    form_start, form_end = BlogViewFilter(params).time_bounds()
+    if form_start is not None:
+        start = form_start if start is None else max(start, form_start)
+    if form_end is not None:
+        end = form_end if end is None else min(end, form_end)
+    return start, end
+
+
+def aggregate(params, group, start=None, end=None, filters=(), distinct=True, order='-z', limit=None,
+              after=None, stream=False):
+    """
+    Grouped {x, y, z} rows over BlogView filtered by BlogViewFilter `params`.
+
+    group(time_field) returns the expression for x; y is the number of
+    distinct blogs (or 1 when distinct is False), z the number of views.
+    `filters` are extra Q objects valid on BlogView and the rollup tables.
+    `after` is the (z, x) of the last row already seen (keyset pagination,
+    order '-z' only). With `stream` an iterator reading the rows through a
+    server-side cursor is returned instead of a list.
+    """
+    start, end = window(params, start, end)
+    querysets = _querysets(params, start, end, filters)
+    if not querysets:
+        return iter(()) if stream else []
+    if len(querysets) == 1:
+        model, qs = querysets[0]
+        time_field, count = source(model)
+        data = (
+            qs.values(x=group(time_field))
+            .annotate(
+                y=Count('blog', distinct=True) if distinct else Value(1),
+                z=count,
+            )
+            .order_by(*ORDERINGS[order])
+            .values('x', 'y', 'z')
+        )
+        if after is not None:
+            data = data.filter(Q(z__lt=after[0]) | Q(z=after[0], x__gt=after[1]))
+        if limit:
+            data = data[:limit]
+        return data.iterator(chunk_size=STREAM_CHUNK_SIZE) if stream else list(data)
+
+    rows = _union_aggregate(querysets, group, distinct, order, limit, after, stream)
+    return rows if stream else list(rows)
+
+
+def aggregate_sets(params, groups, start=None, end=None):
+    """
+    Several aggregate() results from one scan of the filtered window: one
+    list of {x, y, z} rows, ordered by z desc then x, per (group, limit) in
+    `groups`. y counts distinct blogs and groups whose x is NULL are left
+    out. The facts are read once into a CTE and aggregated with GROUPING
+    SETS on PostgreSQL, or a UNION ALL of one GROUP BY per group elsewhere;
+    either way it is a single query.
+    """
+    start, end = window(params, start, end)
+    querysets = _querysets(params, start, end, ())
+    if not querysets or not groups:
+        return [[] for _ in groups]
+
+    columns = {f'k{i}': group for i, (group, _) in enumerate(groups)}
+    facts, params, _, _ = _facts(querysets, **columns)
+    aggregates = 'COUNT(DISTINCT b) AS y, SUM(v) AS z'
+    connection = connections[querysets[0][1].db]
+    if connection.vendor == 'postgresql':
+        sets = ' '.join(f'WHEN GROUPING({name}) = 0 THEN {i}' for i, name in enumerate(columns))
+        keys = ' '.join(f'WHEN GROUPING({name}) = 0 THEN {name}' for name in columns)
+        grouped = (
+            f'SELECT CASE {sets} END AS s, CASE {keys} END AS k, {aggregates} '
+            f'FROM facts GROUP BY GROUPING SETS ({", ".join(f"({name})" for name in columns)})'
+        )
+    else:
+        grouped = ' UNION ALL '.join(
+            f'SELECT {i} AS s, {name} AS k, {aggregates} FROM facts GROUP BY {name}'
+            for i, name in enumerate(columns)
+        )
+    wanted = []
+    for i, (_, limit) in enumerate(groups):
+        if limit:
+            wanted.append(f'(s = {i} AND r <= %s)')
+            params.append(limit)
+        else:
+            wanted.append(f's = {i}')
+    sql = (
+        f'WITH facts AS ({facts}), grouped AS ({grouped}) '
+        f'SELECT s, k, y, z FROM ('
+        f'SELECT s, k, y, z, ROW_NUMBER() OVER (PARTITION BY s ORDER BY z DESC, k) AS r '
+        f'FROM grouped WHERE k IS NOT NULL'
+        f') ranked WHERE {" OR ".join(wanted)} ORDER BY s, r'
+    )
+
+    results = [[] for _ in groups]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for s, k, y, z in cursor.fetchall():
+            results[s].append({'x': k, 'y': y, 'z': int(z)})
+    return results
+
+
+def timeline(params, unit, start, end, filters=()):
+    """
+    Gap-filled [{x, y, z, growth_y, growth_z}] rows, one per `unit` period
+    of the current time zone from the one containing `start` through the one containing `end`, where
+    growth_* is the change in % of y/z against the previous period (None
+    when that was 0). Only the window plus one baseline period is read; the
+    viewed_at bounds in `params` are ignored in favour of start/end.
+    """
+    first, last = floor_period(start, unit), floor_period(end, unit)
+    baseline = add_periods(first, unit, -1)
+    # Rollup buckets are UTC hours and days; only those inside one local period can be used
+    grain = snap(boundaries(baseline, add_periods(last, unit, 1), unit))
+    querysets = _querysets(params, baseline, end, filters, grain)
+    if querysets and connections[querysets[0][1].db].vendor == 'postgresql':
+        return list(_series_sql(querysets, unit, baseline, last))
+
+    # Fallback: fill the gaps and compute LAG() in Python
+    totals = {}
+    if querysets:
+        rows = _union_aggregate(querysets, PERIODS[unit], True, 'x', None, None, False)
+        totals = {row['x']: row for row in rows}
+    return fill_series(totals, unit, baseline, last)
+
+
+def fill_series(totals, unit, baseline, last):
+    """timeline() rows from {period start: {y, z}} totals; `baseline` only seeds the first growth."""
+    results, previous, period = [], None, baseline
+    while period <= last:
+        row = totals.get(period, {'y': 0, 'z': 0})
+        if previous is not None:
+            results.append({
+                'x': period,
+                'y': row['y'],
+                'z': row['z'],
+                'growth_y': _growth(row['y'], previous['y']),
+                'growth_z': _growth(row['z'], previous['z']),
+            })
+        previous, period = row, add_periods(period, unit, 1)
+    return results
+
+
+def _growth(value, previous):
+    return None if not previous else round((value - previous) * 100 / previous, 2)
+
+
+def _querysets(params, start, end, filters, grain=DAY):
+    """(model, queryset) per slice of the window that can match anything."""
+    querysets = []
+    for model, lookups in plan(start, end, watermarks(), grain):
+        qs = model.objects.filter(*filters, blog__isnull=False, **lookups)
+        qs = RollupFilter(params, queryset=qs).qs
+        if not qs.query.is_empty():  # e.g. an unknown country code
+            # Pin the read database now: streamed rows are read after the view returns
+            querysets.append((model, qs.using(qs.db)))
+    return querysets
+
+
+def source(model):
+    """(time field, view count expression) of BlogView or a rollup model."""
+    if model is BlogView:
+        return 'viewed_at', Count('id')
+    return 'bucket', Sum('views')
+
+
+def _facts(querysets, **columns):
+    """
+    UNION ALL of (*columns, b, v) = (group keys, blog, views) facts over
+    every slice, where `columns` maps names to group(time_field) callables.
+    Returns (sql, params, compiler, converters), the last two converting the
+    first column.
+    """
+    parts, params = [], []
+    for model, qs in querysets:
+        time_field, count = source(model)
+        compiler = (
+            qs.values(**{name: group(time_field) for name, group in columns.items()}, b=F('blog_id'))
+            .annotate(v=count)
+            .order_by()
+            .query.get_compiler(using=qs.db)
+        )
+        sql, part_params = compiler.as_sql()
+        parts.append(sql)
+        params.extend(part_params)
+
+    # Converters of the first column (e.g. datetimes on SQLite) from the last slice.
+    first = next(iter(columns))
+    expr = next(col for col, _, alias in compiler.select if alias == first)
+    return " UNION ALL ".join(parts), params, compiler, compiler.get_converters([expr])
+
+
+def _series_sql(querysets, unit, baseline, last):
+    """timeline() on PostgreSQL: generate_series() periods, LEFT JOINed totals and LAG()."""
+    facts, params, compiler, converters = _facts(querysets, x=PERIODS[unit])
+    growth = 'ROUND(100.0 * ({0} - LAG({0}) OVER w) / NULLIF(LAG({0}) OVER w, 0), 2)'
+    # Trunc yields timestamps in the current time zone, so the series is built in it too
+    tzname = timezone.get_current_timezone_name()
+    sql = (
+        f'WITH periods AS ('
+        f'SELECT generate_series(%s::timestamptz AT TIME ZONE %s, %s::timestamptz AT TIME ZONE %s, %s::interval) AS x'
+        f'), totals AS ('
+        f'SELECT x, COUNT(DISTINCT b) AS y, SUM(v) AS z FROM ({facts}) facts GROUP BY x'
+        f'), series AS ('
+        f'SELECT p.x, COALESCE(t.y, 0) AS y, COALESCE(t.z, 0) AS z FROM periods p LEFT JOIN totals t ON t.x = p.x'
+        f') '
+        f'SELECT x, y, z, {growth.format("y")}, {growth.format("z")} FROM series '
+        f'WINDOW w AS (ORDER BY x) ORDER BY x OFFSET 1'
+    )
+    params = [baseline, tzname, last, tzname, f'1 {unit}', *params]
+
+    with connections[querysets[0][1].db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    if converters:
+        rows = compiler.apply_converters(rows, converters)
+    for x, y, z, growth_y, growth_z in rows:
+        yield {
+            'x': x,
+            'y': y,
+            'z': int(z),
+            'growth_y': None if growth_y is None else float(growth_y),
+            'growth_z': None if growth_z is None else float(growth_z),
+        }
+
+
+def _union_aggregate(querysets, group, distinct, order, limit, after, stream):
+    """Aggregate (x, blog, views) facts from every slice in one UNION ALL query; yields rows."""
+    facts, params, compiler, converters = _facts(querysets, x=group)
+    y = 'COUNT(DISTINCT b)' if distinct else '1'
+    sql = f'SELECT x, {y} AS y, SUM(v) AS z FROM ({facts}) facts GROUP BY x'
+    if after is not None:
+        sql += ' HAVING SUM(v) < %s OR (SUM(v) = %s AND x > %s)'
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY z DESC, x' if order == '-z' else ' ORDER BY x'
+    if limit:
+        sql += ' LIMIT %s'
+        params.append(limit)
+
+    connection = connections[querysets[0][1].db]
+    with (connection.chunked_cursor() if stream else connection.cursor()) as cursor:
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(STREAM_CHUNK_SIZE):
+            if converters:
+                rows = compiler.apply_converters(rows, converters)
+            for x, y, z in rows:
+                yield {'x': x, 'y': y, 'z': int(z)}
@@ -0,0 +1,125 @@
+"""
+Read-replica routing for analytics aggregations.
+
+Inside replica_reads() (entered by the AnalyticsViewSet GET actions through
+use_replica) every read goes to the ANALYTICS_REPLICA['ALIAS'] database,
+configured from ANALYTICS_REPLICA_URL. Ingestion, rollup refreshes and
+everything else keep reading and writing the primary.
+
+The replica is only used while it answers and its replay lag is at most
+MAX_LAG seconds. The check runs at most once per CHECK_INTERVAL seconds per
+process, in one thread at a time while the others keep the last known state
+(the primary before the first check); a failing or lagging replica sends
+reads to the primary until the next check.
+"""
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ALIAS': 'replica',
+    'MAX_LAG': 30.0,         # seconds
+    'CHECK_INTERVAL': 5.0,   # seconds between health checks
+}
+
+# 0 on a primary or a standby that has replayed everything it received
+LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+_read_alias = contextvars.ContextVar('analytics_read_alias', default=None)
+_health = {}  # alias -> (checked at, healthy)
+_checking = set()  # aliases a thread is checking right now
+_lock = threading.Lock()
+
+
+def replica_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_REPLICA', {})}
+
+
+def replica_lag(alias):
+    """Replay lag of `alias` in seconds (0 for a database that is not a standby)."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+
+def replica_alias():
+    """The replica alias if it is configured and healthy, else None."""
+    conf = replica_settings()
+    alias = conf['ALIAS']
+    if alias not in settings.DATABASES:
+        return None
+
+    with _lock:
+        checked = _health.get(alias)
+        now = time.monotonic()
+        fresh = checked is not None and now - checked[0] < conf['CHECK_INTERVAL']
+        if fresh or alias in _checking:
+            # Another thread is checking: use the last known state meanwhile
+            return alias if checked is not None and checked[1] else None
+        _checking.add(alias)
+
+    # Outside the lock, so a slow or unreachable replica only holds up this thread
+    healthy = False
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError as exc:
+        logger.warning("Analytics replica '%s' unavailable, reading from the primary: %s", alias, exc)
+        connections[alias].close()
+    else:
+        healthy = lag <= conf['MAX_LAG']
+        if not healthy:
+            logger.warning("Analytics replica '%s' lags %.1fs, reading from the primary", alias, lag)
+    finally:
+        with _lock:
+            _health[alias] = (now, healthy)
+            _checking.discard(alias)
+    return alias if healthy else None
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """Route reads in this block, including threads started through asgiref, to a healthy replica."""
+    token = _read_alias.set(replica_alias())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def use_replica(view_func):
+    """Run a viewset action inside replica_reads()."""
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view_func(*args, **kwargs)
+    return wrapper
+
+
+class AnalyticsReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from the replica are copies of the primary's
+        if {obj1._state.db, obj2._state.db} <= {'default', replica_settings()['ALIAS']}:
+            return True
+        return None
@@ -0,0 +1,314 @@
+"""
+HyperLogLog sketches behind ?approx=true on blog_views and top.
+
+y ("unique blogs") is a COUNT(DISTINCT blog) per group, the most expensive
+part of those queries. BlogViewSketch stores, per day and per viewer country
+or viewer user, the exact view count and an HLL sketch of the blog ids
+viewed. Sketches merge by register-wise maximum, so any window and any set of
+keys is answered from one small row per (day, key); the partial days at the
+window edges come from the hourly/raw tiers and are added id by id.
+
+Error bounds: precision P = 12 (4096 one-byte registers) gives a relative
+standard error of 1.04 / sqrt(4096) ~ 1.6%, i.e. about 68% of estimates
+within 1.6% of the exact count, 95% within 3.3% and 99.7% within 4.9%.
+Below 2.5 * 4096 ~ 10,000 distinct blogs linear counting applies and the
+estimate is close to exact; just above that the raw HLL estimate reads
+about 1% high. z (views) is always exact.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Min, Q, Sum
+
+from . import labels, rollups
+from .api.filters import BlogViewFilter, RollupFilter
+from .ingest import country_codes
+from .models import BlogViewDaily, BlogViewSketch
+
+P = 12
+M = 1 << P
+ALPHA = 0.7213 / (1 + 1.079 / M)
+RANK_BITS = 64 - P
+BATCH_SIZE = 5000
+BLOCK_SIZE = 256  # groups per register matrix in aggregate()
+
+COUNTRY, USER = BlogViewSketch.COUNTRY, BlogViewSketch.USER
+# Key column of each dimension on BlogView and the rollup tables
+KEY_FIELDS = {COUNTRY: 'viewer_country_id', USER: 'user_id'}
+# Filters that only narrow the keys of a dimension, so sketches still apply
+KEY_FILTERS = {COUNTRY: 'viewer_country', USER: 'user'}
+WINDOW_FILTERS = {'viewed_at_gte', 'viewed_at_lte'}
+
+
+def _hash(values):
+    """splitmix64 of integer ids."""
+    h = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def _registers(values):
+    """(register index, rank) of each id."""
+    h = _hash(values)
+    index = (h >> np.uint64(RANK_BITS)).astype(np.intp)
+    rest = (h & np.uint64((1 << RANK_BITS) - 1)).astype(np.float64)  # exact below 2**53
+    # Rank = position of the first 1 bit in the remaining RANK_BITS bits
+    _, bit_length = np.frexp(rest)
+    return index, (RANK_BITS + 1 - bit_length).astype(np.uint8)
+
+
+_INVERSE_POWERS = np.exp2(-np.arange(RANK_BITS + 2, dtype=np.float64))
+
+
+def count_many(matrix):
+    """HyperLogLog estimate of every row of an (n, M) register matrix."""
+    estimates = ALPHA * M * M / _INVERSE_POWERS[matrix].sum(axis=1)
+    zeros = M - np.count_nonzero(matrix, axis=1)
+    small = (estimates <= 2.5 * M) & (zeros > 0)
+    # Linear counting for small cardinalities
+    estimates[small] = M * np.log(M / zeros[small])
+    return [int(round(estimate)) for estimate in estimates]
+
+
+class HyperLogLog:
+    """HyperLogLog sketch of integer ids with M one-byte registers."""
+
+    def __init__(self):
+        self.registers = np.zeros(M, dtype=np.uint8)
+
+    def update(self, values):
+        values = list(values)
+        if values:
+            index, ranks = _registers(values)
+            np.maximum.at(self.registers, index, ranks)
+        return self
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def merge_bytes(self, data):
+        """Merge a to_bytes() payload."""
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        if len(data) == M:
+            np.maximum(self.registers, data, out=self.registers)
+        elif len(data):
+            packed = data.reshape(-1, 3)
+            index = packed[:, 0].astype(np.intp) << 8 | packed[:, 1]
+            np.maximum.at(self.registers, index, packed[:, 2])
+        return self
+
+    def to_bytes(self):
+        """Dense registers, or (index_hi, index_lo, rank) triples when shorter (never M bytes long)."""
+        nonzero = np.flatnonzero(self.registers)
+        if len(nonzero) * 3 >= M:
+            return self.registers.tobytes()
+        packed = np.empty((len(nonzero), 3), dtype=np.uint8)
+        packed[:, 0] = nonzero >> 8
+        packed[:, 1] = nonzero & 0xFF
+        packed[:, 2] = self.registers[nonzero]
+        return packed.tobytes()
+
+    def count(self):
+        return count_many(self.registers[np.newaxis])[0]
+
+
+def rebuild(start, stop):
+    """Replace the sketches of the days in [start, stop) from BlogViewDaily; returns rows written."""
+    BlogViewSketch.objects.filter(bucket__gte=start, bucket__lt=stop).delete()
+    created = 0
+    for dimension, field in KEY_FIELDS.items():
+        rows = BlogViewDaily.objects.filter(bucket__gte=start, bucket__lt=stop, blog__isnull=False)
+        if dimension == USER:
+            rows = rows.filter(user__isnull=False)
+        rows = rows.values_list('bucket', field, 'blog_id', 'views').order_by('bucket', field)
+
+        batch = []
+        for (bucket, key), group in groupby(rows.iterator(chunk_size=BATCH_SIZE), key=itemgetter(0, 1)):
+            group = list(group)
+            batch.append(BlogViewSketch(
+                bucket=bucket,
+                dimension=dimension,
+                key=key,
+                views=sum(row[3] for row in group),
+                registers=HyperLogLog().update(row[2] for row in group).to_bytes(),
+            ))
+            if len(batch) >= BATCH_SIZE:
+                created += len(BlogViewSketch.objects.bulk_create(batch))
+                batch = []
+        created += len(BlogViewSketch.objects.bulk_create(batch))
+    return created
+
+
+def refresh_sketches(lookback=timedelta(0), chunk=rollups.DAY):
+    """Sketch the days rolled up into BlogViewDaily since the 'sketch' watermark; returns rows written."""
+    marks = rollups.watermarks()
+    until = marks.get('daily')
+    if until is None:
+        return 0
+    start = marks.get('sketch')
+    if start is None:
+        first = BlogViewDaily.objects.aggregate(first=Min('bucket'))['first']
+        if first is None:
+            return 0
+        start = rollups.floor_day(first)
+    start = rollups.floor_day(start - lookback)
+
+    written = 0
+    while start < until:
+        stop = min(start + max(chunk, rollups.DAY), until)
+        with transaction.atomic():
+            written += rebuild(start, stop)
+            rollups.set_watermark('sketch', stop)
+        start = stop
+    return written
+
+
+def _filter_values(params):
+    return BlogViewFilter(params).values()
+
+
+def supports(params, dimension):
+    """True when every filter in `params` can be answered from the sketches of `dimension`."""
+    return set(_filter_values(params)) <= WINDOW_FILTERS | {KEY_FILTERS[dimension]}
+
+
+def aggregate(params, dimension, start=None, end=None, limit=None):
+    """
+    Approximate rollups.aggregate() for grouping by viewer country or user id,
+    ordered by views then id: y is a HyperLogLog estimate, x and z are exact.
+    Returns None when `params` hold filters the sketches cannot answer.
+    """
+    if not supports(params, dimension):
+        return None
+    start, end = rollups.window(params, start, end)
+    keys = _filtered_keys(params, dimension)
+    if keys == []:
+        return []
+
+    # The daily tier is only usable as far as it has been sketched
+    marks = rollups.watermarks()
+    if marks.get('daily') is not None:
+        marks['daily'] = min(marks['daily'], marks['sketch']) if marks.get('sketch') else None
+    horizon = marks.get(rollups.HOURLY_HORIZON)
+    if horizon is not None and (marks.get('daily') is None or marks['daily'] < horizon):
+        return None  # days only left in BlogViewDaily that have no sketch yet
+
+    field = KEY_FIELDS[dimension]
+    views = defaultdict(int)
+    edges = defaultdict(list)  # key -> blog ids outside the sketched days
+    days = Q(pk__in=[])
+    for model, lookups in rollups.plan(start, end, marks):
+        if model is BlogViewDaily:
+            days |= Q(**lookups)
+            continue
+        qs = RollupFilter(params, queryset=model.objects.filter(blog__isnull=False, **lookups)).qs
+        if dimension == USER:
+            qs = qs.filter(user__isnull=False)
+        _, count = rollups.source(model)
+        for key, blog_id, total in qs.values_list(field, 'blog_id').annotate(total=count).order_by():
+            views[key] += total
+            edges[key].append(blog_id)
+
+    sketched = BlogViewSketch.objects.filter(days, dimension=dimension)
+    if keys is not None:
+        sketched = sketched.filter(key__in=keys)
+    for key, total in sketched.values_list('key').annotate(total=Sum('views')).order_by():
+        views[key] += total
+
+    groups = _ranked_groups(dimension, views, limit)
+    if limit:
+        wanted = {key for _, group_keys in groups for key in group_keys}
+        selected = Q(key__in=wanted - {None})
+        if None in wanted:
+            selected |= Q(key__isnull=True)
+        sketched = sketched.filter(selected)
+
+    rows = sketched.values_list('key', 'registers').order_by('key').iterator(chunk_size=BATCH_SIZE)
+    estimates = _estimate(groups, _with_edge_keys(rows, edges), edges, block=BLOCK_SIZE)
+    return [
+        {'x': label, 'y': estimates.get(label, 0), 'z': sum(views[key] for key in group_keys)}
+        for label, group_keys in groups
+    ]
+
+
+def _with_edge_keys(rows, edges):
+    """(key, registers) rows followed by an empty row for each key seen only at the edges."""
+    seen = set()
+    for key, registers in rows:
+        seen.add(key)
+        yield key, registers
+    for key in edges:
+        if key not in seen:
+            yield key, b''
+
+
+def _estimate(groups, rows, edges, block):
+    """
+    {label: estimate} for [(label, keys)] from (key, registers) rows and the
+    edge blog ids, merging `block` labels at a time in one register matrix.
+    All keys of a label must arrive within one block.
+    """
+    label_of = {key: label for label, group_keys in groups for key in group_keys}
+    estimates = {}
+    index, pending = {}, []
+
+    def flush():
+        matrix = np.zeros((len(index), M), dtype=np.uint8)
+        sparse = []
+        for row, key, data in pending:
+            if len(data) == M:
+                np.maximum(matrix[row], np.frombuffer(data, dtype=np.uint8), out=matrix[row])
+            elif len(data):
+                sparse.append((row, data))
+        if sparse:
+            packed = np.frombuffer(b''.join(data for _, data in sparse), dtype=np.uint8).reshape(-1, 3)
+            owners = np.repeat([row for row, _ in sparse], [len(data) // 3 for _, data in sparse])
+            np.maximum.at(matrix, (owners, packed[:, 0].astype(np.intp) << 8 | packed[:, 1]), packed[:, 2])
+        edge_keys = {(row, key) for row, key, _ in pending if key in edges}
+        if edge_keys:
+            owners = np.repeat([row for row, _ in edge_keys], [len(edges[key]) for _, key in edge_keys])
+            positions, ranks = _registers([blog_id for _, key in edge_keys for blog_id in edges[key]])
+            np.maximum.at(matrix, (owners, positions), ranks)
+        for label, count in zip(index, count_many(matrix)):
+            estimates[label] = count
+        index.clear()
+        pending.clear()
+
+    for key, data in rows:
+        label = label_of.get(key)
+        if label is None:
+            continue
+        if label not in index:
+            if len(index) >= block:
+                flush()
+            index[label] = len(index)
+        pending.append((index[label], key, data))
+    if index:
+        flush()
+    return estimates
+
+
+def _filtered_keys(params, dimension):
+    """Keys selected by the dimension's own filter: None for all, [] for an unknown country code."""
+    value = _filter_values(params).get(KEY_FILTERS[dimension])
+    if value is None:
+        return None
+    if dimension == COUNTRY:
+        country_id = country_codes.resolve(value)
+        return [] if country_id is None else [country_id]
+    return [int(value)]
+
+
+def _ranked_groups(dimension, views, limit):
+    """[(x, [key])] ordered by views then x like the exact path, the top `limit` only when given."""
+    groups = sorted(
+        ((labels.NO_COUNTRY if key is None else key, [key]) for key in views),
+        key=lambda group: (-views[group[1][0]], group[0]),
+    )
+    return groups[:limit] if limit else groups
@@ -1,3 +1,1558 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from string import ascii_uppercase
+from time import sleep
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from project_config import schema, startup
+from project_config.schema import SchemaView
+from project_config.settings.base import database_config
+
+from . import (
+    columnar, denormalize, exports, ingest, labels, middleware, partitions, periods, retention, rollups, routers,
+    sketches, topk,
+)
+from .api import cache, renderers, warming
+from .api.filters import BlogViewFilter
+from .api.views import GROUPS, AnalyticsViewSet, ExportViewSet
+from .management.commands.benchmark_analytics import benchmark_cases
+from .rollups import refresh_rollups
+from .models import (
+    AnalyticsQuery, Blog, BlogView, BlogViewDaily, BlogViewHourly, BlogViewSketch, BlogViewTopK, Country, ExportJob,
+    RollupDirtyHour, RollupWatermark,
+)
+
+
+HAS_REPLICA = 'replica' in settings.DATABASES
+_module_settings = override_settings(ANALYTICS_REPLICA={'ALIAS': None},
+                                     ANALYTICS_INSTRUMENTATION={'ENABLED': False})
+
+
+def setUpModule():
+    # Fixtures live on the primary and request logs are noise; ReplicaRoutingTests
+    # and InstrumentationTests turn these back on
+    _module_settings.enable()
+
+
+def tearDownModule():
+    _module_settings.disable()
+    # Write the query counts now rather than at exit, after the test database is gone
+    cache.queries.persist()
+
+
+def child_indexes(index):
+    """Names of the per-partition indexes of a partitioned index (PostgreSQL)."""
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [index],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+class AnalyticsAPIMixin:
+    """Calls AnalyticsViewSet actions directly, with the response cache off."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Entered first, so that a class's own override_settings can swap a cache back in
+        cls.enterClassContext(override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            ANALYTICS_CACHE={'ALIAS': 'default'},
+        ))
+        super().setUpClass()
+
+    def request(self, action, params=None, method='get', accept=None):
+        """The response of `action` to a GET with query `params`, or to a POST of `params` as JSON."""
+        headers = {'HTTP_ACCEPT': accept} if accept else {}
+        if method == 'post':
+            request = APIRequestFactory().post('/', params, format='json', **headers)
+        else:
+            request = APIRequestFactory().get('/', params or {}, **headers)
+        return AnalyticsViewSet.as_view({method: action})(request)
+
+    def get(self, action, **params):
+        return self.request(action, params).data
+
+
+class IndexPlanTests(TestCase):
+    """The query shapes of AnalyticsViewSet are answered by the intended indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.country = Country.objects.create(name='Ethiopia', code='ET')
+        cls.blog = Blog.objects.create(title='Blog', content='', author=cls.author, country=cls.country)
+        # Production-like cardinality: ~250 countries, many users, views over a year
+        codes = [a + b for a in ascii_uppercase[:10] for b in ascii_uppercase if a + b != 'ET'][:249]
+        countries = [cls.country] + Country.objects.bulk_create(Country(name=f'Country {code}', code=code) for code in codes)
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(500))
+        blogs = [cls.blog] + [
+            Blog.objects.create(title=f'Blog {i}', content='', author=users[i], country=countries[i])
+            for i in range(1, 50)
+        ]
+        now = timezone.now()
+        if partitions.is_partitioned(connection):
+            partitions.ensure_partitions(connection, now - timedelta(hours=8000), now)
+        BlogView.objects.bulk_create(
+            BlogView(blog=blog, blog_author_id=blog.author_id, blog_country_id=blog.country_id,
+                     user=users[i % 500], viewer_country=countries[i % 250],
+                     viewed_at=now - timedelta(hours=2 * i))
+            for i, blog in ((i, blogs[i % 50]) for i in range(4000))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_bitmapscan = off')
+
+    def window(self, **params):
+        qs = BlogViewFilter(params, queryset=BlogView.objects.all()).qs
+        return qs.filter(viewed_at__gte=timezone.now() - timedelta(days=7))
+
+    def assertUsesIndex(self, qs, *indexes):
+        """The plan reads analytics_blogview through one of `indexes`, never a full table scan."""
+        plan = qs.explain()
+        names = [name for index in indexes for name in [index, *child_indexes(index)]]
+        self.assertTrue(any(name in plan for name in names), plan)
+        self.assertNotIn('Seq Scan on analytics_blogview', plan)
+        self.assertNotRegex(plan, r'(?m)SCAN analytics_blogview\s*$')
+
+    def grouped(self, qs, x):
+        # Same shape as rollups.aggregate() on raw rows
+        return qs.values(x=x).annotate(y=Count('blog', distinct=True), z=Count('id')).order_by('-z')
+
+    def test_window_grouped_by_country(self):
+        qs = self.grouped(self.window(), Coalesce(F('viewer_country_id'), Value(labels.NO_COUNTRY)))
+        # Either the window drives the scan, or partitions are merged in country order
+        self.assertUsesIndex(qs, 'blogview_time_country_cov', 'blogview_country_time_cov')
+
+    def test_window_grouped_by_user(self):
+        qs = self.grouped(self.window().exclude(user__isnull=True), F('user_id'))
+        # Either the window drives the scan, or the planner walks users in group order
+        self.assertUsesIndex(qs, 'blogview_time_country_cov', 'blogview_user_time_cov')
+
+    def test_viewer_country_filter(self):
+        qs = self.window(viewer_country='ET').values('blog')
+        self.assertUsesIndex(qs, 'blogview_country_time_cov')
+
+    def test_user_filter(self):
+        qs = self.window(user=self.author.id).values('blog')
+        self.assertUsesIndex(qs, 'blogview_user_time_cov')
+
+    def test_blog_author_filter(self):
+        qs = self.grouped(self.window(blog_author=self.author.id), F('blog_id'))
+        self.assertUsesIndex(qs, 'blogview_author_time_cov')
+
+    @skipUnless(connection.vendor == 'postgresql', 'BRIN indexes are PostgreSQL only')
+    def test_brin_on_viewed_at(self):
+        # Any btree beats BRIN on a test-sized table, so check the index rather than a plan
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT am.amname FROM pg_class c JOIN pg_am am ON am.oid = c.relam WHERE c.oid = to_regclass(%s)',
+                ['blogview_viewed_at_brin'],
+            )
+            self.assertEqual(cursor.fetchone(), ('brin',))
+        if partitions.is_partitioned(connection):
+            self.assertEqual(len(child_indexes('blogview_viewed_at_brin')), len(partitions.partitions(connection)) + 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning is PostgreSQL only')
+class PartitionTests(TestCase):
+    """analytics_blogview is range partitioned by month and pruned by viewed_at filters."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author')
+        cls.blog = Blog.objects.create(title='Blog', content='', author=author)
+        cls.now = timezone.now()
+        cls.month = partitions.month_floor(cls.now)
+
+    def view(self, viewed_at):
+        return BlogView.objects.create(blog=self.blog, viewed_at=viewed_at)
+
+    def test_table_is_partitioned(self):
+        self.assertTrue(partitions.is_partitioned(connection))
+        self.assertIn(self.month, partitions.partitions(connection))
+
+    def test_window_prunes_other_months(self):
+        partitions.ensure_partitions(connection, self.now - timedelta(days=400), self.now)
+        params = {'viewed_at_gte': self.month.isoformat(), 'viewed_at_lte': self.now.isoformat()}
+        window = BlogViewFilter(params, queryset=BlogView.objects.all()).qs
+        plan = window.values('blog').explain()
+        self.assertIn(partitions.partition_name(self.month), plan)
+        self.assertNotIn(partitions.partition_name(partitions.add_months(self.month, -1)), plan)
+        self.assertNotIn(partitions.DEFAULT_PARTITION, plan)
+
+    def test_create_partition_moves_rows_out_of_default(self):
+        old = self.view(self.now - timedelta(days=3 * 365))
+        month = partitions.month_floor(old.viewed_at)
+        self.assertTrue(partitions.create_partition(connection, month))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {partitions.partition_name(month)}')
+            self.assertEqual(cursor.fetchall(), [(old.id,)])
+            # Still held until the test's transaction ends: readers and writers of the parent were never locked out
+            cursor.execute('SELECT mode FROM pg_locks WHERE pid = pg_backend_pid() AND relation = to_regclass(%s)',
+                           [partitions.PARENT])
+            self.assertNotIn('AccessExclusiveLock', {mode for mode, in cursor.fetchall()})
+        self.assertEqual(BlogView.objects.get(pk=old.pk).viewed_at, old.viewed_at)
+
+    def test_retention_drops_expired_months(self):
+        old = self.view(self.now - timedelta(days=3 * 365))
+        kept = self.view(self.now)
+        partitions.create_partition(connection, partitions.month_floor(old.viewed_at))
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')  # DROP TABLE refuses pending FK checks
+        call_command('manage_partitions', retain_months=12, drop=True, force=True, stdout=io.StringIO())
+        self.assertEqual(list(BlogView.objects.values_list('id', flat=True)), [kept.id])
+        self.assertIn(partitions.add_months(self.month, 3), partitions.partitions(connection))
+
+    def test_changed_partition_is_kept(self):
+        old = self.view(self.now - timedelta(days=3 * 365))
+        month = partitions.month_floor(old.viewed_at)
+        partitions.create_partition(connection, month)
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        # Rolled up without the row written since
+        self.assertFalse(partitions.drop_rolled_up_partition(connection, partitions.partition_name(month), 0))
+        self.assertIn(month, partitions.partitions(connection))
+        self.assertTrue(partitions.drop_rolled_up_partition(connection, partitions.partition_name(month), 1))
+        self.assertFalse(BlogView.objects.filter(pk=old.pk).exists())
+
+    def test_drop_gives_up_behind_long_queries(self):
+        month = partitions.add_months(self.month, 1)
+        name = partitions.partition_name(month)
+        # Another session in the middle of a long read of the parent
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute(f'LOCK TABLE {partitions.PARENT} IN ACCESS SHARE MODE')
+        with self.settings(ANALYTICS_PARTITIONS={'LOCK_TIMEOUT': 0.1}):
+            self.assertFalse(partitions.drop_empty_partition(connection, name))
+            self.assertIn(month, partitions.partitions(connection))
+            other.close()
+            self.assertTrue(partitions.drop_empty_partition(connection, name))
+
+
+@override_settings(ANALYTICS_RETENTION={'RAW_DAYS': 20, 'HOURLY_DAYS': 55})
+class RetentionTests(AnalyticsAPIMixin, TestCase):
+    """compact() deletes expired raw views and hourly rows; the queries read the rollups in their place."""
+
+    @classmethod
+    def setUpTestData(cls):
+        countries = [Country.objects.create(name=f'Country {code}', code=code) for code in ('AA', 'BB')]
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(4))
+        cls.blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=users[i % 4], country=countries[i % 2])
+                     for i in range(6)]
+        cls.now = rollups.floor_hour(timezone.now())
+        BlogView.objects.bulk_create(
+            BlogView(blog=cls.blogs[i % 6], blog_author_id=cls.blogs[i % 6].author_id,
+                     blog_country_id=cls.blogs[i % 6].country_id, user=users[i % 4] if i % 3 else None,
+                     viewer_country=countries[i % 2] if i % 5 else None,
+                     viewed_at=cls.now - timedelta(hours=7, minutes=13) * i - timedelta(minutes=1))
+            for i in range(200)
+        )
+        cls.raw_cutoff, cls.hourly_cutoff = retention.cutoffs(cls.now)
+        # Partitioned tables drop whole months
+        cls.raw_horizon = (partitions.month_floor(cls.raw_cutoff) if partitions.is_partitioned(connection)
+                           else cls.raw_cutoff)
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')  # DROP TABLE refuses pending FK checks
+
+    def responses(self):
+        start = (self.now - timedelta(days=50)).isoformat()
+        end = (self.now - timedelta(days=10)).isoformat()
+        return [
+            self.get('blog_views', object_type='country', range='year'),
+            self.get('blog_views', object_type='user', viewed_at_gte=start, viewed_at_lte=end),
+            self.get('top', top='blog', range='year', viewer_country='BB'),
+            self.get('performance', compare='week', periods=10),
+        ]
+
+    def total(self, **params):
+        return sum(row['z'] for row in self.get('blog_views', object_type='country', range='year', **params))
+
+    def test_queries_span_the_tiers(self):
+        refresh_rollups(until=self.now)
+        # A start inside an hour behind the raw horizon counts that hour's bucket from the next hour on
+        start = self.raw_horizon - timedelta(days=2, minutes=30)
+        partial = BlogView.objects.filter(viewed_at__gte=rollups.ceil_hour(start)).count()
+        expected = self.responses()
+
+        with CaptureQueriesContext(connection) as queries:
+            raw, hourly = retention.compact(now=self.now)
+        self.assertGreater(raw, 0)
+        self.assertGreater(hourly, 0)
+        self.assertEqual(rollups.watermarks()[rollups.RAW_HORIZON], self.raw_horizon)
+        if partitions.is_partitioned(connection):
+            # Expired months are dropped whole instead of deleted row by row
+            self.assertFalse([query for query in queries if query['sql'].startswith('DELETE FROM "analytics_blogview" ')])
+            self.assertEqual(min(partitions.partitions(connection)), self.raw_horizon)
+        self.assertFalse(BlogView.objects.filter(viewed_at__lt=self.raw_horizon).exists())
+        self.assertTrue(BlogView.objects.filter(viewed_at__gte=self.raw_horizon).exists())
+        self.assertFalse(BlogViewHourly.objects.filter(bucket__lt=self.hourly_cutoff).exists())
+        self.assertEqual(self.responses(), expected)
+        self.assertEqual(self.total(viewed_at_gte=start.isoformat()), partial)
+        self.assertEqual(retention.compact(now=self.now), (0, 0))
+
+    def test_late_rows_are_folded(self):
+        refresh_rollups(until=self.now)
+        sketches.refresh_sketches()
+        topk.refresh_topk()
+        retention.compact(now=self.now)
+        total = self.total()
+        marks = rollups.watermarks()
+        for horizon in (rollups.RAW_HORIZON, rollups.HOURLY_HORIZON):  # behind the raw horizon, then the hourly one too
+            blog = self.blogs[0]
+            BlogView.objects.create(blog=blog, blog_author_id=blog.author_id, blog_country_id=blog.country_id,
+                                    viewed_at=marks[horizon] - timedelta(days=1))
+        self.assertEqual(retention.compact(now=self.now), (2, 0))
+        self.assertEqual(self.total(), total + 2)
+        # The late day's sketches and top-K summary include the folded view
+        day = rollups.floor_day(marks[rollups.RAW_HORIZON] - timedelta(days=1))
+        views = BlogViewDaily.objects.filter(bucket=day, blog=blog).aggregate(views=Sum('views'))['views']
+        self.assertEqual(BlogViewSketch.objects.filter(bucket=day, dimension=sketches.COUNTRY)
+                         .aggregate(views=Sum('views'))['views'],
+                         BlogViewDaily.objects.filter(bucket=day).aggregate(views=Sum('views'))['views'])
+        summary = BlogViewTopK.objects.get(bucket=day, dimension=topk.BLOG)
+        self.assertEqual(topk.SpaceSaving.from_bytes(summary.counters, summary.floor, 200).counters[blog.id][0], views)
+
+        # Re-aggregating stops at the horizons instead of wiping the compacted buckets
+        refresh_rollups(until=self.now, lookback=timedelta(days=60))
+        self.assertEqual(self.total(), total + 2)
+        with self.assertRaises(CommandError):
+            call_command('refresh_rollups', rebuild=True, stdout=io.StringIO())
+
+    def test_late_rows_are_rolled_up(self):
+        refresh_rollups(until=self.now)
+        sketches.refresh_sketches()
+        topk.refresh_topk()
+        total = self.total()
+        day = rollups.floor_day(self.now - timedelta(days=2))
+        blog = self.blogs[1]
+        ingest.write_views([(blog.id, None, None, day + timedelta(hours=5, minutes=3))] * 2)
+        self.assertEqual(RollupDirtyHour.objects.get().bucket, day + timedelta(hours=5))
+
+        refresh_rollups(until=self.now)
+        self.assertFalse(RollupDirtyHour.objects.exists())
+        self.assertEqual(self.total(), total + 2)
+        views = BlogView.objects.filter(viewed_at__gte=day, viewed_at__lt=day + timedelta(days=1)).count()
+        for model in (BlogViewDaily, BlogViewSketch):
+            rows = model.objects.filter(bucket=day)
+            if model is BlogViewSketch:
+                rows = rows.filter(dimension=sketches.COUNTRY)
+            self.assertEqual(rows.aggregate(total=Sum('views'))['total'], views, model)
+
+
+class IngestTests(AnalyticsAPIMixin, TestCase):
+    """Batches are bounded in size and age, a full buffer throttles, and a failed flush is retried."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(title='Blog', content='', author=User.objects.create(username='author'))
+
+    def test_old_events_are_rejected(self):
+        old = (timezone.now() - timedelta(days=31)).isoformat()
+        events = [{'blog': self.blog.id, 'viewed_at': old}]
+        with self.settings(ANALYTICS_INGEST={'MAX_AGE': 30}):
+            self.assertEqual(self.request('ingest_views', events, method='post').status_code, 400)
+        with self.settings(ANALYTICS_INGEST={'MAX_AGE': 0}), \
+                mock.patch.object(ingest, '_buffer', ingest.ViewBuffer(max_size=10, flush_size=10, flush_interval=0)):
+            self.assertEqual(self.request('ingest_views', events, method='post').status_code, 202)
+        self.assertEqual(BlogView.objects.get().viewed_at, datetime.fromisoformat(old))
+
+    def test_oversized_batches_are_rejected(self):
+        events = [{'blog': self.blog.id}] * 3
+        with self.settings(ANALYTICS_INGEST={'MAX_BATCH': 2}):
+            self.assertEqual(self.request('ingest_views', events, method='post').status_code, 400)
+        self.assertFalse(BlogView.objects.exists())
+
+    def test_full_buffer_is_throttled(self):
+        buffer = ingest.ViewBuffer(max_size=2, flush_size=10, flush_interval=5)
+        with mock.patch.object(ingest, '_buffer', buffer), mock.patch.object(buffer, '_ensure_thread'):
+            response = self.request('ingest_views', [{'blog': self.blog.id}] * 2, method='post')
+            self.assertEqual(response.status_code, 202)
+            response = self.request('ingest_views', [{'blog': self.blog.id}], method='post')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(len(buffer), 2)  # all or nothing
+
+    def test_failed_flush_is_retried(self):
+        buffer = ingest.ViewBuffer(max_size=10, flush_size=2, flush_interval=0)
+        rows = [(self.blog.id, None, None, timezone.now())] * 3
+        with mock.patch.object(ingest, 'write_views', side_effect=OperationalError('down')), \
+                self.assertLogs('analytics.ingest', 'ERROR'):
+            self.assertTrue(buffer.offer(rows))
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.flush(), 0)  # still backing off
+        # Each failure in a row doubles the delay, and the batch keeps its place at the front
+        buffer._retry_at = 0.0
+        with mock.patch.object(ingest, 'write_views', side_effect=OperationalError('down')), \
+                mock.patch.object(ingest.time, 'monotonic', return_value=100.0), \
+                self.assertLogs('analytics.ingest', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual((buffer._failures, buffer._retry_at), (2, 100.0 + 2 * ingest.RETRY_DELAY))
+        self.assertEqual(list(buffer._rows), rows)
+        buffer._retry_at = 0.0
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(BlogView.objects.count(), 3)
+
+        # A row the database rejects alone is dropped, the rest of its batch is written
+        write_views = ingest.write_views
+
+        def reject_unknown_blogs(batch):
+            if any(row[0] != self.blog.id for row in batch):
+                raise IntegrityError('blog does not exist')
+            return write_views(batch)
+
+        rows = [(self.blog.id, None, None, timezone.now()), (0, None, None, timezone.now())]
+        with mock.patch.object(ingest, 'write_views', reject_unknown_blogs), \
+                self.assertLogs('analytics.ingest', 'ERROR'):
+            self.assertEqual(buffer.offer(rows), True)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(BlogView.objects.count(), 4)
+
+
+class DenormalizationTests(TestCase):
+    """BlogView and rollup copies of blog.author/blog.country follow blog changes, backfills and country deletes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.editor = User.objects.create(username='author'), User.objects.create(username='editor')
+        cls.here = Country.objects.create(name='Here', code='HH')
+        cls.there = Country.objects.create(name='There', code='TT')
+        cls.blog = Blog.objects.create(title='Blog', content='', author=cls.author, country=cls.here)
+        cls.other = Blog.objects.create(title='Other', content='', author=cls.editor, country=cls.there)
+        at = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=3)
+        ingest.write_views([(blog.id, None, None, at + timedelta(hours=i)) for i in range(6)
+                            for blog in (cls.blog, cls.other)])
+        refresh_rollups()
+
+    def columns(self, blog):
+        return {model.__name__: set(model.objects.filter(blog=blog).values_list('blog_author_id', 'blog_country_id'))
+                for model in denormalize.DENORMALIZED}
+
+    def assertColumns(self, blog, author, country):
+        expected = {model.__name__: {(author, country)} for model in denormalize.DENORMALIZED}
+        self.assertEqual(self.columns(blog), expected)
+
+    def test_blog_changes_resync_its_rows(self):
+        self.assertColumns(self.blog, self.author.id, self.here.id)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.blog.title = 'Renamed'
+            self.blog.save()
+        self.assertEqual(callbacks, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blog.author, self.blog.country = self.editor, self.there
+            self.blog.save()
+        self.assertColumns(self.blog, self.editor.id, self.there.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blog.country = None
+            self.blog.save()
+        self.assertColumns(self.blog, self.editor.id, None)
+        self.assertColumns(self.other, self.editor.id, self.there.id)
+
+        # Chunked: every stale row is rewritten, current ones are left alone
+        BlogView.objects.filter(blog=self.blog).update(blog_author=self.author)
+        self.assertEqual(denormalize.sync_blog(self.blog.id, self.editor.id, None, chunk_size=4), 6)
+        self.assertEqual(denormalize.sync_blog(self.blog.id, self.editor.id, None, chunk_size=4), 0)
+        self.assertColumns(self.blog, self.editor.id, None)
+
+    def test_backfill_command(self):
+        Blog.objects.filter(pk=self.blog.pk).update(author=self.editor)  # bypasses the signals
+        BlogView.objects.filter(blog=self.other).update(blog_author=None, blog_country=None)
+        call_command('backfill_blog_columns', chunk_size=5, only_missing=True, stdout=io.StringIO())
+        self.assertColumns(self.blog, self.author.id, self.here.id)
+        self.assertColumns(self.other, self.editor.id, self.there.id)
+
+        out = io.StringIO()
+        call_command('backfill_blog_columns', chunk_size=5, stdout=out)
+        self.assertColumns(self.blog, self.editor.id, self.here.id)
+        self.assertIn('Backfill complete!', out.getvalue())
+
+    def test_deleted_country_is_cleared(self):
+        self.here.delete()
+        self.blog.refresh_from_db()
+        self.assertIsNone(self.blog.country_id)
+        self.assertColumns(self.blog, self.author.id, None)
+        self.assertColumns(self.other, self.editor.id, self.there.id)
+
+
+class HyperLogLogTests(TestCase):
+    def test_estimate_within_error_bounds(self):
+        for n in (10, 1000, 50000):
+            hll = sketches.HyperLogLog().update(range(n))
+            # 3 standard errors (1.04 / sqrt(4096) each)
+            self.assertAlmostEqual(hll.count(), n, delta=max(1, n * 0.049))
+
+    def test_merge_is_union(self):
+        a = sketches.HyperLogLog().update(range(0, 30000))
+        b = sketches.HyperLogLog().update(range(20000, 50000))
+        self.assertAlmostEqual(a.merge(b).count(), 50000, delta=50000 * 0.049)
+
+    def test_bytes_round_trip(self):
+        for n in (5, 5000):  # sparse and dense encodings
+            hll = sketches.HyperLogLog().update(range(n))
+            copy = sketches.HyperLogLog().merge_bytes(hll.to_bytes())
+            self.assertEqual(copy.registers.tobytes(), hll.registers.tobytes())
+
+
+class ApproximateAnalyticsTests(AnalyticsAPIMixin, TestCase):
+    """?approx=true answers from daily sketches plus the raw/hourly edges of the window."""
+
+    @classmethod
+    def setUpTestData(cls):
+        countries = [Country.objects.create(name=f'Country {code}', code=code) for code in ('AA', 'BB', 'CC')]
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(20))
+        blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=users[i % 20], country=countries[i % 3])
+                 for i in range(40)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blogs[(i * 7) % 40], blog_author_id=blogs[(i * 7) % 40].author_id,
+                     user=users[i % 20] if i % 4 else None, viewer_country=countries[i % 3] if i % 5 else None,
+                     viewed_at=now - timedelta(minutes=37 * i))
+            for i in range(600)
+        )
+        refresh_rollups()
+        sketches.refresh_sketches()
+
+    def test_approx_matches_exact_on_small_groups(self):
+        for action, params in [('blog_views', {'object_type': 'country', 'range': 'week'}),
+                               ('blog_views', {'object_type': 'user', 'range': 'month'}),
+                               ('top', {'top': 'country', 'range': 'week'}),
+                               ('blog_views', {'object_type': 'country', 'range': 'month', 'viewer_country': 'BB'})]:
+            exact = self.get(action, **params)
+            approx = self.get(action, **params, approx='true')
+            # Linear counting is exact for a few dozen blogs
+            self.assertCountEqual(approx, exact, params)
+
+    def test_incompatible_filters_use_exact_path(self):
+        self.assertIsNone(sketches.aggregate({'blog_author': '1'}, sketches.COUNTRY))
+        self.assertIsNotNone(sketches.aggregate({'viewer_country': 'AA'}, sketches.COUNTRY))
+
+
+class PaginationTests(AnalyticsAPIMixin, TestCase):
+    """blog-views pages by a (z, x) keyset and streams NDJSON/CSV."""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Ethiopia', code='ET')
+        users = User.objects.bulk_create(User(username=f'user{i:02}') for i in range(30))
+        blog = Blog.objects.create(title='Blog', content='', author=users[0], country=country)
+        now = timezone.now()
+        # Only three distinct view counts, so most pages split ties on z
+        BlogView.objects.bulk_create(
+            BlogView(blog=blog, blog_author_id=users[0].id, user=users[i % 30], viewer_country=country,
+                     viewed_at=now - timedelta(hours=5 * i))
+            for i in range(90 + 30 + 10)
+        )
+
+    def walk(self, **params):
+        rows, params = [], {'object_type': 'user', 'range': 'month', 'page_size': 7, **params}
+        while True:
+            page = self.request('blog_views', params).data
+            rows += page['results']
+            if page['next'] is None:
+                return rows
+            params['cursor'] = parse_qs(urlsplit(page['next']).query)['cursor'][0]
+
+    def test_pages_match_unpaginated_order(self):
+        exact = self.request('blog_views', {'object_type': 'user', 'range': 'month'}).data
+        self.assertEqual(len(exact), 30)
+        self.assertEqual(exact, sorted(exact, key=lambda row: (-row['z'], row['x'])))
+        # Raw rows only (one query), then rollups plus raw edges (UNION ALL)
+        self.assertEqual(self.walk(), exact)
+        refresh_rollups()
+        self.assertEqual(self.walk(), exact)
+
+    def test_invalid_page_parameters(self):
+        for params in ({'page_size': 0}, {'page_size': 'x'}, {'cursor': 'not-a-cursor'}, {'stream': 'xml'}):
+            self.assertEqual(self.request('blog_views', {'object_type': 'user', **params}).status_code, 400, params)
+
+    def test_streams(self):
+        exact = self.request('blog_views', {'object_type': 'user', 'range': 'month'}).data
+        response = self.request('blog_views', {'object_type': 'user', 'range': 'month', 'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], exact)
+
+        response = self.request('blog_views', {'object_type': 'user', 'range': 'month', 'stream': 'csv'})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['x', 'y', 'z'])
+        self.assertEqual(rows[1:], [[row['x'], str(row['y']), str(row['z'])] for row in exact])
+
+
+class PerformanceTests(AnalyticsAPIMixin, TestCase):
+    """performance returns every period of the window with growth against the previous one."""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Ethiopia', code='ET')
+        cls.author, other = User.objects.bulk_create([User(username='author'), User(username='other')])
+        blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=cls.author, country=country)
+                 for i in range(3)]
+        foreign = Blog.objects.create(title='Other', content='', author=other, country=country)
+        cls.month = rollups.floor_period(timezone.now(), 'month')
+        # Views per month, oldest first: 4 months ago is the baseline of a 4-period window
+        views = {-4: [blogs[0]] * 2, -3: [blogs[0], blogs[1]] * 2, -2: [], -1: blogs * 3, 0: [blogs[2]]}
+        BlogView.objects.bulk_create(
+            BlogView(blog=blog, blog_author_id=blog.author_id, viewer_country=country,
+                     viewed_at=min(rollups.add_periods(cls.month, 'month', offset) + timedelta(hours=i + 1),
+                                   timezone.now()))
+            for offset, month_blogs in views.items() for i, blog in enumerate(month_blogs + [foreign])
+        )
+
+    def expected(self):
+        return [
+            {'x': f"{rollups.add_periods(self.month, 'month', -3):%Y-%m-%d}", 'y': 2, 'z': 4,
+             'growth_blogs': 100.0, 'growth_views': 100.0},
+            {'x': f"{rollups.add_periods(self.month, 'month', -2):%Y-%m-%d}", 'y': 0, 'z': 0,
+             'growth_blogs': -100.0, 'growth_views': -100.0},
+            {'x': f"{rollups.add_periods(self.month, 'month', -1):%Y-%m-%d}", 'y': 3, 'z': 9,
+             'growth_blogs': None, 'growth_views': None},
+            {'x': f'{self.month:%Y-%m-%d}', 'y': 1, 'z': 1,
+             'growth_blogs': -66.67, 'growth_views': -88.89},
+        ]
+
+    def test_gap_filled_growth(self):
+        self.assertEqual(self.get('performance', compare='month', periods=4, user=self.author.id), self.expected())
+        refresh_rollups()
+        self.assertEqual(self.get('performance', compare='month', periods=4, user=self.author.id), self.expected())
+
+    def test_window_is_bounded(self):
+        rows = self.get('performance', compare='week', periods=3)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[-1]['x'], f"{rollups.floor_period(timezone.now(), 'week'):%Y-%m-%d}")
+        start = rollups.add_periods(self.month, 'month', -1)
+        rows = self.get('performance', compare='month', viewed_at_gte=start.isoformat(), user=self.author.id)
+        self.assertEqual(rows, self.expected()[2:])
+
+    def test_invalid_periods(self):
+        self.assertEqual(self.request('performance', {'periods': 0}).status_code, 400)
+
+
+class PeriodTests(TestCase):
+    def test_calendar_ranges(self):
+        now = datetime(2025, 3, 12, 15, 0, tzinfo=dt_timezone.utc)  # a Wednesday
+        self.assertEqual(periods.range_window('current_week', now),
+                         (datetime(2025, 3, 10, tzinfo=dt_timezone.utc), None))
+        with timezone.override(periods.get_zone('America/New_York')):
+            start, end = periods.range_window('last_2_months', now)
+        # Local midnights; DST started on March 9
+        self.assertEqual(start, datetime(2025, 1, 1, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(end + periods.MICROSECOND, datetime(2025, 3, 1, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(periods.range_window('week', now), (now - timedelta(days=7), None))
+        for unknown in ('last_0_days', 'last_2_day', 'current_decade', None):
+            self.assertEqual(periods.range_window(unknown, now), (None, None))
+        with self.assertRaises(ValueError):
+            periods.get_zone('Mars/Olympus')
+
+    def test_snap_to_rollup_buckets(self):
+        for name, grain in (('UTC', periods.DAY), ('America/New_York', periods.HOUR), ('Asia/Kolkata', None)):
+            with timezone.override(periods.get_zone(name)):
+                first = rollups.floor_period(datetime(2025, 3, 1, tzinfo=dt_timezone.utc), 'day')
+                self.assertEqual(periods.snap(periods.boundaries(first, first + timedelta(days=14), 'day')),
+                                 grain, name)
+
+    def test_closed_calendar_window_reads_no_raw_rows(self):
+        now = timezone.now()
+        start, end = periods.range_window('last_3_days', now)
+        slices = rollups.plan(start, end, {'hourly': rollups.floor_hour(now), 'daily': rollups.floor_day(now)})
+        self.assertEqual(slices, [(BlogViewDaily, {'bucket__lt': end + periods.MICROSECOND, 'bucket__gte': start})])
+
+
+class TimeZoneTests(AnalyticsAPIMixin, TestCase):
+    """?tz= moves calendar ranges and performance periods to local midnights."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.zone = periods.get_zone('America/New_York')
+        author = User.objects.create(username='author')
+        blog = Blog.objects.create(title='Blog', content='', author=author)
+        today = timezone.localtime(timezone.now(), cls.zone).date()
+        cls.days = [today - timedelta(days=offset) for offset in (3, 2, 1)]
+        # Local 00:30 and 23:30 fall on different UTC days
+        BlogView.objects.bulk_create(
+            BlogView(blog=blog, blog_author_id=author.id,
+                     viewed_at=datetime.combine(day, local_time, tzinfo=cls.zone))
+            for n, day in enumerate(cls.days, 1) for local_time in (time(0, 30),) * n + (time(23, 30),)
+        )
+
+    def test_performance_in_time_zone(self):
+        expected = [f'{day:%Y-%m-%d}' for day in self.days], [n + 1 for n in range(1, 4)]
+        params = {'compare': 'day', 'range': 'last_3_days', 'tz': 'America/New_York'}
+        for tier in ('raw', 'rollups', 'columnar'):
+            if tier == 'rollups':
+                refresh_rollups()
+            with self.settings(ANALYTICS_COLUMNAR={'ENABLED': tier == 'columnar', 'REFRESH_INTERVAL': 0}), \
+                    mock.patch.object(columnar.ColumnStore, '_wake', columnar.ColumnStore.refresh):
+                columnar.get_store().invalidate()
+                rows = self.get('performance', **params)
+            self.assertEqual(([row['x'] for row in rows], [row['z'] for row in rows]), expected, tier)
+
+    def test_calendar_range_in_time_zone(self):
+        rows = self.get('top', top='blog', range='last_3_days', tz='America/New_York')
+        self.assertEqual(rows[0]['z'], 9)
+        rows = self.get('top', top='blog', range='last_2_days', tz='America/New_York')
+        self.assertEqual(rows[0]['z'], 7)
+        self.assertEqual(self.request('top', {'range': 'current_day', 'tz': 'Nowhere/City'}).status_code, 400)
+
+
+@override_settings(ANALYTICS_COLUMNAR={'ENABLED': True, 'DAYS': 8, 'REFRESH_INTERVAL': 0})
+class ColumnarTests(TestCase):
+    """The in-memory store answers recent windows exactly like the SQL path."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Two countries and two blogs share a label
+        countries = [Country.objects.create(name=name, code=code)
+                     for name, code in (('Twin', 'AA'), ('Twin', 'BB'), ('Country CC', 'CC'))]
+        cls.users = User.objects.bulk_create(User(username=f'user{i}') for i in range(12))
+        blogs = [Blog.objects.create(title='Twin' if i < 2 else f'Blog {i}', content='', author=cls.users[i % 4],
+                                     country=countries[i % 3]) for i in range(15)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blogs[(i * 7) % 15], blog_author_id=blogs[(i * 7) % 15].author_id,
+                     blog_country_id=blogs[(i * 7) % 15].country_id,
+                     user=cls.users[i % 12] if i % 4 else None, viewer_country=countries[i % 3] if i % 5 else None,
+                     viewed_at=now - timedelta(minutes=23 * i))
+            for i in range(700)  # about 11 days
+        )
+
+    def setUp(self):
+        columnar.get_store().invalidate()
+        # Refresh in the request rather than on the daemon thread, whose connection cannot see the test's rows
+        patcher = mock.patch.object(columnar.ColumnStore, '_wake', columnar.ColumnStore.refresh)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exact(self, params, dimension, start, limit=None):
+        groups = {
+            columnar.COUNTRY: (lambda time_field: Coalesce(F('viewer_country_id'), Value(labels.NO_COUNTRY)), []),
+            columnar.USER: (lambda time_field: F('user_id'), [Q(user__isnull=False)]),
+            columnar.BLOG: (lambda time_field: F('blog_id'), []),
+        }
+        group, filters = groups[dimension]
+        return rollups.aggregate(params, group=group, start=start, filters=filters,
+                                 distinct=dimension != columnar.BLOG, limit=limit)
+
+    def test_aggregate_matches_sql(self):
+        week = timezone.now() - timedelta(days=7)
+        for dimension in (columnar.COUNTRY, columnar.USER, columnar.BLOG):
+            for params in ({}, {'viewer_country': 'BB'}, {'blog_country': 'CC', 'user': self.users[1].id},
+                           {'blog_author': self.users[2].id}, {'viewer_country': 'ZZ'}):
+                for limit in (None, 3):
+                    self.assertEqual(columnar.aggregate(params, dimension, start=week, limit=limit),
+                                     self.exact(params, dimension, week, limit), (dimension, params, limit))
+
+    def test_timeline_matches_sql(self):
+        end = timezone.now()
+        start = end - timedelta(days=5)
+        for params, author in (({}, None), ({'viewer_country': 'AA'}, self.users[3].id)):
+            filters = [Q(blog_author_id=author)] if author else []
+            self.assertEqual(columnar.timeline(params, 'day', start, end, author=author),
+                             rollups.timeline(params, 'day', start, end, filters=filters))
+
+    def test_falls_back_to_sql(self):
+        self.assertIsNone(columnar.aggregate({}, columnar.COUNTRY, start=timezone.now() - timedelta(days=30)))
+        self.assertIsNone(columnar.aggregate({}, columnar.COUNTRY))
+        self.assertIsNone(columnar.timeline({}, 'week', timezone.now() - timedelta(days=7), timezone.now()))
+        with self.settings(ANALYTICS_COLUMNAR={'ENABLED': False}):
+            self.assertIsNone(columnar.aggregate({}, columnar.COUNTRY, start=timezone.now() - timedelta(days=1)))
+
+    def test_incremental_refresh(self):
+        store = columnar.get_store()
+        columns, _ = store.snapshot()
+        held = len(columns['id'])
+        self.assertEqual(held, BlogView.objects.filter(viewed_at__gte=timezone.now() - timedelta(days=8)).count())
+
+        # A row committed after a higher id was read is picked up once from the overlap
+        store.state = (columnar._take(columns, columns['id'] != columns['id'].max()), store.state[1])
+        view = BlogView.objects.create(blog=Blog.objects.first(), viewed_at=timezone.now())
+        columns, _ = store.snapshot()
+        self.assertEqual(len(columns['id']), held + 1)
+        self.assertEqual(len(set(columns['id'].tolist())), held + 1)
+        self.assertIn(view.id, columns['id'])
+
+        with self.settings(ANALYTICS_COLUMNAR={'ENABLED': True, 'DAYS': 2, 'REFRESH_INTERVAL': 0}):
+            columns, since = store.snapshot()
+        self.assertEqual(len(columns['id']), BlogView.objects.filter(viewed_at__gte=since).count())
+
+    def test_blog_change_reloads_other_processes(self):
+        other = columnar.ColumnStore()  # another worker's store
+        columns, _ = other.snapshot()
+        blog = Blog.objects.exclude(author=self.users[0]).first()
+        self.assertNotIn(self.users[0].id, columns['blog_author_id'][columns['blog_id'] == blog.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            blog.author = self.users[0]
+            blog.save()
+        columns, _ = other.snapshot()
+        self.assertTrue((columns['blog_author_id'][columns['blog_id'] == blog.id] == self.users[0].id).all())
+
+
+@override_settings(ANALYTICS_COLUMNAR={'ENABLED': True, 'REFRESH_INTERVAL': 60})
+class ColumnarRefreshTests(TestCase):
+    """The store loads on its own thread: requests read what it holds meanwhile, and oversized loads are skipped."""
+
+    def test_requests_do_not_wait_for_the_refresh(self):
+        store = columnar.ColumnStore()
+        loading, loaded = threading.Event(), threading.Event()
+
+        def refresh(conf=None):
+            loading.set()
+            loaded.wait(5)
+            store.state = (mock.sentinel.columns, mock.sentinel.since)
+            store._loaded = store._refreshed = columnar.time.monotonic()
+
+        with mock.patch.object(store, 'refresh', refresh):
+            self.assertEqual(store.snapshot(), (None, None))
+            self.assertTrue(loading.wait(5))
+            self.assertEqual(store.snapshot(), (None, None))
+            loaded.set()
+            for _ in range(100):
+                if store.state[0] is not None:
+                    break
+                sleep(0.05)
+        self.assertEqual(store.snapshot(), (mock.sentinel.columns, mock.sentinel.since))
+
+    def test_oversized_reload_is_skipped(self):
+        blog = Blog.objects.create(title='Blog', content='', author=User.objects.create(username='author'))
+        BlogView.objects.bulk_create(BlogView(blog=blog, viewed_at=timezone.now()) for _ in range(11))
+        store = columnar.ColumnStore()
+        with self.settings(ANALYTICS_COLUMNAR={'ENABLED': True, 'MAX_ROWS': 10}), \
+                mock.patch.object(columnar, '_fetch') as fetch, self.assertLogs('analytics.columnar', 'WARNING'):
+            store.refresh()
+        fetch.assert_not_called()
+        self.assertEqual(store.state, (None, None))
+
+
+class LabelTests(AnalyticsAPIMixin, TestCase):
+    """Aggregations group by id; x comes from the label cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = Country.objects.create(name='Ethiopia', code='ET')
+        cls.author = User.objects.create(username='author')
+        cls.blogs = [Blog.objects.create(title='Same title', content='', author=cls.author, country=cls.country)
+                     for _ in range(2)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blog, blog_author_id=cls.author.id, user=cls.author if i else None,
+                     viewer_country=cls.country if i else None, viewed_at=now - timedelta(hours=i + 1))
+            for blog, count in zip(cls.blogs, (3, 2)) for i in range(count)
+        )
+
+    def setUp(self):
+        for cache in labels.caches.values():
+            cache.clear()
+
+    def test_blogs_sharing_a_title_stay_apart(self):
+        self.assertEqual(self.get('top', top='blog', range='week'), [
+            {'x': 'Same title', 'y': 1, 'z': 3},
+            {'x': 'Same title', 'y': 1, 'z': 2},
+        ])
+        self.assertEqual(self.get('blog_views', object_type='country', range='week'), [
+            {'x': 'Ethiopia', 'y': 2, 'z': 3},
+            {'x': 'Unknown', 'y': 2, 'z': 2},
+        ])
+
+    def test_renames_are_picked_up(self):
+        self.assertEqual(self.get('top', top='user', range='week')[0]['x'], 'author')
+        self.author.username = 'renamed'
+        self.author.save()
+        self.assertEqual(self.get('top', top='user', range='week')[0]['x'], 'renamed')
+
+    @override_settings(ANALYTICS_LABELS={'MAX_SIZE': 1, 'TTL': 300})
+    def test_lru_eviction(self):
+        cache = labels.caches[labels.BLOG]
+        self.assertEqual(cache.get_many([blog.id for blog in self.blogs]),
+                         {blog.id: 'Same title' for blog in self.blogs})
+        self.assertEqual(len(cache), 1)
+        with self.assertNumQueries(0):
+            cache.get_many([self.blogs[-1].id])
+        with self.assertNumQueries(1):
+            cache.get_many([self.blogs[0].id])
+
+
+class BatchTests(AnalyticsAPIMixin, TestCase):
+    """POST /analytics/batch/ answers several groupings of one filter set in one query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        countries = [Country.objects.create(name=f'Country {code}', code=code) for code in ('AA', 'BB')]
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(8))
+        blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=users[i % 8], country=countries[i % 2])
+                 for i in range(12)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blogs[(i * 5) % 12], blog_author_id=blogs[(i * 5) % 12].author_id,
+                     blog_country_id=blogs[(i * 5) % 12].country_id,
+                     user=users[i % 8] if i % 3 else None, viewer_country=countries[i % 2] if i % 7 else None,
+                     viewed_at=now - timedelta(hours=7 * i))
+            for i in range(300)
+        )
+
+    def test_matches_separate_requests(self):
+        filters = {'range': 'month', 'blog_country': 'BB'}
+        data = {'filters': filters, 'queries': [
+            {'id': 'countries', 'group': 'country'},
+            {'id': 'users', 'group': 'user'},
+            {'id': 'top_users', 'group': 'user', 'limit': 10},
+            {'id': 'top_countries', 'group': 'country', 'limit': 10},
+            {'id': 'top_blogs', 'group': 'blog', 'limit': 10},
+        ]}
+        expected = {
+            'countries': self.get('blog_views', object_type='country', **filters),
+            'users': self.get('blog_views', object_type='user', **filters),
+            'top_users': self.get('top', top='user', **filters),
+            'top_countries': self.get('top', top='country', **filters),
+            'top_blogs': self.get('top', top='blog', **filters),
+        }
+        for refresh in (False, True):
+            if refresh:
+                refresh_rollups()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.request('batch', data, method='post')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, expected)
+            scans = [query for query in queries if 'analytics_blogview' in query['sql']]
+            self.assertEqual(len(scans), 1, scans)
+
+    def test_invalid_batches(self):
+        for data in ({'queries': []},
+                     {'queries': [{'id': 'a', 'group': 'title'}]},
+                     {'queries': [{'id': 'a', 'group': 'user'}, {'id': 'a', 'group': 'blog'}]},
+                     {'queries': [{'id': 'a', 'group': 'user', 'limit': 0}]}):
+            self.assertEqual(self.request('batch', data, method='post').status_code, 400, data)
+
+
+class RendererTests(AnalyticsAPIMixin, TestCase):
+    """The analytics actions render JSON with orjson, columns or MessagePack by Accept."""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Éthiopie', code='ET')
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(4))
+        blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=users[i], country=country)
+                 for i in range(4)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blogs[i % 4], blog_author_id=blogs[i % 4].author_id, user=users[i % 3] if i % 5 else None,
+                     viewer_country=country if i % 2 else None, viewed_at=now - timedelta(hours=9 * i))
+            for i in range(40)
+        )
+
+    def render(self, action, accept=None, **params):
+        return self.request(action, params, accept=accept).render()
+
+    def test_json_matches_drf_renderer(self):
+        data = [{'x': 'Éthiopie', 'y': 1, 'z': Decimal('2.50'), 'at': datetime(2025, 3, 1, 12, 0, 0, 123456,
+                                                                                 tzinfo=dt_timezone.utc)},
+                {'x': None, 'y': 2, 'z': 3, 'at': None, 'growth': 12.5}]
+        self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        response = self.render('blog_views', object_type='user')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_columns(self):
+        for action, params in (('blog_views', {'object_type': 'country'}), ('top', {'top': 'blog'}),
+                               ('performance', {'compare': 'week', 'periods': 3})):
+            rows = json.loads(self.render(action, **params).content)
+            response = self.render(action, 'application/vnd.analytics.columns+json', **params)
+            self.assertEqual(response['Content-Type'], 'application/vnd.analytics.columns+json')
+            self.assertEqual(json.loads(response.content), {field: [row[field] for row in rows] for field in rows[0]})
+
+        page = json.loads(self.render('blog_views', format='columns', object_type='user', page_size=2).content)
+        self.assertEqual(len(page['results']['z']), 2)
+        self.assertIsNotNone(page['next'])
+        self.assertEqual(renderers.columns([]), {'x': [], 'y': [], 'z': []})
+        # Empty results keep their action's fields
+        empty = {'x': [], 'y': [], 'z': [], 'growth_blogs': [], 'growth_views': []}
+        with mock.patch.object(rollups, 'timeline', return_value=[]):
+            self.assertEqual(json.loads(self.render('performance', format='columns').content), empty)
+            self.assertEqual(json.loads(self.render('dashboard', format='columns').content)['performance'], empty)
+        self.assertEqual(renderers.columns({'error': 'Invalid.'}), {'error': 'Invalid.'})
+
+    @skipUnless(renderers.msgpack, 'needs msgpack')
+    def test_msgpack(self):
+        rows = json.loads(self.render('top', top='user').content)
+        response = self.render('top', 'application/msgpack', top='user')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), rows)
+
+
+class SpaceSavingTests(TestCase):
+    def test_bounds(self):
+        counts = {key: 1 + (key * 7919) % 50 for key in range(300)}
+        summary = topk.SpaceSaving(40)
+        for offset in range(0, 300, 30):  # several ingest batches
+            summary.update({key: counts[key] for key in range(offset, offset + 30)})
+        self.assertEqual(len(summary.counters), 40)
+        for key, views in counts.items():
+            if key in summary.counters:
+                count, error = summary.counters[key]
+                self.assertLessEqual(count - error, views)
+                self.assertGreaterEqual(count, views)
+            else:
+                self.assertLessEqual(views, summary.floor)
+
+        copy = topk.SpaceSaving.from_bytes(summary.to_bytes(), summary.floor, 40)
+        self.assertEqual(copy.counters, summary.counters)
+        exact = topk.SpaceSaving.from_exact(counts, 40)
+        self.assertEqual(exact.floor, sorted(counts.values())[-41])
+
+
+@override_settings(ANALYTICS_TOPK={'ENABLED': True, 'CAPACITY': 20, 'CANDIDATES': 15})
+class TopKTests(AnalyticsAPIMixin, TestCase):
+    """/analytics/top/ from the per-day summaries gives the exact answer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        countries = [Country.objects.create(name=f'Country {code}', code=code) for code in ('AA', 'BB', 'CC')]
+        cls.users = User.objects.bulk_create(User(username=f'user{i}') for i in range(30))
+        cls.blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=cls.users[i % 5],
+                                         country=countries[i % 3]) for i in range(25)]
+        now = timezone.now()
+        # Skewed: user i views max(1, 30 - 2i) times a day, on the blog of the same index
+        BlogView.objects.bulk_create(
+            BlogView(blog=cls.blogs[i % 25], blog_author_id=cls.blogs[i % 25].author_id,
+                     user=cls.users[i] if n % 4 else None, viewer_country=countries[i % 3] if i % 4 else None,
+                     viewed_at=now - timedelta(days=day, minutes=n))
+            for day in range(1, 10) for i in range(30) for n in range(max(1, 30 - 2 * i))
+        )
+        refresh_rollups()
+        topk.refresh_topk()
+
+    def exact(self, **params):
+        with self.settings(ANALYTICS_TOPK={'ENABLED': False}):
+            return self.get('top', **params)
+
+    def test_matches_exact_path(self):
+        self.assertEqual(BlogViewTopK.objects.filter(dimension=topk.USER).count(), 9)
+        start = timezone.now() - timedelta(days=7)
+        for dimension in (topk.COUNTRY, topk.USER, topk.BLOG):
+            self.assertIsNotNone(topk.top({}, dimension, GROUPS[dimension], start=start, limit=10), dimension)
+            self.assertEqual(self.get('top', top=dimension, range='week'), self.exact(top=dimension, range='week'))
+
+    def test_ingested_views_are_counted(self):
+        ingest.write_views([(self.blogs[24].id, self.users[29].id, None, timezone.now())] * 200)
+        rows = topk.top({}, topk.USER, GROUPS[topk.USER], start=timezone.now() - timedelta(days=7), limit=10)
+        self.assertEqual(rows[0], {'x': self.users[29].id, 'y': 1, 'z': 200})
+        self.assertEqual(self.get('top', top='user', range='week'), self.exact(top='user', range='week'))
+        self.assertEqual(self.get('top', top='user', range='week')[0]['x'], 'user29')
+
+    def test_unsummarized_views_are_counted(self):
+        # Ingested after the 'topk' watermark: counted exactly, no summary written
+        summaries = list(BlogViewTopK.objects.values_list('bucket', 'dimension', 'floor', 'counters'))
+        ingest.write_views([(self.blogs[0].id, self.users[0].id, None, timezone.now())] * 5)
+        self.assertNotEqual(topk.top({}, topk.USER, GROUPS[topk.USER],
+                                     start=timezone.now() - timedelta(hours=1), limit=10), [])
+        self.assertEqual(self.get('top', top='user', range='day'), self.exact(top='user', range='day'))
+
+        # Late views reach the summaries with the rollups, when refresh_rollups rebuilds their day
+        ingest.write_views([(self.blogs[24].id, self.users[29].id, None, timezone.now() - timedelta(days=3))] * 200)
+        self.assertEqual(list(BlogViewTopK.objects.values_list('bucket', 'dimension', 'floor', 'counters')), summaries)
+        self.assertEqual(self.get('top', top='user', range='week'), self.exact(top='user', range='week'))
+        refresh_rollups()
+        self.assertEqual(self.get('top', top='user', range='week')[0]['x'], 'user29')
+        self.assertEqual(self.get('top', top='user', range='week'), self.exact(top='user', range='week'))
+
+        RollupWatermark.objects.filter(name='topk').delete()
+        self.assertIsNone(topk.top({}, topk.USER, GROUPS[topk.USER],
+                                   start=timezone.now() - timedelta(days=7), limit=10))
+
+    def test_falls_back_to_exact_path(self):
+        start = timezone.now() - timedelta(days=7)
+        self.assertIsNone(topk.top({'viewer_country': 'AA'}, topk.USER, GROUPS[topk.USER], start=start, limit=10))
+        with self.settings(ANALYTICS_TOPK={'ENABLED': True, 'CAPACITY': 20, 'CANDIDATES': 2}):
+            # Two candidates cannot prove a top 10
+            self.assertIsNone(topk.top({}, topk.USER, GROUPS[topk.USER], start=start, limit=10))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                               'LOCATION': 'response-cache-tests'}},
+                   ANALYTICS_CACHE={'ALIAS': 'default', 'DEFAULT_TTL': 60, 'CLOSED_TTL': 86400, 'GRACE': 300})
+class ResponseCacheTests(TestCase):
+    """Closed windows keep one key per generation, open ones a key per TTL bucket; late rows orphan them all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(title='Blog', content='', author=User.objects.create(username='author'))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def key(self, params, rolling=True, at=None):
+        return cache.cache_key('blog_views', params, (), rolling, at)
+
+    def test_closed_windows_skip_the_time_bucket(self):
+        at = timezone.now().timestamp() // 60 * 60 + 1
+        past = (timezone.now() - timedelta(days=2)).isoformat()
+        recent = (timezone.now() - timedelta(seconds=60)).isoformat()  # within GRACE
+        for params, rolling in [({'range': 'last_2_days'}, True), ({'viewed_at_lte': past}, False)]:
+            key, ttl = self.key(params, rolling, at)
+            self.assertEqual(ttl, 86400, params)
+            self.assertEqual(self.key(params, rolling, at + 3600), (key, ttl), params)
+        # A rolling lower bound or an end within GRACE keeps the window open
+        for params, rolling in [({'range': 'week', 'viewed_at_lte': past}, True), ({'viewed_at_lte': recent}, False)]:
+            key, ttl = self.key(params, rolling, at)
+            self.assertEqual(ttl, 60, params)
+            self.assertEqual(self.key(params, rolling, at + 30)[0], key, params)
+            self.assertNotEqual(self.key(params, rolling, at + 60)[0], key, params)
+
+    def test_late_rows_bump_the_generation(self):
+        params = {'range': 'last_2_days'}
+        key, _ = self.key(params)
+        ingest.write_views([(self.blog.id, None, None, timezone.now())])
+        self.assertEqual(self.key(params)[0], key)
+
+        ingest.write_views([(self.blog.id, None, None, timezone.now() - timedelta(days=1))])
+        late_key, _ = self.key(params)
+        self.assertNotEqual(late_key, key)
+        BlogView.objects.create(blog=self.blog, viewed_at=timezone.now() - timedelta(days=1))
+        self.assertNotIn(self.key(params)[0], (key, late_key))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                               'LOCATION': 'warming-tests'}},
+                   ANALYTICS_CACHE={'ALIAS': 'default', 'PERSIST_INTERVAL': 0, 'LOCK_TIMEOUT': 5})
+class CacheWarmingTests(AnalyticsAPIMixin, TestCase):
+    """Popular queries are counted, precomputed, and concurrent misses are computed once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='author')
+        blog = Blog.objects.create(title='Blog', content='', author=user)
+        now = timezone.now()
+        BlogView.objects.bulk_create(BlogView(blog=blog, blog_author_id=user.id, viewed_at=now - timedelta(hours=n))
+                                     for n in range(1, 50))
+
+    def setUp(self):
+        cache.get_cache().clear()
+        # Leave out the queries counted by the other tests
+        patcher = mock.patch.object(cache, 'queries', cache.QueryCounter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_popular_queries_are_warmed(self):
+        for _ in range(3):
+            self.request('blog_views', {'range': 'week'})
+        self.request('blog_views', {'range': 'week', 'page_size': 10})
+        self.request('top', {'top': 'blog', 'range': 'day'})
+        query = AnalyticsQuery.objects.get(action='blog_views', hits=3)
+        self.assertEqual(query.params, {'range': 'week'})
+
+        cache.get_cache().clear()
+        at = timezone.now().timestamp() // 60 * 60 + 20  # within the current 60 s bucket
+        self.assertEqual(warming.warm(lead=0, at=at), (2, 2))  # pages are not warmed
+        self.assertEqual(warming.warm(lead=0, at=at), (0, 2))
+        # Within LEAD of the bucket's end, the next one is computed too
+        self.assertEqual(warming.warm(lead=30, at=at + 30), (2, 2))
+        self.assertEqual(AnalyticsQuery.objects.get(key=query.key).hits, 3)
+        with self.settings(ANALYTICS_CACHE={'ALIAS': 'default', 'COUNT_QUERIES': False}), self.assertNumQueries(0):
+            response = self.request('blog_views', {'range': 'week'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(sum(row['z'] for row in response.data), 49)
+
+    def test_concurrent_misses_are_computed_once(self):
+        store, calls = cache.get_cache(), []
+
+        def compute():
+            calls.append(1)
+            sleep(0.2)
+            store.set('key', [1, 2], 60)
+            return [1, 2]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache._single_flight(store, 'key', 5, compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[1, 2]] * 5)
+
+        # Another worker holds the lock: wait for its entry instead of computing
+        store.delete('key')
+        store.set('key:lock', 1, 5)
+        threading.Timer(0.2, lambda: store.set('key', [3], 60)).start()
+        self.assertEqual(cache._single_flight(store, 'key', 5, compute), [3])
+        self.assertEqual(len(calls), 1)
+
+
+class AsyncViewTests(AnalyticsAPIMixin, TransactionTestCase):
+    """The async views run the viewset actions in worker threads, each on its own connection."""
+
+    def setUp(self):
+        # Worker threads keep their connections for CONN_MAX_AGE, which would outlive the test database
+        patcher = mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        country = Country.objects.create(name='Ethiopia', code='ET')
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(5))
+        blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=users[i], country=country)
+                 for i in range(5)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blogs[i % 5], blog_author_id=blogs[i % 5].author_id, user=users[i % 3],
+                     viewer_country=country, viewed_at=now - timedelta(hours=7 * i))
+            for i in range(50)
+        )
+
+    def sync(self, action, **params):
+        return json.loads(self.request(action, params).render().content)
+
+    async def test_dashboard_matches_actions(self):
+        response = await self.async_client.get('/analytics/dashboard/', {'range': 'month', 'object_type': 'user'})
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        for action in ('top', 'blog_views', 'performance'):
+            expected = await sync_to_async(self.sync)(action, range='month', object_type='user')
+            self.assertEqual(payload[action], expected, action)
+
+        response = await self.async_client.get('/analytics/dashboard/', {'object_type': 'blog'})
+        self.assertEqual(response.status_code, 400)
+
+        columns = 'application/vnd.analytics.columns+json'
+        response = await self.async_client.get('/analytics/dashboard/', {'range': 'month'}, headers={'Accept': columns})
+        self.assertEqual(response['Content-Type'], columns)
+        self.assertEqual(response.json()['performance'], renderers.columns(payload['performance']))
+        response = await self.async_client.get('/analytics/dashboard/', headers={'Accept': 'text/csv'})
+        self.assertEqual(response.status_code, 406)
+
+    async def test_async_stream(self):
+        response = await self.async_client.get('/analytics/blog-views/', {'object_type': 'user', 'stream': 'ndjson'})
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        expected = await sync_to_async(self.sync)('blog_views', object_type='user')
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+
+class ExportTests(TransactionTestCase):
+    """Export jobs write the filtered raw views to a file in the background."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.settings_override = self.settings(ANALYTICS_EXPORTS={'DIRECTORY': directory, 'WORKERS': 0,
+                                                                  'CHUNK_SIZE': 7})
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        countries = [Country.objects.create(name=f'Country {code}', code=code) for code in ('AA', 'BB')]
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(3))
+        blogs = [Blog.objects.create(title=f'Blog {i}', content='', author=users[i], country=countries[i % 2])
+                 for i in range(3)]
+        now = timezone.now()
+        BlogView.objects.bulk_create(
+            BlogView(blog=blogs[i % 3], blog_author_id=blogs[i % 3].author_id, blog_country_id=blogs[i % 3].country_id,
+                     user=users[i % 3] if i % 4 else None, viewer_country=countries[i % 2] if i % 5 else None,
+                     viewed_at=now - timedelta(hours=5 * i))
+            for i in range(60)
+        )
+        self.expected = list(BlogView.objects.filter(viewer_country__code='AA').order_by('id')
+                             .values_list(*exports.FIELDS))
+
+    def post(self, data):
+        view = ExportViewSet.as_view({'post': 'create'})
+        return view(APIRequestFactory().post('/analytics/exports/', data, format='json'))
+
+    def get(self, pk, action='retrieve'):
+        view = ExportViewSet.as_view({'get': action})
+        return view(APIRequestFactory().get(f'/analytics/exports/{pk}/'), pk=pk)
+
+    def test_csv_export(self):
+        response = self.post({'filters': {'viewer_country': 'AA', 'blog_author': ''}})
+        self.assertEqual(response.status_code, 202)
+        job = response.data
+        self.assertEqual((job['status'], job['rows'], job['total'], job['progress']),
+                         ('done', len(self.expected), len(self.expected), 1.0))
+        self.assertTrue(job['url'].endswith(f"/analytics/exports/{job['id']}/download/"))
+
+        response = self.get(job['id'], 'download')
+        with gzip.open(io.BytesIO(b''.join(response.streaming_content)), 'rt', newline='') as file:
+            header, *rows = list(csv.reader(file))
+        self.assertEqual(tuple(header), exports.FIELDS)
+        self.assertEqual(sorted(int(row[0]) for row in rows), [row[0] for row in self.expected])
+
+    def test_calendar_range_is_resolved_at_submit(self):
+        job = self.post({'filters': {'range': 'last_2_days', 'tz': 'Asia/Tokyo'}}).data
+        with timezone.override(periods.get_zone('Asia/Tokyo')):
+            start, end = periods.range_window('last_2_days')
+        self.assertEqual(job['params'], {'viewed_at_gte': start.isoformat(), 'viewed_at_lte': end.isoformat()})
+        self.assertEqual(job['rows'], BlogView.objects.filter(viewed_at__gte=start, viewed_at__lte=end).count())
+
+    def test_background_worker(self):
+        with self.settings(ANALYTICS_EXPORTS={**settings.ANALYTICS_EXPORTS, 'WORKERS': 1}):
+            job = self.post({'filters': {'viewer_country': 'AA'}}).data
+            for _ in range(100):
+                job = self.get(job['id']).data
+                if job['status'] == 'done':
+                    break
+                sleep(0.05)
+        self.assertEqual((job['status'], job['rows']), ('done', len(self.expected)))
+
+    @skipUnless(exports.parquet_available(), 'needs pyarrow')
+    def test_parquet_export(self):
+        import pyarrow.parquet as pq
+        job = self.post({'format': 'parquet', 'filters': {'viewer_country': 'AA'}}).data
+        table = pq.read_table(exports.path(ExportJob.objects.get(pk=job['id'])))
+        self.assertEqual(sorted(table.column('id').to_pylist()), [row[0] for row in self.expected])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post({'format': 'xlsx'}).status_code, 400)
+        self.assertEqual(self.post({'filters': {'tz': 'Nowhere/City'}}).status_code, 400)
+        if not exports.parquet_available():
+            self.assertEqual(self.post({'format': 'parquet'}).status_code, 400)
+        pending = ExportJob.objects.create(params={})
+        self.assertEqual(self.get(pending.pk, 'download').status_code, 409)
+        self.assertEqual(self.client.get('/analytics/exports/not-a-job/').status_code, 404)
+
+
+class DatabaseConfigTests(TestCase):
+    def test_pool_options_from_url(self):
+        db = database_config('postgres://u:p@db:5432/blog?pool=true&pool_max_size=8&sslmode=require',
+                             conn_max_age=600)
+        self.assertEqual(db['OPTIONS'], {'pool': {'max_size': 8}, 'sslmode': 'require'})
+        self.assertEqual(db['CONN_MAX_AGE'], 0)
+        db = database_config('postgres://u:p@db:5432/blog', conn_max_age=600)
+        self.assertNotIn('pool', db['OPTIONS'])
+        self.assertEqual(db['CONN_MAX_AGE'], 600)
+
+
+class SchemaTests(TestCase):
+    """/api/schema/ serves the files of build_schema, byte for byte what it would generate."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.settings_override = self.settings(OPENAPI_SCHEMA_DIR=directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.addCleanup(schema._read.cache_clear)
+
+    def test_prebuilt_schema_matches_generated(self):
+        generated = {fmt: self.client.get(f'/api/schema/?format={fmt}') for fmt in ('yaml', 'json')}
+        call_command('build_schema', validate=True, stdout=io.StringIO())
+        with mock.patch.object(SchemaView.generator_class, 'get_schema') as get_schema:
+            for fmt, expected in generated.items():
+                response = self.client.get(f'/api/schema/?format={fmt}')
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+            get_schema.assert_not_called()
+        self.assertEqual(self.client.get('/api/schema/?lang=en').content, generated['yaml'].content)
+
+    def test_warm_up_reads_no_rows(self):
+        call_command('build_schema', stdout=io.StringIO())
+        with self.assertNumQueries(0):
+            startup.warm_up()
+        self.assertIsNotNone(schema.prebuilt('json'))
+
+
+@skipUnless(HAS_REPLICA, 'needs ANALYTICS_REPLICA_URL (e.g. a second local PostgreSQL database)')
+@override_settings(ANALYTICS_REPLICA={'ALIAS': 'replica', 'MAX_LAG': 30, 'CHECK_INTERVAL': 0})
+class ReplicaRoutingTests(AnalyticsAPIMixin, TestCase):
+    """Aggregations read the replica while it is healthy; ingestion always writes the primary."""
+    databases = {'default', 'replica'} if HAS_REPLICA else {'default'}
+
+    @classmethod
+    def setUpTestData(cls):
+        # Two independent databases: the replica holds more views than the primary
+        for alias, views in (('default', 3), ('replica', 5)):
+            country = Country.objects.using(alias).create(name='Ethiopia', code='ET')
+            user = User.objects.db_manager(alias).create(username='reader')
+            blog = Blog.objects.using(alias).create(title='Blog', content='', author=user, country=country)
+            BlogView.objects.using(alias).bulk_create(
+                BlogView(blog=blog, blog_author_id=user.id, user=user, viewer_country=country,
+                         viewed_at=timezone.now() - timedelta(hours=i))
+                for i in range(views)
+            )
+            if alias == 'default':
+                cls.blog = blog
+
+    def views(self):
+        return self.get('blog_views', object_type='country')[0]['z']
+
+    def test_aggregations_read_replica(self):
+        self.assertEqual(self.views(), 5)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with override_settings(ANALYTICS_REPLICA={'ALIAS': 'replica', 'MAX_LAG': -1, 'CHECK_INTERVAL': 0}):
+            self.assertEqual(self.views(), 3)
+
+    def test_ingestion_writes_primary(self):
+        with routers.replica_reads():
+            ingest.write_views([(self.blog.id, None, None, timezone.now())])
+        self.assertEqual(BlogView.objects.using('default').count(), 4)
+        self.assertEqual(BlogView.objects.using('replica').count(), 5)
+
+
+@override_settings(ANALYTICS_REPLICA={'ALIAS': 'default', 'MAX_LAG': 30, 'CHECK_INTERVAL': 0})
+class ReplicaHealthTests(TestCase):
+    """One thread checks the replica; the others keep the last known state instead of waiting."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(routers._health, {'default': (0.0, True)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_slow_check_does_not_block_other_threads(self):
+        checking, release = threading.Event(), threading.Event()
+
+        def slow_lag(alias):
+            checking.set()
+            release.wait(5)
+            return 60.0
+
+        with mock.patch.object(routers, 'replica_lag', slow_lag), self.assertLogs('analytics.routers', 'WARNING'):
+            results = []
+            checker = threading.Thread(target=lambda: results.append(routers.replica_alias()))
+            checker.start()
+            self.assertTrue(checking.wait(5))
+            # Answered from the last known state while the check is still running
+            self.assertEqual(routers.replica_alias(), 'default')
+            release.set()
+            checker.join()
+        self.assertEqual(results, [None])
+        self.assertEqual(routers._health['default'][1], False)
+        self.assertEqual(routers._checking, set())
+
+
+@override_settings(ANALYTICS_INSTRUMENTATION={'SLOW_MS': 0, 'SLOW_SAMPLE_RATE': 1.0, 'EXPLAIN_QUERIES': 2})
+class InstrumentationTests(AnalyticsAPIMixin, TestCase):
+    """The middleware times every analytics request and explains the slowest queries of slow ones."""
+
+    def setUp(self):
+        # The async views run their queries in worker threads that keep connections for CONN_MAX_AGE
+        patcher = mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Slow requests are explained by drain() below instead of a daemon thread
+        self.slow_log = middleware.SlowLog(max_size=10)
+        for patcher in (mock.patch.object(middleware, '_slow_log', self.slow_log),
+                        mock.patch.object(self.slow_log, '_ensure_thread')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_request_and_slow_logs(self):
+        with self.assertLogs('analytics.requests', 'INFO') as requests, \
+                self.assertLogs('analytics.slow', 'WARNING') as slow:
+            response = self.client.get('/analytics/blog-views/', {
+                'object_type': 'user', 'range': 'week', 'viewer_country': 'ET', 'blog_author': '1', 'cursor': 'x',
+            })
+            self.client.get('/analytics/performance/', {'compare': 'week', 'periods': 4})
+            self.assertEqual(len(slow.records), 0)  # nothing explained in the request
+            self.assertEqual(self.slow_log.drain(), 2)
+
+        self.assertEqual(response.status_code, 400)  # invalid cursor, still instrumented
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+, total;dur=')
+        record = json.loads(requests.records[0].getMessage())
+        self.assertEqual(record['filters'], ['blog_author', 'viewer_country'])
+        self.assertEqual(record['params'], {'object_type': 'user', 'range': 'week'})
+        self.assertEqual(record['status'], 400)
+
+        record = json.loads(slow.records[-1].getMessage())
+        self.assertEqual(record['rows'], 4)
+        self.assertGreater(record['queries'], 0)
+        self.assertLessEqual(len(record['slowest']), 2)
+        self.assertTrue(record['slowest'][0]['explain'])
+
+    def test_full_backlog_is_logged_unexplained(self):
+        self.slow_log.max_size = 0
+        with self.assertLogs('analytics.slow', 'WARNING') as slow:
+            self.client.get('/analytics/performance/', {'compare': 'week', 'periods': 4})
+        record = json.loads(slow.records[-1].getMessage())
+        self.assertTrue(record['slowest'])
+        self.assertIsNone(record['slowest'][0]['explain'])
+
+    def test_other_routes_are_not_instrumented(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/schema/'))
+
+
+class SampleDataTests(TestCase):
+    """populate_sample_data writes the requested counts, and a second run tops up views on the existing blogs."""
+
+    def test_counts_and_top_up(self):
+        out = io.StringIO()
+        call_command('populate_sample_data', users=3, countries=7, blogs=4, views=50, span_days=2, seed=1,
+                     chunk_size=20, stdout=out)
+        self.assertIn('50 blog views created.', out.getvalue())
+        self.assertEqual((User.objects.count(), Country.objects.count(), Blog.objects.count()), (3, 7, 4))
+        self.assertEqual(BlogView.objects.count(), 50)
+        self.assertTrue(Country.objects.filter(code='AA').exists())  # synthetic beyond the built-in five
+        span = BlogView.objects.aggregate(first=Min('viewed_at'), last=Max('viewed_at'))
+        self.assertGreaterEqual(span['first'], timezone.now() - timedelta(days=2))
+        self.assertLessEqual(span['last'], timezone.now())
+        self.assertFalse(BlogView.objects.exclude(blog_author=F('blog__author')).exists())
+
+        call_command('populate_sample_data', users=3, countries=7, blogs=0, views=10, seed=2, stdout=out)
+        self.assertEqual((User.objects.count(), Country.objects.count(), Blog.objects.count()), (3, 7, 4))
+        self.assertEqual(BlogView.objects.count(), 60)
+
+
+class BenchmarkTests(TestCase):
+    """benchmark_analytics seeds each size and reports one result per case as JSON."""
+
+    def test_report_shape(self):
+        out = io.StringIO()
+        with mock.patch('sys.stderr', io.StringIO()):  # the seeding output
+            call_command('benchmark_analytics', sizes='60,30', repeat=1, span_days=3, renderers=True,
+                         stdout=out, stderr=io.StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['meta']['vendor'], connection.vendor)
+        self.assertEqual(BlogView.objects.count(), 60)
+
+        blog = Blog.objects.order_by('id').first()
+        cases = benchmark_cases(blog.author_id, blog.country.code)
+        self.assertEqual(len(report['results']), 2 * len(cases))
+        self.assertEqual([result['size'] for result in report['results']], [30] * len(cases) + [60] * len(cases))
+        for result in report['results']:
+            self.assertEqual(result['status'], 200, result['params'])
+            self.assertGreater(result['queries'], 0, result['params'])
+            self.assertEqual(result['rows_scanned'] is None, connection.vendor != 'postgresql')
+            self.assertLessEqual({'drf-json', 'json', 'columns'}, set(result['render']))
+
+        BlogView.objects.all().delete()
+        Blog.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('benchmark_analytics', no_seed=True, stdout=io.StringIO(), stderr=io.StringIO())
@@ -0,0 +1,216 @@
+"""
+Space-Saving top-K summaries behind /analytics/top/.
+
+BlogViewTopK keeps one row per UTC day and per viewer country, viewer user
+or blog. Each row holds at most CAPACITY (key, count, error) counters and a
+floor: no key left out of the counters had more than `floor` views that
+day. Summaries are only written by refresh_topk(), which builds complete
+days from BlogViewDaily and moves the 'topk' watermark past them, and by
+refresh_rollups() rebuilding the days of late views; the write path never
+touches them. Until then late views are missing from the summaries just
+as from the daily rollups that the exact path reads, so both agree.
+
+top() merges the days of a window before the 'topk' watermark, and counts
+the views from the watermark on exactly with one aggregation. A key can
+have at most the sum of its counters plus the floors of the days it is
+missing from, plus its views after the watermark. The CANDIDATES keys with
+the highest such bound are counted exactly over the window. The result is
+returned only when the limit-th exact count is higher than the bound of
+every other key, i.e. when it is provably the exact top list. Otherwise it
+returns None and the caller runs the full aggregation.
+"""
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import labels, rollups
+from .api.filters import BlogViewFilter
+from .models import BlogViewDaily, BlogViewTopK
+
+DEFAULTS = {
+    'ENABLED': False,
+    'CAPACITY': 200,          # counters per day and dimension
+    'CANDIDATES': 50,         # keys counted exactly per request
+}
+BATCH_SIZE = 5000
+
+COUNTRY, USER, BLOG = BlogViewTopK.COUNTRY, BlogViewTopK.USER, BlogViewTopK.BLOG
+KEY_FIELDS = {COUNTRY: 'viewer_country_id', USER: 'user_id', BLOG: 'blog_id'}
+WINDOW_FILTERS = {'viewed_at_gte', 'viewed_at_lte'}
+
+
+def topk_settings():
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS_TOPK', {})}
+
+
+class SpaceSaving:
+    """At most `capacity` {key: [count, error]} counters; keys left out have at most `floor` views."""
+    def __init__(self, capacity, counters=None, floor=0):
+        self.capacity = capacity
+        self.counters = counters if counters is not None else {}
+        self.floor = floor
+
+    @classmethod
+    def from_exact(cls, counts, capacity):
+        """The `capacity` largest of exact {key: views} counts."""
+        ranked = sorted(counts.items(), key=lambda item: -item[1])
+        floor = ranked[capacity][1] if len(ranked) > capacity else 0
+        return cls(capacity, {key: [views, 0] for key, views in ranked[:capacity]}, floor)
+
+    @classmethod
+    def from_bytes(cls, data, floor, capacity):
+        triples = np.frombuffer(bytes(data), dtype=np.int64).reshape(-1, 3)
+        return cls(capacity, {key: [count, error] for key, count, error in triples.tolist()}, floor)
+
+    def to_bytes(self):
+        triples = [(key, count, error) for key, (count, error) in self.counters.items()]
+        return np.array(triples, dtype=np.int64).reshape(-1, 3).tobytes()
+
+    def update(self, counts):
+        """Add {key: views}, heaviest first so that the light keys are the ones evicted."""
+        for key, views in sorted(counts.items(), key=lambda item: -item[1]):
+            counter = self.counters.get(key)
+            if counter is not None:
+                counter[0] += views
+                continue
+            if len(self.counters) >= self.capacity:
+                evicted = min(self.counters, key=lambda k: self.counters[k][0])
+                self.floor = max(self.floor, self.counters.pop(evicted)[0])
+            # The key may have had up to `floor` views before
+            self.counters[key] = [self.floor + views, self.floor]
+        return self
+
+
+def rebuild(start, stop):
+    """Replace the summaries of the days in [start, stop) from BlogViewDaily; returns rows written."""
+    capacity = topk_settings()['CAPACITY']
+    BlogViewTopK.objects.filter(bucket__gte=start, bucket__lt=stop).delete()
+    created = 0
+    for dimension, field in KEY_FIELDS.items():
+        rows = BlogViewDaily.objects.filter(bucket__gte=start, bucket__lt=stop, blog__isnull=False)
+        if dimension == USER:
+            rows = rows.filter(user__isnull=False)
+        rows = (
+            rows.values('bucket', k=Coalesce(F(field), Value(labels.NO_COUNTRY)) if dimension == COUNTRY else F(field))
+            .annotate(total=Sum('views'))
+            .values_list('bucket', 'k', 'total')
+            .order_by('bucket')
+        )
+        batch = []
+        for bucket, group in groupby(rows.iterator(chunk_size=BATCH_SIZE), key=itemgetter(0)):
+            summary = SpaceSaving.from_exact({key: total for _, key, total in group}, capacity)
+            batch.append(BlogViewTopK(bucket=bucket, dimension=dimension,
+                                      counters=summary.to_bytes(), floor=summary.floor))
+        created += len(BlogViewTopK.objects.bulk_create(batch, batch_size=BATCH_SIZE))
+    return created
+
+
+def refresh_topk(lookback=timedelta(0), chunk=rollups.DAY):
+    """Rebuild the days rolled up into BlogViewDaily since the 'topk' watermark; returns rows written."""
+    marks = rollups.watermarks()
+    until = marks.get('daily')
+    if until is None:
+        return 0
+    start = marks.get('topk')
+    if start is None:
+        first = BlogViewDaily.objects.aggregate(first=Min('bucket'))['first']
+        if first is None:
+            return 0
+        start = rollups.floor_day(first)
+    start = rollups.floor_day(start - lookback)
+
+    written = 0
+    while start < until:
+        stop = min(start + max(chunk, rollups.DAY), until)
+        with transaction.atomic():
+            written += rebuild(start, stop)
+            rollups.set_watermark('topk', stop)
+        start = stop
+    return written
+
+
+def _key_filter(dimension, keys):
+    """Views of `keys`, or of every key the dimension counts when keys is None."""
+    field = KEY_FIELDS[dimension]
+    if keys is None:
+        return Q() if dimension == COUNTRY else Q(**{f'{field[:-3]}__isnull': False})
+    if dimension == COUNTRY and labels.NO_COUNTRY in keys:
+        return Q(**{f'{field}__in': keys}) | Q(**{f'{field[:-3]}__isnull': True})
+    return Q(**{f'{field}__in': keys})
+
+
+def top(params, dimension, group, start=None, end=None, limit=10):
+    """
+    rollups.aggregate() of the `limit` most viewed keys of `dimension`,
+    exact, from the summaries plus one aggregation over the candidates.
+    Returns None when disabled, when `params` filter on anything but the
+    window, when no day of the window is summarized yet, or when the
+    summaries cannot prove the result.
+    """
+    conf = topk_settings()
+    if not conf['ENABLED'] or set(BlogViewFilter(params).values()) - WINDOW_FILTERS:
+        return None
+    start, end = rollups.window(params, start, end)
+    # Only the days refresh_topk() has rebuilt are complete; the rest is counted exactly
+    mark = rollups.watermarks().get('topk')
+    if mark is None or (start is not None and start >= mark):
+        return None
+
+    summaries = BlogViewTopK.objects.filter(dimension=dimension, bucket__lt=mark)
+    if start is not None:
+        summaries = summaries.filter(bucket__gte=rollups.floor_day(start))
+    if end is not None:
+        summaries = summaries.filter(bucket__lte=end)
+    parts, floors, total_floor = [], [], 0
+    for floor, data in summaries.values_list('floor', 'counters').iterator(chunk_size=BATCH_SIZE):
+        triples = np.frombuffer(bytes(data), dtype=np.int64).reshape(-1, 3)
+        parts.append(triples[:, :2])
+        floors.append(np.full(len(triples), floor, dtype=np.int64))
+        total_floor += floor
+
+    keys = np.empty(0, dtype=np.int64)
+    bounds = np.empty(0, dtype=np.int64)
+    if parts:
+        counts, floors = np.concatenate(parts), np.concatenate(floors)
+        keys, inverse = np.unique(counts[:, 0], return_inverse=True)
+        # Counted where present, the day's floor where missing
+        bounds = (np.bincount(inverse, weights=counts[:, 1], minlength=len(keys))
+                  - np.bincount(inverse, weights=floors, minlength=len(keys))
+                  + total_floor).astype(np.int64)
+    if end is None or end >= mark:
+        tail = rollups.aggregate(params, group=group, start=mark, end=end,
+                                 filters=[_key_filter(dimension, None)], distinct=False)
+        tail_keys = np.array([row['x'] for row in tail], dtype=np.int64)
+        tail_counts = np.array([row['z'] for row in tail], dtype=np.int64)
+        merged = np.union1d(keys, tail_keys)
+        merged_bounds = np.full(len(merged), total_floor, dtype=np.int64)
+        merged_bounds[np.searchsorted(merged, keys)] = bounds
+        merged_bounds[np.searchsorted(merged, tail_keys)] += tail_counts
+        keys, bounds = merged, merged_bounds
+    order = np.argsort(-bounds, kind='stable')
+    candidates, others = order[:conf['CANDIDATES']], order[conf['CANDIDATES']:]
+    bound = max(int(bounds[others].max()) if len(others) else 0, total_floor)
+    if not len(candidates):
+        return [] if bound == 0 else None  # no views in the window at all
+    if bound and (len(candidates) < limit or bounds[candidates[limit - 1]] <= bound):
+        return None  # even the candidates' upper bounds cannot beat the other keys
+
+    rows = rollups.aggregate(
+        params,
+        group=group,
+        start=start,
+        end=end,
+        filters=[_key_filter(dimension, keys[candidates].tolist())],
+        distinct=dimension != BLOG,
+        limit=limit,
+    )
+    # Every other key has at most `bound` views in the window
+    if bound == 0 or (len(rows) == limit and rows[-1]['z'] > bound):
+        return rows
+    return None
@@ -0,0 +1,71 @@
+"""
+Gunicorn settings of the deployment (render.yaml):
+
+    gunicorn -c python:project_config.gunicorn_conf project_config.asgi:application
+
+Workers are Uvicorn workers by default, for the async analytics views;
+GUNICORN_WORKER_CLASS=gthread with project_config.wsgi:application runs
+GUNICORN_THREADS threads per sync worker instead. The app is preloaded and
+warmed up (project_config/startup.py) in the master, and workers are
+recycled after about GUNICORN_MAX_REQUESTS requests, jittered so they do
+not all restart at once. Every setting can be overridden from the
+environment; see `python manage.py benchmark_startup` for the cost of a
+worker's start.
+"""
+import os
+
+# Gunicorn reads every module-level name as a setting, and `config` is one of them
+import decouple
+
+
+def cpu_count():
+    """CPUs this container may use: its cgroup CPU quota when there is one, else the visible CPUs."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(int(quota) // int(period), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+bind = f"0.0.0.0:{decouple.config('PORT', default=8000, cast=int)}"
+worker_class = decouple.config('GUNICORN_WORKER_CLASS', default='uvicorn_worker.UvicornWorker')
+# Each worker keeps its own columnar store, label and response caches, so cap the count
+workers = decouple.config('WEB_CONCURRENCY', cast=int, default=min(
+    2 * cpu_count() + 1, decouple.config('GUNICORN_MAX_WORKERS', default=8, cast=int)))
+threads = decouple.config('GUNICORN_THREADS', default=4, cast=int)  # gthread workers only
+preload_app = decouple.config('GUNICORN_PRELOAD', default=True, cast=bool)
+# A recycled worker's replacement reloads the columnar store (analytics/columnar.py) from scratch
+max_requests = decouple.config('GUNICORN_MAX_REQUESTS', default=1000, cast=int)
+max_requests_jitter = decouple.config('GUNICORN_MAX_REQUESTS_JITTER', default=100, cast=int)
+timeout = decouple.config('GUNICORN_TIMEOUT', default=30, cast=int)
+graceful_timeout = decouple.config('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+keepalive = decouple.config('GUNICORN_KEEPALIVE', default=5, cast=int)
+# Heartbeat files on tmpfs: a disk-backed /tmp can stall workers into timeouts
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def when_ready(server):
+    # Master, after the preloaded app was imported and before the workers fork
+    if server.cfg.preload_app:
+        from project_config.startup import warm_up
+        warm_up()
+        check_cache(server)
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        from project_config.startup import warm_up
+        warm_up()
+        check_cache(worker)
+
+
+def check_cache(arbiter):
+    from analytics.api.cache import is_shared
+    if arbiter.cfg.workers > 1 and not is_shared():
+        arbiter.log.warning("The analytics cache is per-process locmem: with %d workers, late rows and blog "
+                            "changes only invalidate the responses cached by the worker that saw them. "
+                            "Set ANALYTICS_CACHE_BACKEND to a shared cache.", arbiter.cfg.workers)
@@ -0,0 +1,61 @@
+"""
+The OpenAPI schema, generated once at build time.
+
+`manage.py build_schema` writes schema.yaml and schema.json to
+OPENAPI_SCHEMA_DIR. SchemaView answers /api/schema/ with those bytes
+instead of walking every view on each request; without the files (local
+development) or for ?lang= and ?version= variants it generates the schema
+like SpectacularAPIView.
+"""
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView
+
+RENDERERS = [OpenApiYamlRenderer, OpenApiJsonRenderer]
+
+
+def schema_path(fmt):
+    return Path(settings.BASE_DIR, settings.OPENAPI_SCHEMA_DIR, f'schema.{fmt}')
+
+
+@lru_cache(maxsize=None)
+def _read(path):
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def prebuilt(fmt):
+    """The schema file written at build time for `fmt` ('yaml' or 'json'), None if there is none."""
+    return _read(schema_path(fmt))
+
+
+def write_schema(schema):
+    """Write `schema` in every format; returns the paths written."""
+    paths = []
+    for renderer in RENDERERS:
+        path = schema_path(renderer.format)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(renderer().render(schema, renderer_context={}))
+        _read.cache_clear()
+        paths.append(path)
+    return paths
+
+
+class SchemaView(SpectacularAPIView):
+    def _get_schema_response(self, request):
+        renderer, media_type = self.perform_content_negotiation(request, force=True)
+        content = None if request.GET.get('lang') or request.GET.get('version') else prebuilt(renderer.format)
+        if content is None:
+            return super()._get_schema_response(request)
+        if renderer.charset:
+            media_type = f'{media_type}; charset={renderer.charset}'
+        filename = f'{spectacular_settings.TITLE or "schema"}.{renderer.format}'
+        return HttpResponse(content, content_type=media_type,
+                            headers={'Content-Disposition': f'inline; filename="{filename}"'})
@@ -1,6 +1,5 @@
 from .base import *
 from decouple import config
-import dj_database_url
 
 # Production overrides
 DEBUG = False
@@ -8,10 +7,12 @@ ALLOWED_HOSTS = ['blog-analysis.onrender.com']
 
 # Production database (Neon)
 DATABASES = {
-    'default': dj_database_url.config(
-        default=config('DATABASE_URL'),  # Neon connection string
+    'default': database_config(
+        config('DATABASE_URL'),  # Neon connection string
         conn_max_age=600,
         ssl_require=True
     )
 }
+if ANALYTICS_REPLICA_URL:
+    DATABASES['replica'] = database_config(ANALYTICS_REPLICA_URL, conn_max_age=600, ssl_require=True)
 
@@ -0,0 +1,22 @@
+"""
+Work a worker process would otherwise do on its first request.
+
+warm_up() imports the URLconf, and with it every view, DRF,
+drf-spectacular and NumPy, resolves the reverse URL map and reads the
+prebuilt OpenAPI schema. With preload_app (project_config/gunicorn_conf.py)
+the gunicorn master calls it once before forking, so every worker starts
+with all of it in copy-on-write memory; otherwise each worker calls it as
+it boots, before accepting requests. Nothing here touches the database:
+connections must not be shared across a fork.
+"""
+from django.urls import get_resolver
+
+from . import schema
+
+
+def warm_up():
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+    for renderer in schema.RENDERERS:
+        schema.prebuilt(renderer.format)